@@ -1,11 +1,27 @@
 import os
+import re
 import json
 import argparse
 import sys
 import random
+import zlib
+import socket
 from datetime import datetime
 from typing import Optional
-from tracking_audit import Audit, DEFAULT_AUDIT_NAME, current_location
+from tracking_audit import (
+    DEFAULT_AUDIT_NAME,
+    OUTPUT_DIR,
+    HOST_COOLDOWN_SECONDS,
+    RETRY_MAX_ATTEMPTS,
+    BROWSER_RECYCLE_VISITS,
+    BROWSER_RECYCLE_RSS_MB,
+    LIVENESS_CACHE_FILENAME,
+    LIVENESS_TTL_SECONDS,
+    INSTRUMENT_PRESETS,
+    DEFAULT_INSTRUMENT_PRESET,
+    PREFLIGHT_SKIP,
+    PREFLIGHT_DEFER,
+)
 
 ## Constants (mostly default args)
 # number of browsers per treatment condition
@@ -50,6 +66,26 @@ def parse_args() -> dict:
         default=False,
         help="Should it extract and store the html documents of the pages visited?",
     )
+    # resources to save
+    parser.add_argument(
+        "-sc",
+        "--save-content",
+        dest="resources_to_save",
+        nargs="?",
+        type=str,
+        default=None,
+        help="Comma-separated resource types whose response bodies should be saved, e.g. 'script,sub_frame'",
+    )
+    # shared content store
+    parser.add_argument(
+        "-cs",
+        "--content-store",
+        dest="content_store",
+        nargs="?",
+        type=str,
+        default=None,
+        help="Directory of a content-addressed store shared by all audits, where saved response bodies are stored once. Defaults to a LevelDB per audit.",
+    )
     # location flag
     parser.add_argument(
         "-l",
@@ -79,9 +115,9 @@ def parse_args() -> dict:
         "-b",
         "--browser-n",
         dest="browser_n",
-        type=int,
+        type=lambda v: v if v == "auto" else int(v),
         default=BROWSER_N,
-        help="Number of browsers to use",
+        help="Number of browsers to use, or 'auto' to run as many as the memory and cpus of this machine allow",
     )
     # max_cookies
     parser.add_argument(
@@ -123,6 +159,136 @@ def parse_args() -> dict:
         default=RANDOM_SEED,
         help="Random state seed integer to use while sampling.",
     )
+    # host cooldown
+    parser.add_argument(
+        "-hc",
+        "--host-cooldown",
+        dest="host_cooldown",
+        type=float,
+        default=HOST_COOLDOWN_SECONDS,
+        help="Seconds between the end of a visit and the next visit to the same registered domain.",
+    )
+    # host cooldown per ip
+    parser.add_argument(
+        "-ip",
+        "--cooldown-per-ip",
+        dest="cooldown_per_ip",
+        action="store_true",
+        default=False,
+        help="Also apply the host cooldown per ip address, e.g. for websites sharing a hosting provider?",
+    )
+    # shared work queue
+    parser.add_argument(
+        "-q",
+        "--work-queue",
+        dest="work_queue",
+        nargs="?",
+        type=str,
+        default=None,
+        help="Path to a sqlite work queue shared by several crawler processes/machines (e.g. in the shared output folder). The websites are leased from it, so each process only visits its share. All the processes must use the same trial name and run id.",
+    )
+    # worker id
+    parser.add_argument(
+        "-w",
+        "--worker-id",
+        dest="worker_id",
+        nargs="?",
+        type=str,
+        default=None,
+        help="Unique name of this crawler process in the work queue, defaults to the hostname. Added to the audit name.",
+    )
+    # restart browsers between active windows
+    parser.add_argument(
+        "-rb",
+        "--restart-browsers",
+        dest="restart_browsers",
+        action="store_true",
+        default=False,
+        help="Shut the browsers down outside of the active hours and start them again when the next active window opens?",
+    )
+    # run id
+    parser.add_argument(
+        "-id",
+        "--run-id",
+        dest="run_id",
+        nargs="?",
+        type=str,
+        default=None,
+        help="Stable identifier of the run, used instead of the timestamp suffix. Re-running with the same id resumes the audit. If missing, the latest unfinished audit with the same name is resumed.",
+    )
+    # pre-crawl liveness probe
+    parser.add_argument(
+        "-pf",
+        "--preflight",
+        dest="preflight",
+        nargs="?",
+        choices=[PREFLIGHT_SKIP, PREFLIGHT_DEFER],
+        const=PREFLIGHT_DEFER,
+        default=None,
+        help="Probe DNS, TCP and HTTP for all the websites before launching the browsers, and skip the unreachable ones or defer them to the end (default).",
+    )
+    # liveness cache ttl
+    parser.add_argument(
+        "-pt",
+        "--preflight-ttl",
+        dest="preflight_ttl",
+        type=float,
+        default=LIVENESS_TTL_SECONDS,
+        help=f"Seconds the probe results are reused for, cached in {os.path.join('output', LIVENESS_CACHE_FILENAME)}.",
+    )
+    # history of previous audits for the adaptive timeouts
+    parser.add_argument(
+        "-th",
+        "--timeout-history",
+        dest="timeout_history",
+        nargs="+",
+        default=None,
+        help="Output directories or databases of previous audits (or a warehouse) to learn per-site page load timeouts from, instead of the fixed GET_REQUEST_TIMEOUT.",
+    )
+    # shared stats file for the adaptive timeouts
+    parser.add_argument(
+        "-ts",
+        "--timeout-stats",
+        dest="timeout_stats",
+        type=str,
+        default=None,
+        help="Json file with the page loads of each site, used for the adaptive timeouts and updated with the visits of this audit.",
+    )
+    # retries of the failed visits
+    parser.add_argument(
+        "-ma",
+        "--max-attempts",
+        dest="max_attempts",
+        type=int,
+        default=RETRY_MAX_ATTEMPTS,
+        help="Visits of a site at most. Timeouts, network errors, browser crashes and 5xx pages are visited again at the end of the crawl, with an exponential backoff. 1 to never retry.",
+    )
+    # browser recycling
+    parser.add_argument(
+        "-rv",
+        "--recycle-visits",
+        dest="recycle_visits",
+        type=int,
+        default=BROWSER_RECYCLE_VISITS,
+        help="Restart a browser between two visits after this many visits, 0 to never.",
+    )
+    parser.add_argument(
+        "-rm",
+        "--recycle-memory",
+        dest="recycle_rss_mb",
+        type=float,
+        default=BROWSER_RECYCLE_RSS_MB,
+        help="Restart a browser between two visits once its processes use more than this many MB, 0 to never.",
+    )
+    # OpenWPM instruments
+    parser.add_argument(
+        "-in",
+        "--instruments",
+        dest="instruments",
+        choices=list(INSTRUMENT_PRESETS),
+        default=DEFAULT_INSTRUMENT_PRESET,
+        help="Preset of OpenWPM instruments to turn on. 'full' records everything, 'cookies-and-requests' drops the costly js, callstack and dns instruments, 'cookies-only' just records the cookies.",
+    )
     args_pprint = "\n".join(
         [f"{k} ---> {v}" for k, v in vars(parser.parse_args([])).items()]
     )
@@ -133,10 +299,39 @@ def parse_args() -> dict:
     return vars(args)
 
 
+def make_audit_name(
+    trial_name: str, location: Optional[str] = None, run_id: Optional[str] = None
+) -> str:
+    """
+    Make a stable audit name: trial_name + location (where applicable) + run id.
+    Without a run id, resume the latest unfinished audit with the same prefix or add a new YYYYMMDDHHMM time stamp (for replications)
+    """
+    audit_name = trial_name
+    if location:
+        audit_name = "_".join([audit_name, location])
+    if run_id:
+        return "_".join([audit_name, run_id])
+    # look for unfinished audits with the same prefix, i.e. without the crawl_done.txt status file
+    unfinished = []
+    if os.path.isdir(OUTPUT_DIR):
+        pattern = re.compile(re.escape(audit_name) + r"_\d{12}$")
+        for d in os.listdir(OUTPUT_DIR):
+            if pattern.match(d) and not os.path.isfile(
+                os.path.join(OUTPUT_DIR, d, "crawl_done.txt")
+            ):
+                unfinished.append(d)
+    if unfinished:
+        # time stamps sort lexicographically
+        resumed = sorted(unfinished)[-1]
+        print(f"[+] Resuming the unfinished audit {resumed}")
+        return resumed
+    return "_".join([audit_name, datetime.now().strftime("%Y%m%d%H%M")])
+
+
 ## crawler
 def crawl(
     websites_n: Optional[int] = WEBSITES_N,
-    browser_n: int = BROWSER_N,
+    browser_n: int or str = BROWSER_N,
     headless: bool = HEADLESS,
     location: str or None = None,
     trial_name: str = "test_crawl",
@@ -144,26 +339,54 @@ def crawl(
     random_seed: Optional[int] = None,
     store_screenshots: bool = False,
     store_source: bool = False,
+    run_id: Optional[str] = None,
+    restart_browsers: bool = False,
+    host_cooldown: float = HOST_COOLDOWN_SECONDS,
+    cooldown_per_ip: bool = False,
+    work_queue: Optional[str] = None,
+    worker_id: Optional[str] = None,
+    resources_to_save: Optional[str] = None,
+    content_store: Optional[str] = None,
+    preflight: Optional[str] = None,
+    preflight_ttl: float = LIVENESS_TTL_SECONDS,
+    timeout_history: Optional[list] = None,
+    timeout_stats: Optional[str] = None,
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    recycle_visits: int = BROWSER_RECYCLE_VISITS,
+    recycle_rss_mb: float = BROWSER_RECYCLE_RSS_MB,
+    instruments: str = DEFAULT_INSTRUMENT_PRESET,
     **kwargs,
 ) -> None:
     """
     Run a crawler using openwpm
         websites_n: int or None; number of websites to crawl;
-        browser_n: int; number of crawlers to visit the websites in parallel, set to 1 unless if focusing on tracking
+        browser_n: int or str; number of crawlers to visit the websites in parallel, set to 1 unless if focusing on tracking. "auto" picks it from the memory and cpus available
         location: str; expressvpn alias. Check VPNHandler.get_aliases().
         trial_name: str; prefix to the directory/db of the crawl session, e.g. "pilot 2"
         max_cookies: int or None: stop after collect n cookies (a type of control)
         random_seed: it or None: random seed to use in sampling the websites if websites_n != None
         store_screenshots: bool: take a screenshot of the page visited
         store_source: bool: store source page of the page visited
+        run_id: str or None: stable identifier of the run, re-using it resumes an unfinished audit
+        restart_browsers: bool: shut the browsers down outside of the active hours
+        host_cooldown: float: seconds between visits to the same registered domain
+        cooldown_per_ip: bool: also apply the host cooldown per ip address
+        work_queue: str or None: path to a sqlite work queue shared with other crawler processes
+        worker_id: str or None: name of this crawler process in the work queue, defaults to the hostname
+        resources_to_save: str or None: comma-separated resource types whose response bodies are saved
+        content_store: str or None: directory of a content-addressed store shared by all audits for the saved bodies
+        preflight: str or None: "skip" or "defer" the websites unreachable before the crawl, no probe if None
+        preflight_ttl: float: seconds the probe results are cached for
+        timeout_history: list or None: previous audits to learn per-site page load timeouts from
+        timeout_stats: str or None: json file with the page loads of each site, read and updated
+        max_attempts: int: visits of a site at most, failed visits worth it are retried at the end of the crawl
+        recycle_visits: int: restart a browser between two visits after this many visits, never if 0
+        recycle_rss_mb: float: restart a browser between two visits once it uses more memory (MB), never if 0
+        instruments: str: preset of OpenWPM instruments to turn on, see INSTRUMENT_PRESETS
     """
     ## prepare the name of the crawl audit used for the directory/db
-    # the audit name will be trial_name + location (where applicable) + treatment + YYYYMMDDHH (for replications)
-    # Make the audit name and add a time stamp following (_YYYYMMDDHHMM) for replications
-    audit_name = trial_name
-    if location:
-        audit_name = "_".join([audit_name, location])
-    audit_name = "_".join([audit_name, datetime.now().strftime("%Y%m%d%H%M")])
+    # the audit name will be trial_name + location (where applicable) + run id or YYYYMMDDHHMM (for replications)
+    audit_name = make_audit_name(trial_name=trial_name, location=location, run_id=run_id)
     ## read the websites
     with open(WEBSITES_PATH, "r", encoding="utf-8") as f:
         websites = json.load(f)
@@ -171,9 +394,9 @@ def crawl(
     websites = [w.get("url") for _, w in websites.items()]
     # if user defined websites_n sample, else take all
     if websites_n:
-        # if missing, generate the random seed
+        # if missing, derive the random seed from the audit name so that a resumed run samples the same websites
         if not random_seed:
-            random_seed = random.randint(1, (2**32 - 1))  # random seed limit
+            random_seed = zlib.crc32(audit_name.encode("utf-8")) or 1
         random.seed(int(random_seed))
         websites = random.sample(websites, int(websites_n))
     else:
@@ -181,15 +404,58 @@ def crawl(
         random_seed = random_seed or 1234
         random.seed(int(random_seed))
         random.shuffle(websites)
+    # probe the websites before launching any browser, dead ones would each cost a full page load timeout
+    preflight_summary = None
+    if preflight:
+        from tracking_audit.liveness import probe_sites, order_by_liveness, summarize
 
+        results = probe_sites(
+            websites,
+            cache_path=os.path.join(OUTPUT_DIR, LIVENESS_CACHE_FILENAME),
+            ttl=preflight_ttl,
+        )
+        websites = order_by_liveness(websites, results, mode=preflight)
+        preflight_summary = {"mode": preflight, **summarize(results)}
+        print(
+            f"[+] Preflight: {preflight_summary['unreachable']} of {preflight_summary['sites']} websites unreachable "
+            f"({'skipped' if preflight == PREFLIGHT_SKIP else 'deferred to the end'})"
+        )
+    # with a shared work queue, each worker writes its own audit db
+    if work_queue:
+        worker_id = worker_id or socket.gethostname()
+        audit_name = "_".join([audit_name, worker_id])
+
+    # as many browsers as fit in the memory, measured for a browser in the previous audits
+    browser_n_auto = browser_n == "auto"
+    if browser_n_auto:
+        from tracking_audit.browser_pool import auto_browser_n
+
+        browser_n = auto_browser_n()
+        print(f"[+] Running {browser_n} browsers")
     ## Run the crawler
+    # OpenWPM, pandas and the rest of the crawler are only loaded once there is something to crawl
+    from tracking_audit import Audit, current_location
+
     # create an audit instance
     audit = Audit(
         websites=websites,
         headless = headless,
         audit_name=audit_name,
         browser_n=browser_n,
-        max_cookies=max_cookies
+        max_cookies=max_cookies,
+        host_cooldown=host_cooldown,
+        cooldown_per_ip=cooldown_per_ip,
+        work_queue=work_queue,
+        worker_id=worker_id,
+        resources_to_save=resources_to_save,
+        content_store=content_store,
+        timeout_history=timeout_history,
+        timeout_stats=timeout_stats,
+        max_attempts=max_attempts,
+        path_to_seed_profile=kwargs.get("path_to_seed_profile"),
+        recycle_visits=recycle_visits or None,
+        recycle_rss_mb=recycle_rss_mb or None,
+        instruments=instruments,
     )
     # create the status file if missing
     status_file = os.path.join(audit.parent_output_dir, "crawl_done.txt")
@@ -198,7 +464,9 @@ def crawl(
         start = datetime.now().strftime("%Y%m%d%H%M")
         # crawl
         audit.crawl_audit(
-            take_screenshot=store_screenshots, fetch_source_code=store_source
+            take_screenshot=store_screenshots,
+            fetch_source_code=store_source,
+            restart_browsers_between_windows=restart_browsers,
         )
         end = datetime.now().strftime("%Y%m%d%H%M")
         with open(status_file, "w") as fp:
@@ -210,6 +478,7 @@ def crawl(
             "audit_name": audit_name,
             "websites_n": websites_n,
             "browser_n": browser_n,
+            "browser_n_auto": browser_n_auto,
             "location": location,
             "seed_profile_used": kwargs.get("path_to_seed_profile")
             if "path_to_seed_profile" in kwargs
@@ -219,6 +488,27 @@ def crawl(
             "started_at": start,
             "ended_at": end,
             "random_seed": random_seed,
+            "run_id": run_id,
+            "host_cooldown": host_cooldown,
+            "cooldown_per_ip": cooldown_per_ip,
+            "work_queue": work_queue,
+            "worker_id": worker_id,
+            "resources_to_save": resources_to_save,
+            "content_store": content_store,
+            "preflight": preflight_summary,
+            "timeout_history": timeout_history,
+            "timeout_stats": timeout_stats,
+            "max_attempts": max_attempts,
+            "instruments": instruments,
+            # seed profile cache lookup and the launch of the browsers of each TaskManager session
+            "startup_timings": audit.startup_timings,
+            # memory of the browsers, restarts between visits and pool size changes under memory pressure
+            "browser_pool": audit.pool.summary(),
+            # wall-clock time spent waiting for the active window
+            "window_pauses": audit.window_pauses,
+            "window_paused_seconds": sum(p["seconds"] for p in audit.window_pauses),
+            # throughput, latency and failure aggregates, per visit timings are in metrics.jsonl
+            "crawl_metrics": audit.metrics.summary() if audit.metrics else None,
             "ran_from_location": current_location(),
         }
         # run the sanity check and add the results to the crawl config
@@ -0,0 +1,130 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+PARENT_DIR = Path().resolve()
+# where the results are written
+BENCHMARK_OUTPUT_DIR = "./output/benchmark_import_time"
+# commands timed, all of them start a fresh interpreter
+COMMANDS = {
+    "import tracking_audit": [sys.executable, "-c", "import tracking_audit"],
+    "import tracking_audit.audit": [sys.executable, "-c", "import tracking_audit.audit"],
+    "run_audits.py --help": [sys.executable, str(PARENT_DIR / "run_audits.py"), "--help"],
+}
+# heavy modules that must not be loaded by importing the package
+HEAVY_MODULES = ("openwpm", "selenium", "pandas", "numpy", "requests", "tldextract", "psutil", "pyarrow")
+# "import time: self [us] | cumulative | imported package" lines written by python -X importtime
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="benchmark_import_time",
+        description="Time the import of the tracking_audit package and the startup of the CLI, check that no heavy dependency is loaded and no directory is created at import.",
+    )
+    parser.add_argument(
+        "-r",
+        "--runs",
+        dest="runs",
+        type=int,
+        default=10,
+        help="Runs of each command, the median is reported",
+    )
+    parser.add_argument(
+        "-t",
+        "--top",
+        dest="top",
+        type=int,
+        default=10,
+        help="Slowest top-level imports listed for each command",
+    )
+    return vars(parser.parse_args())
+
+
+def _env() -> dict:
+    """Environment of the timed interpreters: the package importable from anywhere and no bytecode written"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (str(PARENT_DIR), env.get("PYTHONPATH")) if p)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def import_times(command: list, cwd: str) -> list:
+    """(cumulative ms, module) of the top-level imports of a command, from python -X importtime"""
+    result = subprocess.run(
+        [command[0], "-X", "importtime", *command[1:]], cwd=cwd, env=_env(), capture_output=True, text=True
+    )
+    out = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # only the imports made directly by the command, the nested ones are part of their cumulative time
+        if match and len(match.group(3)) == 1:
+            out.append((int(match.group(2)) / 1000, match.group(4)))
+    return sorted(out, reverse=True)
+
+
+def wall_ms(command: list, cwd: str, runs: int) -> list:
+    """Wall-clock milliseconds of each run of a command"""
+    out = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, env=_env(), stdout=subprocess.DEVNULL, check=True)
+        out.append((time.perf_counter() - start) * 1000)
+    return out
+
+
+def loaded_heavy_modules(cwd: str) -> list:
+    """Heavy modules in sys.modules after importing the package"""
+    code = f"import sys, tracking_audit; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=_env(), capture_output=True, text=True)
+    return result.stdout.split()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = {}
+    # the commands run from an empty directory, so that anything created at import shows up
+    with tempfile.TemporaryDirectory() as cwd:
+        # a bare interpreter, the floor of any command
+        baseline = statistics.median(wall_ms([sys.executable, "-c", "pass"], cwd, args["runs"]))
+        print(f"[+] Bare interpreter: {baseline:.0f}ms")
+        for name, command in COMMANDS.items():
+            runs = wall_ms(command, cwd, args["runs"])
+            results[name] = {
+                "median_ms": round(statistics.median(runs), 1),
+                "over_bare_interpreter_ms": round(statistics.median(runs) - baseline, 1),
+                "top_imports_ms": [[round(ms, 1), module] for ms, module in import_times(command, cwd)[: args["top"]]],
+            }
+            print(f"[+] {name}: {results[name]['median_ms']:.0f}ms ({results[name]['over_bare_interpreter_ms']:+.0f}ms)")
+            for ms, module in results[name]["top_imports_ms"]:
+                print(f"      {ms:>8.1f}ms  {module}")
+        heavy = loaded_heavy_modules(cwd)
+        created = sorted(os.listdir(cwd))
+
+    if heavy:
+        print(f"[!] Heavy modules loaded by importing tracking_audit: {', '.join(heavy)}")
+    if created:
+        print(f"[!] Files created at import: {', '.join(created)}")
+    os.makedirs(BENCHMARK_OUTPUT_DIR, exist_ok=True)
+    results_path = os.path.join(BENCHMARK_OUTPUT_DIR, f"results_{datetime.now().strftime('%Y%m%d%H%M')}.json")
+    with open(results_path, "w") as f:
+        json.dump(
+            {
+                "python": sys.version.split()[0],
+                "bare_interpreter_ms": round(baseline, 1),
+                "commands": results,
+                "heavy_modules_loaded": heavy,
+                "files_created_at_import": created,
+            },
+            f,
+            indent=4,
+        )
+    print(f"[+] Results written to {results_path}")
@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import resource
+from datetime import datetime
+from pathlib import Path
+
+PARENT_DIR = Path().resolve()
+sys.path.insert(0, str(PARENT_DIR))
+from tracking_audit import Audit, INSTRUMENT_PRESETS
+from tracking_audit.metrics import _percentile
+
+# path to the websites
+WEBSITES_PATH = "./resources/governmental_websites/governmental_websites.json"
+# where the benchmark audits are written, apart from the real ones
+BENCHMARK_OUTPUT_DIR = "./output/benchmark_instrument_presets"
+# tables written by each instrument, counted per site
+INSTRUMENT_TABLES = {
+    "http_instrument": ("http_requests", "http_responses", "http_redirects"),
+    "cookie_instrument": ("javascript_cookies",),
+    "navigation_instrument": ("navigations",),
+    "js_instrument": ("javascript",),
+    "callstack_instrument": ("callstacks",),
+    "dns_instrument": ("dns_responses",),
+}
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="benchmark_instrument_presets",
+        description="Crawl the same websites with each preset of OpenWPM instruments and compare the page load latency, cpu time and database bytes per site.",
+    )
+    parser.add_argument(
+        "-n",
+        "--n-websites",
+        dest="websites_n",
+        type=int,
+        default=20,
+        help="Number of websites sampled from the governmental websites dataset",
+    )
+    parser.add_argument(
+        "-r",
+        "--rounds",
+        dest="rounds",
+        type=int,
+        default=1,
+        help="Crawls of each preset, the order of the presets is rotated between rounds",
+    )
+    parser.add_argument(
+        "-p",
+        "--presets",
+        dest="presets",
+        nargs="+",
+        choices=list(INSTRUMENT_PRESETS),
+        default=list(INSTRUMENT_PRESETS),
+        help="Presets to compare",
+    )
+    parser.add_argument(
+        "-d",
+        "--dwell",
+        dest="dwell",
+        type=float,
+        default=2,
+        help="Seconds a page stays open after loading, the same for all the visits",
+    )
+    parser.add_argument(
+        "-rs",
+        "--random-seed",
+        dest="random_seed",
+        type=int,
+        default=1234,
+        help="Random seed used to sample the websites",
+    )
+    parser.add_argument(
+        "-native",
+        dest="native",
+        action="store_true",
+        default=False,
+        help="Show the browser instead of running headless?",
+    )
+    return vars(parser.parse_args())
+
+
+def cpu_seconds() -> float:
+    """User and system cpu time of this process and its waited-for children (the browsers once closed)"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def db_bytes(db_path: Path) -> int:
+    """Size of the OpenWPM database, its write-ahead log included"""
+    return sum(
+        os.path.getsize(p)
+        for p in (str(db_path), f"{db_path}-wal")
+        if os.path.isfile(p)
+    )
+
+
+def table_rows(db_path: Path) -> dict:
+    """Rows of the tables of each instrument, table -> rows"""
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        existing = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+        return {
+            table: con.execute(f"SELECT count(*) FROM {table};").fetchone()[0]
+            for tables in INSTRUMENT_TABLES.values()
+            for table in tables
+            if table in existing
+        }
+    finally:
+        con.close()
+
+
+def run_preset(preset: str, websites: list, audit_name: str, dwell: float, headless: bool) -> dict:
+    """Crawl the websites with a preset, returns the raw measurements of the run"""
+    audit = Audit(
+        websites=list(websites),
+        headless=headless,
+        audit_name=audit_name,
+        output_dir=BENCHMARK_OUTPUT_DIR,
+        instruments=preset,
+        dwell_range=(dwell, dwell),
+        # the failed visits are not visited again, every preset gets a single visit per site
+        max_attempts=1,
+        recycle_visits=None,
+        recycle_rss_mb=None,
+        host_cooldown=0,
+        # a benchmark runs at any time of the day
+        active_hours=(0, 23),
+    )
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    audit.crawl_audit()
+    wall_seconds = time.perf_counter() - start
+    cpu = cpu_seconds() - cpu_start
+    with open(audit.metrics.visits_path, "r") as f:
+        visits = [json.loads(line) for line in f]
+    return {
+        "preset": preset,
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu,
+        "visits": visits,
+        "db_bytes": db_bytes(audit.output_db),
+        "table_rows": table_rows(audit.output_db),
+    }
+
+
+def summarize(runs: list) -> dict:
+    """Latency, cpu and database bytes per site of a preset, over its rounds"""
+    visits = [v for run in runs for v in run["visits"]]
+    sites = max(len(visits), 1)
+    # page loads of the GetCommands, from crawl_history
+    get_seconds = [v["get_seconds"] for v in visits if v["success"] and v["get_seconds"] is not None]
+    rows = {}
+    for run in runs:
+        for table, n in run["table_rows"].items():
+            rows[table] = rows.get(table, 0) + n
+    return {
+        "sites": len(visits),
+        "failed_sites": sum(not v["success"] for v in visits),
+        "get_seconds_p50": _percentile(get_seconds, 50),
+        "get_seconds_p95": _percentile(get_seconds, 95),
+        "cpu_seconds_per_site": round(sum(r["cpu_seconds"] for r in runs) / sites, 3),
+        "db_bytes_per_site": round(sum(r["db_bytes"] for r in runs) / sites),
+        "rows_per_site": {table: round(n / sites, 1) for table, n in sorted(rows.items())},
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with open(WEBSITES_PATH, "r", encoding="utf-8") as f:
+        websites = [w.get("url") for _, w in json.load(f).items()]
+    random.seed(args["random_seed"])
+    websites = random.sample(websites, min(args["websites_n"], len(websites)))
+    print(f"[+] {len(websites)} websites, presets: {', '.join(args['presets'])}")
+
+    os.makedirs(BENCHMARK_OUTPUT_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d%H%M")
+    presets = list(args["presets"])
+    runs = {preset: [] for preset in presets}
+    for r in range(args["rounds"]):
+        # rotate the order, so that no preset always crawls the websites first (cold dns and server caches)
+        order = presets[r % len(presets) :] + presets[: r % len(presets)]
+        for preset in order:
+            print(f"[+] Round {r + 1}: crawling with the '{preset}' instruments")
+            runs[preset].append(
+                run_preset(
+                    preset,
+                    websites,
+                    audit_name=f"benchmark_{preset}_{stamp}_r{r}",
+                    dwell=args["dwell"],
+                    headless=not args["native"],
+                )
+            )
+
+    results = {preset: summarize(preset_runs) for preset, preset_runs in runs.items()}
+    print(f"\n{'preset':<22}{'p50 load (s)':>14}{'p95 load (s)':>14}{'cpu/site (s)':>14}{'db/site (KB)':>14}")
+    for preset, summary in results.items():
+        p50, p95 = summary["get_seconds_p50"], summary["get_seconds_p95"]
+        print(
+            f"{preset:<22}"
+            f"{p50 if p50 is not None else float('nan'):>14.2f}"
+            f"{p95 if p95 is not None else float('nan'):>14.2f}"
+            f"{summary['cpu_seconds_per_site']:>14.2f}"
+            f"{summary['db_bytes_per_site'] / 1024:>14.1f}"
+        )
+    results_path = os.path.join(BENCHMARK_OUTPUT_DIR, f"results_{stamp}.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"[+] Results, with the rows of each instrument per site, written to {results_path}")
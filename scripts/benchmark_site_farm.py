@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import itertools
+from datetime import datetime
+from pathlib import Path
+
+PARENT_DIR = Path().resolve()
+sys.path.insert(0, str(PARENT_DIR))
+from tracking_audit import Audit, INSTRUMENT_PRESETS, DEFAULT_INSTRUMENT_PRESET, HOST_COOLDOWN_SECONDS
+from tracking_audit.metrics import _percentile
+from tracking_audit.site_farm import SiteFarm
+
+# where the benchmark audits are written, apart from the real ones
+BENCHMARK_OUTPUT_DIR = "./output/benchmark_site_farm"
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="benchmark_site_farm",
+        description="Crawl a local farm of synthetic websites (trackers, cookies, redirects, slow and dead hosts) and report the throughput, latency, memory and database growth of the crawler for each setting.",
+    )
+    parser.add_argument(
+        "-n",
+        "--sites",
+        dest="sites",
+        type=int,
+        default=100,
+        help="Number of synthetic websites",
+    )
+    parser.add_argument(
+        "-t",
+        "--trackers",
+        dest="trackers",
+        type=int,
+        default=30,
+        help="Number of distinct tracker hosts",
+    )
+    parser.add_argument(
+        "-tp",
+        "--trackers-per-site",
+        dest="trackers_per_site",
+        type=int,
+        default=5,
+        help="Trackers embedded by each website",
+    )
+    parser.add_argument(
+        "-rs",
+        "--redirect-share",
+        dest="redirect_share",
+        type=float,
+        default=0.1,
+        help="Share of redirecting websites",
+    )
+    parser.add_argument(
+        "-ss",
+        "--slow-share",
+        dest="slow_share",
+        type=float,
+        default=0.1,
+        help="Share of slow websites",
+    )
+    parser.add_argument(
+        "-ds",
+        "--dead-share",
+        dest="dead_share",
+        type=float,
+        default=0.05,
+        help="Share of dead websites",
+    )
+    parser.add_argument(
+        "-sl",
+        "--slow-seconds",
+        dest="slow_seconds",
+        type=float,
+        default=5,
+        help="Seconds a slow website waits before answering",
+    )
+    parser.add_argument(
+        "-b",
+        "--browser-n",
+        dest="browser_n",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Numbers of browsers to compare",
+    )
+    parser.add_argument(
+        "-in",
+        "--instruments",
+        dest="instruments",
+        nargs="+",
+        choices=list(INSTRUMENT_PRESETS),
+        default=[DEFAULT_INSTRUMENT_PRESET],
+        help="Instrument presets to compare, each one with every number of browsers",
+    )
+    parser.add_argument(
+        "-d",
+        "--dwell",
+        dest="dwell",
+        type=float,
+        default=2,
+        help="Seconds a page stays open after loading, the same for all the visits",
+    )
+    parser.add_argument(
+        "-hc",
+        "--host-cooldown",
+        dest="host_cooldown",
+        type=float,
+        default=HOST_COOLDOWN_SECONDS,
+        help="Seconds between two visits to the same registered domain",
+    )
+    parser.add_argument(
+        "-ma",
+        "--max-attempts",
+        dest="max_attempts",
+        type=int,
+        default=1,
+        help="Visits of a site at most, 1 so that the retries of the dead websites do not weigh on the throughput",
+    )
+    parser.add_argument(
+        "-seed",
+        dest="seed",
+        type=int,
+        default=0,
+        help="Random seed of the farm",
+    )
+    parser.add_argument(
+        "-native",
+        dest="native",
+        action="store_true",
+        default=False,
+        help="Show the browsers instead of running headless?",
+    )
+    return vars(parser.parse_args())
+
+
+def db_bytes(db_path: Path) -> int:
+    """Size of the OpenWPM database, its write-ahead log included"""
+    return sum(os.path.getsize(p) for p in (str(db_path), f"{db_path}-wal") if os.path.isfile(p))
+
+
+def run_setting(farm: SiteFarm, audit_name: str, browser_n: int, instruments: str, args: dict) -> dict:
+    """Crawl the whole farm with a setting, returns its throughput, latency, memory and database growth"""
+    audit = Audit(
+        websites=farm.urls(),
+        headless=not args["native"],
+        audit_name=audit_name,
+        output_dir=BENCHMARK_OUTPUT_DIR,
+        browser_n=browser_n,
+        instruments=instruments,
+        dwell_range=(args["dwell"], args["dwell"]),
+        host_cooldown=args["host_cooldown"],
+        max_attempts=args["max_attempts"],
+        # a benchmark runs at any time of the day
+        active_hours=(0, 23),
+        # every host name of the farm resolves to the local server
+        browser_prefs=farm.browser_prefs(),
+    )
+    requests_before = dict(farm.requests)
+    start = time.perf_counter()
+    audit.crawl_audit()
+    wall_seconds = time.perf_counter() - start
+    with open(audit.metrics.visits_path, "r") as f:
+        visits = [json.loads(line) for line in f]
+    visit_seconds = [v["visit_seconds"] for v in visits]
+    # page loads of the GetCommands, from crawl_history
+    get_seconds = [v["get_seconds"] for v in visits if v["get_seconds"] is not None]
+    pool = audit.pool.summary()
+    return {
+        "browser_n": browser_n,
+        "instruments": instruments,
+        "sites": len(visits),
+        "failed_sites": sum(not v["success"] for v in visits),
+        "wall_seconds": round(wall_seconds, 1),
+        "sites_per_hour": round(len(visits) / wall_seconds * 3600, 1) if wall_seconds else None,
+        "visit_seconds": {f"p{q}": _percentile(visit_seconds, q) for q in (50, 90, 99)},
+        "get_seconds": {f"p{q}": _percentile(get_seconds, q) for q in (50, 90, 99)},
+        "browser_footprint_mb": pool["browser_footprint_mb"],
+        "browser_peak_mb": pool["browser_peak_mb"],
+        "browsers_recycled": pool["recycled"],
+        "db_bytes_per_site": round(db_bytes(audit.output_db) / max(len(visits), 1)),
+        "requests_served": {k: farm.requests[k] - requests_before[k] for k in farm.requests},
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.makedirs(BENCHMARK_OUTPUT_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d%H%M")
+    farm = SiteFarm(
+        sites=args["sites"],
+        trackers=args["trackers"],
+        trackers_per_site=args["trackers_per_site"],
+        redirect_share=args["redirect_share"],
+        slow_share=args["slow_share"],
+        dead_share=args["dead_share"],
+        slow_seconds=args["slow_seconds"],
+        seed=args["seed"],
+    )
+    results = []
+    with farm:
+        for browser_n, instruments in itertools.product(args["browser_n"], args["instruments"]):
+            print(f"[+] Crawling the farm with {browser_n} browsers and the '{instruments}' instruments")
+            results.append(
+                run_setting(farm, f"sitefarm_b{browser_n}_{instruments}_{stamp}", browser_n, instruments, args)
+            )
+
+    print(
+        f"\n{'browsers':>9}{'instruments':>22}{'sites/h':>10}{'p50 (s)':>10}{'p99 (s)':>10}"
+        f"{'browser MB':>12}{'db/site (KB)':>14}"
+    )
+    for r in results:
+        print(
+            f"{r['browser_n']:>9}{r['instruments']:>22}{r['sites_per_hour'] or 0:>10.0f}"
+            f"{r['visit_seconds']['p50'] or 0:>10.2f}{r['visit_seconds']['p99'] or 0:>10.2f}"
+            f"{r['browser_footprint_mb'] or 0:>12.0f}{r['db_bytes_per_site'] / 1024:>14.1f}"
+        )
+    results_path = os.path.join(BENCHMARK_OUTPUT_DIR, f"results_{stamp}.json")
+    with open(results_path, "w") as f:
+        json.dump(
+            {
+                "farm": {**farm.kinds(), "trackers": args["trackers"], "slow_seconds": args["slow_seconds"]},
+                # peak memory of this process, the TaskManager and the farm server
+                "crawler_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "settings": results,
+            },
+            f,
+            indent=4,
+        )
+    print(f"[+] Results written to {results_path}")
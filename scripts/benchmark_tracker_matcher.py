@@ -0,0 +1,151 @@
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+PARENT_DIR = Path().resolve()
+sys.path.insert(0, str(PARENT_DIR))
+from tracking_audit.trackers import TrackerMatcher
+
+RESOURCE_TYPES = ["script", "image", "xmlhttprequest", "stylesheet", "sub_frame", "font"]
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="benchmark_tracker_matcher",
+        description="Compare the token-indexed tracker matcher against testing every filter of the list on each url.",
+    )
+    parser.add_argument(
+        "-f",
+        "--filter-list",
+        dest="filter_list",
+        type=str,
+        default=None,
+        help="Path to a real filter list, e.g. easyprivacy.txt. A synthetic list is generated if not given",
+    )
+    parser.add_argument(
+        "-n",
+        "--filters",
+        dest="filters",
+        type=int,
+        default=20_000,
+        help="Number of filters of the synthetic list",
+    )
+    parser.add_argument(
+        "-u",
+        "--urls",
+        dest="urls",
+        type=int,
+        default=200_000,
+        help="Number of urls classified by the indexed matcher",
+    )
+    parser.add_argument(
+        "-l",
+        "--linear-urls",
+        dest="linear_urls",
+        type=int,
+        default=500,
+        help="Number of those urls also classified by the linear scan, which is extrapolated",
+    )
+    return vars(parser.parse_args())
+
+
+def synthetic_filters(n: int, rng: random.Random) -> list:
+    """Filter list shaped like EasyPrivacy: mostly ||host^ filters, then paths, query parameters, wildcards and regexes"""
+    filters = ["[Adblock Plus 2.0]", "! Title: synthetic"]
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.6:
+            filters.append(f"||tracker-{i}.com^" + ("$third-party" if i % 2 else ""))
+        elif kind < 0.8:
+            filters.append(f"/collect-{i}/pixel." + ("$image" if i % 3 == 0 else ""))
+        elif kind < 0.9:
+            filters.append(f"&beacon{i}=")
+        elif kind < 0.99:
+            filters.append(f"/stats/*/event{i}_")
+        else:
+            filters.append(f"/analytics-{i}\\.[a-z]+\\.js/")
+        if i % 100 == 0:
+            filters.append(f"@@||tracker-{i}.com/consent.js")
+    return filters
+
+
+def synthetic_requests(n: int, n_filters: int, rng: random.Random) -> list:
+    """(url, resource_type, site_url) of requests, about a third of them to trackers"""
+    requests = []
+    for j in range(n):
+        site = f"https://www.municipio-{rng.randrange(300)}.gov.pt/"
+        i = rng.randrange(n_filters)
+        kind = rng.random()
+        if kind < 0.2:
+            url = f"https://cdn.tracker-{i}.com/t.js?id={j}"
+        elif kind < 0.3:
+            url = f"https://stats.example.com/collect-{i}/pixel.gif?r={j}"
+        elif kind < 0.35:
+            url = f"https://x.example.net/p?a=1&beacon{i}={j}"
+        else:
+            url = f"{site}assets/{rng.choice(['app', 'main', 'vendor'])}.{j % 97}.js?v={j}"
+        requests.append((url, rng.choice(RESOURCE_TYPES), site))
+    return requests
+
+
+def linear_classify(matcher: TrackerMatcher, url: str, resource_type: str, site_url: str):
+    """Baseline: every filter tested on every url, in list order"""
+    from tracking_audit.trackers import _prefix_host
+    from tracking_audit.labelling import authority_prefix, host_registered_domain
+
+    host = _prefix_host(authority_prefix(url))
+    site_host = _prefix_host(authority_prefix(site_url))
+    third_party = host_registered_domain(host) != host_registered_domain(site_host)
+    category = None
+    for f in matcher.filters:
+        if not f.exception and f.matches(url, resource_type, third_party, site_host):
+            category = f.category
+            break
+    if category is None:
+        return None
+    for f in matcher.filters:
+        if f.exception and f.matches(url, resource_type, third_party, site_host):
+            return None
+    return category
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rng = random.Random(0)
+    start = time.perf_counter()
+    if args["filter_list"]:
+        matcher = TrackerMatcher.from_files({Path(args["filter_list"]).stem: args["filter_list"]})
+    else:
+        matcher = TrackerMatcher()
+        matcher.add_list("synthetic", synthetic_filters(args["filters"], rng))
+    print(
+        f"[+] Compiled {len(matcher.filters)} filters ({matcher.skipped} unsupported skipped) in {time.perf_counter() - start:.2f}s"
+    )
+    requests = synthetic_requests(args["urls"], args["filters"], rng)
+
+    start = time.perf_counter()
+    indexed = [matcher.classify(*r) for r in requests]
+    indexed_seconds = time.perf_counter() - start
+    trackers = sum(c is not None for c in indexed)
+    print(
+        f"[+] Indexed matcher: {len(requests)} urls in {indexed_seconds:.2f}s "
+        f"({len(requests) / indexed_seconds:,.0f} urls/s), {trackers} trackers"
+    )
+
+    sample = requests[: args["linear_urls"]]
+    start = time.perf_counter()
+    linear = [linear_classify(matcher, *r) for r in sample]
+    linear_seconds = time.perf_counter() - start
+    print(
+        f"[+] Linear scan: {len(sample)} urls in {linear_seconds:.2f}s ({len(sample) / linear_seconds:,.0f} urls/s)"
+    )
+    if linear != indexed[: len(sample)]:
+        print("[!] The indexed matcher and the linear scan disagree")
+    speed_up = (len(requests) / indexed_seconds) / (len(sample) / linear_seconds)
+    print(f"[+] Speed-up: {speed_up:,.0f}x")
+    print(
+        f"[+] 10 million urls: {1e7 / (len(requests) / indexed_seconds) / 60:.1f} min indexed (one process), "
+        f"{1e7 / (len(sample) / linear_seconds) / 3600:.1f} h linear"
+    )
@@ -0,0 +1,83 @@
+import os
+import sys
+import glob
+import argparse
+from pathlib import Path
+
+PARENT_DIR = Path().resolve()
+sys.path.insert(0, str(PARENT_DIR))
+from tracking_audit.constants import FILTER_LISTS_DIR
+from tracking_audit.trackers import classify_audits, TRACKER_COLUMN
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="classify_trackers",
+        description=f"Classify the http_requests of audits with EasyList/EasyPrivacy-style filter lists, writing the category of each tracker to http_requests.{TRACKER_COLUMN}.",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        type=str,
+        help="Output directories of the audits, or sqlite databases with http_requests and site_visits tables (e.g. a warehouse)",
+    )
+    parser.add_argument(
+        "-f",
+        "--filter-list",
+        dest="filter_lists",
+        action="append",
+        type=str,
+        default=None,
+        help=f"Filter list as category=path, e.g. easyprivacy=easyprivacy.txt, can be repeated. Lists are tried in order. Defaults to every <category>.txt in {FILTER_LISTS_DIR}",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of classifying processes",
+    )
+    return vars(parser.parse_args())
+
+
+def filter_lists_from_args(filter_lists: list) -> dict:
+    """category -> path of the filter lists given, or of the lists found in FILTER_LISTS_DIR"""
+    if not filter_lists:
+        return {
+            Path(path).stem: path
+            for path in sorted(glob.glob(os.path.join(FILTER_LISTS_DIR, "*.txt")))
+        }
+    lists = {}
+    for filter_list in filter_lists:
+        category, _, path = filter_list.rpartition("=")
+        lists[category or Path(path).stem] = path
+    return lists
+
+
+def main() -> None:
+    args = parse_args()
+    filter_lists = filter_lists_from_args(args["filter_lists"])
+    if not filter_lists:
+        print(f"[!] No filter lists given nor found in {FILTER_LISTS_DIR}")
+        sys.exit(1)
+    db_paths = []
+    for path in args["paths"]:
+        if os.path.isdir(path):
+            path = os.path.join(path, f"{os.path.basename(os.path.normpath(path))}.sqlite")
+        if not os.path.isfile(path):
+            print(f"[!] No database found at {path}, skipping it")
+            continue
+        db_paths.append(path)
+    results = classify_audits(db_paths, filter_lists, workers=args["workers"])
+    for path, counts in results.items():
+        requests = counts.pop("requests")
+        trackers = sum(counts.values())
+        print(
+            f"[+] {path}: {trackers} of {requests} requests are trackers"
+            + "".join(f", {n} {category}" for category, n in counts.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+
+PARENT_DIR = Path().resolve()
+sys.path.insert(0, str(PARENT_DIR))
+from tracking_audit.diff import diff_audits, COOKIES, THIRD_PARTIES
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="diff_audits",
+        description="Compare the cookies or third parties found by two or more audits, e.g. the pt audit against the esba one.",
+    )
+    parser.add_argument(
+        "audit_dirs",
+        nargs="+",
+        type=str,
+        help="Output directories of the audits to compare, the first one is the baseline",
+    )
+    parser.add_argument(
+        "-k",
+        "--kind",
+        dest="kind",
+        choices=[COOKIES, THIRD_PARTIES],
+        default=COOKIES,
+        help="Compare (cookie host, cookie name) pairs or third-party registered domains per site",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output_path",
+        type=str,
+        default=None,
+        help="Path to a json file for the full per-site results",
+    )
+    return vars(parser.parse_args())
+
+
+def main() -> None:
+    args = parse_args()
+    db_paths = [
+        os.path.join(d, f"{os.path.basename(os.path.normpath(d))}.sqlite")
+        for d in args["audit_dirs"]
+    ]
+    result = diff_audits(db_paths, kind=args["kind"])
+    print(f"[+] Baseline: {db_paths[0]}")
+    for path, comparison in result["comparisons"].items():
+        totals = comparison["global"]
+        print(
+            f"[+] {path}: {totals['added']} added, {totals['removed']} removed, {totals['shared']} shared"
+        )
+    print(f"[+] Shared by all the audits: {result['shared_by_all']['global']}")
+    if args["output_path"]:
+        with open(args["output_path"], "w") as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
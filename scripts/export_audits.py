@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+
+PARENT_DIR = Path().resolve()
+sys.path.insert(0, str(PARENT_DIR))
+from tracking_audit.export import export_audit, TABLES_TO_EXPORT
+
+# default root directory of the columnar store
+STORE_DIR = "./output/columnar"
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="export_audits",
+        description="Export finished audits to parquet files partitioned by audit, location and visit.",
+    )
+    parser.add_argument(
+        "audit_dirs",
+        nargs="+",
+        type=str,
+        help="Output directories of the audits to export, e.g. output/audit_rep_1_pt_202210101010",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="store_dir",
+        type=str,
+        default=STORE_DIR,
+        help="Root directory of the columnar store",
+    )
+    parser.add_argument(
+        "-t",
+        "--tables",
+        dest="tables",
+        nargs="+",
+        type=str,
+        default=list(TABLES_TO_EXPORT),
+        help="Tables to export",
+    )
+    return vars(parser.parse_args())
+
+
+def audit_metadata(audit_dir: str) -> dict:
+    """Audit name and location of an audit, from its crawl_config.json if present"""
+    audit_name = os.path.basename(os.path.normpath(audit_dir))
+    config_path = os.path.join(audit_dir, "crawl_config.json")
+    location = None
+    if os.path.isfile(config_path):
+        with open(config_path, "r") as f:
+            crawl_config = json.load(f)
+        audit_name = crawl_config.get("audit_name") or audit_name
+        location = crawl_config.get("location")
+    return {"audit": audit_name, "location": location}
+
+
+def main() -> None:
+    args = parse_args()
+    for audit_dir in args["audit_dirs"]:
+        metadata = audit_metadata(audit_dir)
+        db_path = os.path.join(audit_dir, f"{os.path.basename(os.path.normpath(audit_dir))}.sqlite")
+        if not os.path.isfile(db_path):
+            print(f"[!] No audit database found in {audit_dir}, skipping it")
+            continue
+        exported = export_audit(
+            db_path=db_path,
+            output_dir=args["store_dir"],
+            tables=args["tables"],
+            **metadata,
+        )
+        print(
+            f"[+] Exported {metadata['audit']}: "
+            + ", ".join(f"{t} ({n} rows)" for t, n in exported.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
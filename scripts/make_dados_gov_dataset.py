@@ -1,6 +1,11 @@
+import os
+import gzip
 import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import re
 
 DADOS_GOV_SOURCES = {
     "dados_gov_municipios": "https://dados.gov.pt/pt/datasets/r/a86ec6e5-f124-4046-9514-903741d2ec25",
@@ -11,57 +16,243 @@ DADOS_GOV_SOURCES = {
     "dados_gov_presença": "https://dados.gov.pt/pt/datasets/r/c2afba19-9872-4e3a-a616-64f4a61acca9",
     "dados_gov_univ_pub": "https://dados.gov.pt/pt/datasets/r/3dc57d0c-1ccd-48fe-954a-1c4d2fdb6705"
 }
+# what to read from each spreadsheet: sheets, data rows skipped after the header row and the columns of the
+# page name, url and (if any) entity, as in pd.read_excel(url, sheet_name=sheet).iloc[skip:, columns]
+DADOS_GOV_LAYOUTS = {
+    "dados_gov_municipios": {"sheets": [0], "skip": 2, "columns": (1, 2)},
+    "dados_gov_freg": {"sheets": [0], "skip": 1, "columns": (3, 4)},
+    "dados_gov_admin_pub": {"sheets": [0], "skip": 0, "columns": (0, 1)},
+    "dados_gov_açores": {"sheets": [0], "skip": 2, "columns": (0, 1)},
+    "dados_gov_madeira": {"sheets": [0], "skip": 2, "columns": (0, 2)},
+    "dados_gov_presença": {"sheets": [0], "skip": 0, "columns": (0, 1, 2)},
+    "dados_gov_univ_pub": {
+        "sheets": ["Ensino Univ. Público", "Ensino Pol. Público"],
+        "skip": 2,
+        "columns": (0, 1),
+    },
+}
+# cells pd.read_excel reads as missing values
+NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+# bump to invalidate the parsed frames cached with an older parser
+PARSER_VERSION = 1
 
 OUTPUT_PATH = "resources/governmental_websites/interm/dadosgov.json"
+# downloaded spreadsheets, their http validators and the frames parsed from them
+CACHE_DIR = "resources/governmental_websites/.cache/dados_gov"
+DOWNLOADS_INDEX_PATH = os.path.join(CACHE_DIR, "downloads.json")
+PARSED_DIR = os.path.join(CACHE_DIR, "parsed")
+# seconds before a download is given up
+DOWNLOAD_TIMEOUT = 60
 
-def read_dados_gov_files() -> pd.DataFrame:
-    """ read dados gov xlsx file"""
-    dfs = []
-    for dados_gov_source, dados_gov_url in DADOS_GOV_SOURCES.items():
-        # read the excel files
-        if "univ" in dados_gov_source:
-            uni_dfs = []
-            for sheet_name in ["Ensino Univ. Público", "Ensino Pol. Público"]:
-                df = pd.read_excel(dados_gov_url, sheet_name=sheet_name).iloc[2:, 0:2]
-                df.columns = ["page_name", "url"]
-                df["entity"] = df["page_name"]
-                uni_dfs.append(df)
-            df = pd.concat(uni_dfs)
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="make_dados_gov_dataset",
+        description="Download the dados.gov spreadsheets listing governmental websites and convert them to dadosgov.json.",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        dest="force",
+        action="store_true",
+        default=False,
+        help="Download and parse every spreadsheet again, ignoring the cache?",
+    )
+    parser.add_argument(
+        "-o",
+        "--offline",
+        dest="offline",
+        action="store_true",
+        default=False,
+        help="Use the cached spreadsheets without revalidating them?",
+    )
+    return vars(parser.parse_args())
+
+
+def _read_json(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path: str, data: dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def download(session, source: str, url: str, cached: dict, force: bool = False) -> dict:
+    """
+    Download a spreadsheet into the cache, revalidating the cached copy with its ETag/Last-Modified.
+    Returns the cache entry of the source: path, sha256 and the http validators.
+    """
+    path = os.path.join(CACHE_DIR, f"{source}.xlsx")
+    headers = {}
+    if cached and os.path.isfile(path) and not force:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        response = session.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+    except Exception as e:
+        if cached and os.path.isfile(path):
+            print(f"[!] Could not download {source} ({e}), using the cached spreadsheet")
+            return cached
+        raise
+    if response.status_code == 304:
+        return cached
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(response.content)
+    os.replace(tmp_path, path)
+    return {
+        "url": url,
+        "path": path,
+        "sha256": hashlib.sha256(response.content).hexdigest(),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def download_all(force: bool = False, offline: bool = False) -> dict:
+    """Download (or revalidate) all the spreadsheets concurrently, source -> cache entry"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    index = _read_json(DOWNLOADS_INDEX_PATH)
+    if offline:
+        missing = [s for s in DADOS_GOV_SOURCES if s not in index or not os.path.isfile(index[s]["path"])]
+        if missing:
+            raise FileNotFoundError(f"Spreadsheets not cached yet: {', '.join(missing)}")
+        return {s: index[s] for s in DADOS_GOV_SOURCES}
+    import requests
+
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=len(DADOS_GOV_SOURCES)) as executor:
+        futures = {
+            source: executor.submit(
+                download,
+                session,
+                source,
+                url,
+                # a source whose url changed is downloaded again
+                index.get(source) if index.get(source, {}).get("url") == url else None,
+                force,
+            )
+            for source, url in DADOS_GOV_SOURCES.items()
+        }
+        entries = {source: future.result() for source, future in futures.items()}
+    _write_json(DOWNLOADS_INDEX_PATH, {**index, **entries})
+    return entries
+
+
+def _cell(value):
+    """Value of a cell as read by pd.read_excel, None for the missing ones"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = str(value)
+    return None if value in NA_VALUES else value
+
+
+def read_sheet_rows(path: str, sheet, skip: int, columns: tuple) -> list:
+    """
+    Stream the rows of a sheet in read-only mode, keeping only the given columns: the first row is the header and
+    the next skip rows are dropped, as pd.read_excel(...).iloc[skip:, columns] does.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+        rows = []
+        # past the header and the skipped rows, converting only the cells of the columns read
+        for row in worksheet.iter_rows(min_row=2 + skip, values_only=True):
+            rows.append([_cell(row[c]) if c < len(row) else None for c in columns])
+        return rows
+    finally:
+        workbook.close()
+
+
+def parse_source(source: str, path: str) -> list:
+    """(page_name, url, entity) rows of a spreadsheet, the rows with a missing value dropped"""
+    layout = DADOS_GOV_LAYOUTS[source]
+    out = []
+    for sheet in layout["sheets"]:
+        for row in read_sheet_rows(path, sheet, layout["skip"], layout["columns"]):
+            # without an entity column, the entity is the page name
+            page_name, url, entity = row if len(row) == 3 else (*row, row[0])
+            if page_name is None or url is None or entity is None:
+                continue
+            out.append([page_name, url, entity])
+    return out
+
+
+def _parsed_path(source: str, sha256: str) -> str:
+    """The parsed rows of a spreadsheet are cached by its hash and the way it is read"""
+    layout = json.dumps([PARSER_VERSION, DADOS_GOV_LAYOUTS[source]], ensure_ascii=False, sort_keys=True)
+    key = hashlib.sha256(f"{sha256}|{layout}".encode("utf-8")).hexdigest()[:32]
+    return os.path.join(PARSED_DIR, f"{key}.json.gz")
+
+
+def parse_all(entries: dict, force: bool = False) -> dict:
+    """Rows of every spreadsheet, from the cache for the unchanged ones and parsed for the others"""
+    os.makedirs(PARSED_DIR, exist_ok=True)
+    parsed = {}
+    to_parse = {}
+    for source, entry in entries.items():
+        # hash the file when the server gave no validators, e.g. for spreadsheets cached before
+        sha256 = entry.get("sha256") or _file_hash(entry["path"])
+        cache_path = _parsed_path(source, sha256)
+        if os.path.isfile(cache_path) and not force:
+            with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+                parsed[source] = json.load(f)
         else:
-            df = pd.read_excel(dados_gov_url, sheet_name=0)
-            # filter relevant columns and rename
-            if "presença" in dados_gov_source:
-                df.columns = ["page_name", "url", "entity"]
-            else:
-                if "municipios" in dados_gov_source:
-                    df = df.iloc[2:, 1:3]
-                elif "freg" in dados_gov_source:
-                    df = df.iloc[1:,[3, 4]]
-                elif "madeira" in dados_gov_source:
-                    df = df.iloc[2:, [0, 2]]
-                elif "açores" in dados_gov_source:    
-                    df = df.iloc[2:,0:2]
-                else:
-                    df = df.iloc[:,0:2]
-                df.columns = ["page_name", "url"]
-                df["entity"] = df["page_name"]
-        # filter out none values
-        df.dropna(inplace=True)
-        dfs.append(df)
+            to_parse[source] = (entry["path"], cache_path)
+    # the spreadsheets changed since the last build
+    for source, (path, cache_path) in to_parse.items():
+        parsed[source] = parse_source(source, path)
+        with gzip.open(cache_path + ".tmp", "wt", encoding="utf-8") as f:
+            json.dump(parsed[source], f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(cache_path + ".tmp", cache_path)
+    print(f"[+] {len(entries) - len(to_parse)} spreadsheets read from the cache, {len(to_parse)} parsed")
+    return parsed
+
+
+def read_dados_gov_files(force: bool = False, offline: bool = False) -> pd.DataFrame:
+    """ read dados gov xlsx file"""
+    entries = download_all(force=force, offline=offline)
+    parsed = parse_all(entries, force=force)
+    dfs = [
+        pd.DataFrame(parsed[source], columns=["page_name", "url", "entity"], dtype="object")
+        for source in DADOS_GOV_SOURCES
+    ]
     return pd.concat(dfs)
 
-def main() -> None:
+
+def main(force: bool = False, offline: bool = False) -> None:
     """ read the xlsx files and covert to json """
+    start = time.perf_counter()
     # clean up and merge
-    dados_gov_df = read_dados_gov_files().drop_duplicates(subset=["url"])
+    dados_gov_df = read_dados_gov_files(force=force, offline=offline).drop_duplicates(subset=["url"])
     # remove empty cols
     dados_gov_df.dropna(how='all', axis=1, inplace=True)
     dados_gov_df.reset_index(drop = True, inplace=True)
     dados_gov_dict = dados_gov_df.to_dict(orient="index")
     with open(OUTPUT_PATH, "w") as f:
         json.dump(dados_gov_dict, f, indent=4, ensure_ascii=False)
+    print(f"[+] {len(dados_gov_dict)} websites written to {OUTPUT_PATH} in {time.perf_counter() - start:.1f}s")
 
 if __name__ == "__main__":
-    main()
-    
-    
\ No newline at end of file
+    main(**parse_args())
@@ -1,9 +1,16 @@
-import pandas as pd
-import tldextract
 import os
+import sys
 import json
 import re
-import subprocess
+import time
+import runpy
+import hashlib
+import argparse
+from pathlib import Path
+from urllib.parse import urlsplit
+
+PARENT_DIR = Path().resolve()
+sys.path.insert(0, str(PARENT_DIR))
 
 # remove social media platforms, app stores, non completely public companies, and private/public associations
 DOMAINS_TO_IGNORE_REGEX = "|".join(
@@ -32,6 +39,16 @@ DOMAINS_TO_IGNORE_REGEX = "|".join(
         "ajudademae",
     ]
 )
+# compiled once, they are applied to every url of every source
+_DOMAINS_TO_IGNORE = re.compile(DOMAINS_TO_IGNORE_REGEX)
+_URL_REGEX = re.compile(
+    r"^((?:http|ftp)s?(\://))?(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|"  # domain...
+    r"localhost|"  # localhost...
+    r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})"  # ...or ip
+    r"(?::\d+)?"  # optional port
+    r"(?:/?|[/?]\S+)$",
+    re.IGNORECASE,
+)
 
 # data sources
 DATA_SOURCES_DIR = "resources/governmental_websites/interm"
@@ -40,23 +57,28 @@ DATA_SOURCES_DICT = {
     "eportugal": os.path.join(DATA_SOURCES_DIR, "eportugal.json"),
     "outros": os.path.join(DATA_SOURCES_DIR, "outros.json"),
 }
+# scripts making the data sources, run when a source is missing
+DATA_SOURCES_SCRIPTS = {
+    "eportugal": "scripts/scrape_eportugal_data.py",
+    "dadosgov": "scripts/make_dados_gov_dataset.py",
+}
 # path for the dataset
 OUTPUT_PATH = "resources/governmental_websites/governmental_websites.json"
+# normalized and validated records of each source, keyed by the hash of the source file
+CACHE_DIR = "resources/governmental_websites/.cache"
+# sites of the last build by domain, with the source each one came from
+DOMAIN_INDEX_PATH = os.path.join(CACHE_DIR, "domain_index.json")
+# redirect chains of the websites, for the canonicalisation
+REDIRECT_CACHE_PATH = os.path.join(CACHE_DIR, "redirects.sqlite")
+# bump when the normalization changes, so that the cached records are made again
+CACHE_VERSION = 1
+
 
 def validate_url(_url: str) -> bool:
     """validate a url"""
-    if re.search(DOMAINS_TO_IGNORE_REGEX, _url):
+    if _DOMAINS_TO_IGNORE.search(_url):
         return False
-    else:
-        regex = re.compile(
-            r"^((?:http|ftp)s?(\://))?(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|"  # domain...
-            r"localhost|"  # localhost...
-            r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})"  # ...or ip
-            r"(?::\d+)?"  # optional port
-            r"(?:/?|[/?]\S+)$",
-            re.IGNORECASE,
-        )
-        return re.match(regex, _url) is not None
+    return _URL_REGEX.match(_url) is not None
 
 
 def _read_websites_json(path: str) -> dict:
@@ -66,40 +88,148 @@ def _read_websites_json(path: str) -> dict:
     out = {}
     for i, d in dta.items():
         if validate_url(str(d.get("url"))):
-            if not re.search("^http", d.get("url")):
+            if not d.get("url").startswith("http"):
                 d["url"] = "https://" + d.get("url")
             out[i] = d
     return out
 
 
-def read_websites_json() -> list:
-    """wrapper around _read_websites_json which is applied to all json files in resources/governmental_websites/interm"""
-    urls_added = set()
-    i = 0
+def domain_key(url: str) -> str:
+    """
+    Host of a url, the key sites are deduplicated by (e.g. the parishes under freguesias.pt are different sites).
+    Case is kept, as tldextract did when it was used for this.
+    """
+    netloc = urlsplit(url).netloc
+    return netloc.rpartition("@")[2].split(":")[0]
+
+
+def source_hash(path: str) -> str:
+    """Hash of a source file and of everything its normalized records depend on"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        h.update(f.read())
+    h.update(f"{CACHE_VERSION}|{DOMAINS_TO_IGNORE_REGEX}".encode())
+    return h.hexdigest()
+
+
+def read_source(source: str, path: str) -> tuple:
+    """
+    Valid records of a source, each with its source name and domain key, from the cache if the source did not change.
+    Returns (hash of the source, list of [domain key, record]).
+    """
+    _hash = source_hash(path)
+    cache_path = os.path.join(CACHE_DIR, f"{source}.json")
+    if os.path.isfile(cache_path):
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached.get("hash") == _hash:
+            return _hash, cached["records"]
+    records = [
+        [domain_key(d["url"]), dict(d, source=source)]
+        for d in _read_websites_json(path).values()
+    ]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_path, "w") as f:
+        # json.dumps uses the C encoder, json.dump does not
+        f.write(json.dumps({"hash": _hash, "records": records}, ensure_ascii=False))
+    return _hash, records
+
+
+def _read_domain_index() -> dict:
+    if not os.path.isfile(DOMAIN_INDEX_PATH):
+        return {"sources": {}, "domains": {}}
+    with open(DOMAIN_INDEX_PATH, "r") as f:
+        return json.load(f)
+
+
+def read_websites_json() -> tuple:
+    """
+    Merge the valid records of all the sources in resources/governmental_websites/interm, keeping the first site of
+    each domain. Returns the dataset and the domain index (domain key -> source, url) of this build.
+    """
+    domains = {}
+    hashes = {}
     out = {}
     for _source, _file in DATA_SOURCES_DICT.items():
-        if _file != OUTPUT_PATH:
-            if not os.path.isdir(_file) and "json" in _file:
-                with open(_file, "r") as f:
-                    websites_dict = _read_websites_json(_file)
-                    for _, d in websites_dict.items():
-                        parsed_url = ".".join(list(tldextract.extract(d.get("url"))))
-                        if parsed_url not in urls_added:
-                            out[i] = d
-                            urls_added.add(parsed_url)
-                            i += 1
+        if _file == OUTPUT_PATH or not os.path.isfile(_file) or "json" not in _file:
+            continue
+        hashes[_source], records = read_source(_source, _file)
+        for key, d in records:
+            if key not in domains:
+                domains[key] = {"source": _source, "url": d["url"]}
+                out[len(out)] = d
+    return out, {"sources": hashes, "domains": domains}
+
+
+def run_data_source_script(script: str) -> None:
+    """Run the script making a data source in this interpreter, as if from the command line"""
+    argv = sys.argv
+    sys.argv = [script]
+    try:
+        runpy.run_path(script, run_name="__main__")
+    finally:
+        sys.argv = argv
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="make_governmental_websites_dataset",
+        description="Merge the data sources into the governmental websites dataset.",
+    )
+    parser.add_argument(
+        "-c",
+        "--canonicalize",
+        dest="canonicalize",
+        action="store_true",
+        help="Follow the redirects of every website and keep one website per final origin, the others are kept under its 'aliases'",
+    )
+    return vars(parser.parse_args())
+
+
+def canonicalize_websites(dta: dict) -> dict:
+    """Group the websites landing on the same origin, resolving the redirect chains missing from the cache"""
+    from tracking_audit.redirects import resolve_redirects, canonicalize
+
+    start = time.perf_counter()
+    results = resolve_redirects([d["url"] for d in dta.values()], cache_path=REDIRECT_CACHE_PATH)
+    out = canonicalize(dta, results)
+    print(
+        f"[+] Resolved {len(results)} redirect chains ({sum(r['cached'] for r in results.values())} cached, "
+        f"{sum(r['final_url'] is None for r in results.values())} unreachable) in {time.perf_counter() - start:.1f}s, "
+        f"{len(dta) - len(out)} duplicate websites merged"
+    )
     return out
 
 
-def main() -> None:
-    if not os.path.isfile(os.path.join(DATA_SOURCES_DIR, "eportugal.json")):
-        subprocess.call("python3 scripts/scrape_eportugal_data.py", shell=True)
-    if not os.path.isfile(os.path.join(DATA_SOURCES_DIR, "dadosgov.json")):
-        subprocess.call("python3 scripts/make_dados_gov_dataset.py", shell=True)
-    dta = read_websites_json()
+def main(canonicalize: bool = False) -> None:
+    for source, script in DATA_SOURCES_SCRIPTS.items():
+        if not os.path.isfile(DATA_SOURCES_DICT[source]):
+            run_data_source_script(script)
+    start = time.perf_counter()
+    previous_index = _read_domain_index()
+    dta, domain_index = read_websites_json()
+    domain_index["canonicalized"] = canonicalize
+    if (
+        domain_index["sources"] == previous_index["sources"]
+        and canonicalize == previous_index.get("canonicalized", False)
+        and os.path.isfile(OUTPUT_PATH)
+    ):
+        print(f"[+] No source changed, {OUTPUT_PATH} is up to date")
+        return
+    if canonicalize:
+        dta = canonicalize_websites(dta)
     with open(OUTPUT_PATH, "w") as f:
-        json.dump(dta, f, indent=4, ensure_ascii=False)
+        f.write(json.dumps(dta, indent=4, ensure_ascii=False))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(DOMAIN_INDEX_PATH, "w") as f:
+        f.write(json.dumps(domain_index, ensure_ascii=False))
+    added = domain_index["domains"].keys() - previous_index["domains"].keys()
+    removed = previous_index["domains"].keys() - domain_index["domains"].keys()
+    print(
+        f"[+] {len(dta)} websites ({len(added)} added, {len(removed)} removed) "
+        f"written to {OUTPUT_PATH} in {time.perf_counter() - start:.3f}s"
+    )
 
 
 if __name__ == "__main__":
-    main()
+    main(**parse_args())
@@ -0,0 +1,64 @@
+import os
+import sys
+import argparse
+from pathlib import Path
+
+PARENT_DIR = Path().resolve()
+sys.path.insert(0, str(PARENT_DIR))
+from tracking_audit.warehouse import Warehouse
+
+# default path of the warehouse
+WAREHOUSE_PATH = "./output/warehouse.sqlite"
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="merge_audits",
+        description="Append finished audits to a single indexed sqlite warehouse. Audits already merged are skipped.",
+    )
+    parser.add_argument(
+        "audit_dirs",
+        nargs="+",
+        type=str,
+        help="Output directories of the audits to merge, e.g. output/audit_rep_1_pt_*",
+    )
+    parser.add_argument(
+        "-o",
+        "--warehouse",
+        dest="warehouse_path",
+        type=str,
+        default=WAREHOUSE_PATH,
+        help="Path to the warehouse sqlite file, created if missing",
+    )
+    parser.add_argument(
+        "--replace",
+        dest="replace",
+        action="store_true",
+        default=False,
+        help="Merge audits already in the warehouse again, replacing their rows",
+    )
+    return vars(parser.parse_args())
+
+
+def main() -> None:
+    args = parse_args()
+    warehouse = Warehouse(args["warehouse_path"])
+    for audit_dir in args["audit_dirs"]:
+        # only finished audits
+        if not os.path.isfile(os.path.join(audit_dir, "crawl_done.txt")):
+            print(f"[!] {audit_dir} is not finished, skipping it")
+            continue
+        try:
+            audit_id = warehouse.merge_audit_dir(audit_dir, replace=args["replace"])
+        except FileNotFoundError as e:
+            print(f"[!] {e}, skipping it")
+            continue
+        if audit_id is None:
+            print(f"[+] {audit_dir} already merged")
+        else:
+            print(f"[+] Merged {audit_dir} as audit_id {audit_id}")
+    warehouse.close()
+
+
+if __name__ == "__main__":
+    main()
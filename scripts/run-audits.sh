@@ -3,7 +3,7 @@
 ## display usage
 show_help() {
     cat <<EOF
-usage: $0 PARAM [-r|--replications] [-l|--location] [-p|--name-prefix] [-headless] [-n | --n-websites] [-h|--help]
+usage: $0 PARAM [-r|--replications] [-l|--location] [-p|--name-prefix] [-headless] [-n | --n-websites] [-id | --run-id] [-h|--help]
 
 Run multiple tracking audits on governmental websites from Portugal with varying geo-locations (expressvpn) and controlling for the maximum number of cookies
 
@@ -15,6 +15,7 @@ OPTIONS:
    -p|--name-prefix Trial name prefix
    -headless Should the trial be ran in headless mode?
    -n | --n-websites Number of websites to crawl, if left empty all websites will be used
+   -id | --run-id Stable run identifier, re-running with the same id resumes unfinished audits and skips finished ones
 
 RELEVANT CONSTANTS:
     MAX_COOKIES Define the maximum number of cookies to use in the max cookies control trial
@@ -30,6 +31,7 @@ TRIAL_NAME_PREFIX="audit"
 HEADLESS=0
 BROWSER_N=1
 N_WEBSITES=""
+RUN_ID=""
 
 ## parse the arguments
 while true; do
@@ -56,6 +58,12 @@ while true; do
             shift
         fi
         ;;
+    -id | --run-id)
+        if [ "$2" ]; then
+            RUN_ID="$2"
+            shift
+        fi
+        ;;
     -p | --name-prefix)
         if [ "$2" ]; then
             TRIAL_NAME_PREFIX="$2"
@@ -93,6 +101,9 @@ prepare_script() {
     if [[ $HEADLESS -gt 0 ]]; then
         relevant_script="${relevant_script} -headless"
     fi
+    if [ -n "$RUN_ID" ]; then
+        relevant_script="${relevant_script} --run-id ${RUN_ID}"
+    fi
     echo "${relevant_script}"
 
 }
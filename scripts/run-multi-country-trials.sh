@@ -15,10 +15,10 @@ destroy_machines() {
 
 # this crawl will use all websites in the sample, so it should take a very long time
 scripts_array=(
-    'bash scripts/vagrant-run-audits.sh --replications 1 --locations "pt,esba" --name-prefix "audit_${audit_n}" --activation-code ${ACTIVATION_CODE} --vpn -headless' # pt v. es (Barcelona)
-    'bash scripts/vagrant-run-audits.sh --replications 1 --locations "pt,denu" --name-prefix "audit_${audit_n}" --activation-code ${ACTIVATION_CODE} --vpn -headless' # pt v. de (Nuremberg)
-    'bash scripts/vagrant-run-audits.sh --replications 1 --locations "pt,usny" --name-prefix "audit_${audit_n}" --activation-code ${ACTIVATION_CODE}  --vpn -headless' # pt v. us (NY)
-    'bash scripts/vagrant-run-audits.sh --replications 1 --locations "pt,in" --name-prefix "audit_${audit_n}" --activation-code ${ACTIVATION_CODE} --vpn -headless'   # pt v. in 
+    'bash scripts/vagrant-run-audits.sh --replications 1 --locations "pt,esba" --name-prefix "audit_${audit_n}" --run-id "${run_id}" --activation-code ${ACTIVATION_CODE} --vpn -headless' # pt v. es (Barcelona)
+    'bash scripts/vagrant-run-audits.sh --replications 1 --locations "pt,denu" --name-prefix "audit_${audit_n}" --run-id "${run_id}" --activation-code ${ACTIVATION_CODE} --vpn -headless' # pt v. de (Nuremberg)
+    'bash scripts/vagrant-run-audits.sh --replications 1 --locations "pt,usny" --name-prefix "audit_${audit_n}" --run-id "${run_id}" --activation-code ${ACTIVATION_CODE}  --vpn -headless' # pt v. us (NY)
+    'bash scripts/vagrant-run-audits.sh --replications 1 --locations "pt,in" --name-prefix "audit_${audit_n}" --run-id "${run_id}" --activation-code ${ACTIVATION_CODE} --vpn -headless'   # pt v. in 
 )
 audit_n=0
 for cur_script in "${scripts_array[@]}"; do
@@ -26,7 +26,8 @@ for cur_script in "${scripts_array[@]}"; do
     destroy_machines
     # add the audit id to the audit name prefix argument
     let "audit_n+=1"
-    to_run=$(audit_n="country_dyad_${audit_n}" envsubst <<<"$cur_script")
+    # stable run id shared by all the attempts, so that a retry resumes the unfinished audits
+    to_run=$(audit_n="country_dyad_${audit_n}" run_id="$(date +%Y%m%d%H%M)" envsubst <<<"$cur_script")
     # add the dyad id
     for attempt in {1..10}; do
         eval $to_run
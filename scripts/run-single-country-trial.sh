@@ -2,11 +2,11 @@
 
 echo "[!] This trial will not use any vpn"
 
+# stable run id shared by all the attempts, so that a retry resumes the unfinished replications
+RUN_ID=$(date +%Y%m%d%H%M)
 # retry loop
-audit_n=0
 for attempt in {1..10}; do
-    let "audit_n+=1"
-    bash scripts/run-audits.sh --replications 10 --location "pt" --name-prefix "audit_novpn_${audit_n}" -headless
+    bash scripts/run-audits.sh --replications 10 --location "pt" --name-prefix "audit_novpn" --run-id "${RUN_ID}" -headless
     ret=$?
     if [ $ret -eq 0 ]; then
         break
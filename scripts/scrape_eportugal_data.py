@@ -1,17 +1,15 @@
-from random import random
 from typing import Optional, Union
 import os
+import re
 import sys
 import time
 import random
 import json
+import argparse
 import configparser
 from pathlib import Path
-from selenium.webdriver import Firefox
-from selenium.webdriver.remote.webelement import WebElement
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
 
 PARENT_DIR = Path().resolve()
 # parse config file and make it available to the entire module
@@ -21,26 +19,96 @@ config.read(os.path.join(PARENT_DIR, "config.ini"))
 PATH_TO_OPENWPM = config.get("openwpm", "path")
 print(PATH_TO_OPENWPM)
 sys.path.insert(0, PATH_TO_OPENWPM)
-from openwpm.utilities.platform_utils import get_firefox_binary_path
-from openwpm.deploy_browsers.selenium_firefox import Options
-from selenium.webdriver.common.proxy import Proxy, ProxyType
 
 # paths for the output data
 OUTPUT_DIR = "resources/governmental_websites/interm"
 if not os.path.isdir(OUTPUT_DIR):
     os.mkdir(OUTPUT_DIR)
 OUTPUT_PATH = os.path.join(OUTPUT_DIR, "eportugal.json")
+# saved result pages of each directory and the records browser mode collected from them (expected.json)
+FIXTURES_DIR = "resources/governmental_websites/fixtures/eportugal"
 # should the client run in headless mode
 HEADLESS = True
 # standard sleep times
 SLEEP_SHORT = 3
 SLEEP_MEDIUM = 8
 SLEEP_LONG = 30
+# result pages fetched at once in http mode
+HTTP_WORKERS = 8
+# seconds before a result page request is given up
+HTTP_TIMEOUT = 30
+# firefox user agent, as the directory is visited in browser mode
+HTTP_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0"
 
 PUBLIC_WEBSITE_DIRECTORIES = {
     "entidades": "https://eportugal.gov.pt/entidades/",
     "directorio_dos_sitios_publicos": "https://eportugal.gov.pt/diretorio-dos-sitios-publicos/-/pesquisa/search_cyberspace?_searchresults_formDate=1657019500131&_searchresults_keywords=&_searchresults_portalCategoryTypesId=&_searchresults_TipodeCanais+238346=on&_searchresults_checkboxNames=Categorias+238338%2CCategorias+238341%2CCategorias+238339%2CCategorias+238459%2CCategorias+238483%2CCategorias+1996102%2CCategorias+238336%2CCategorias+238340%2CCategorias+238492%2CAreasGovernativas+238357%2CAreasGovernativas+238521%2CAreasGovernativas+238361%2CAreasGovernativas+238360%2CAreasGovernativas+238519%2CAreasGovernativas+238358%2CAreasGovernativas+238512%2CAreasGovernativas+238359%2CAreasGovernativas+11216967%2CAreasGovernativas+238515%2CAreasGovernativas+238511%2CAreasGovernativas+238513%2CAreasGovernativas+238362%2CAreasGovernativas+238514%2CAreasGovernativas+238509%2CAreasGovernativas+238520%2CAreasGovernativas+238518%2CAreasGovernativas+238510%2CAreasGovernativas+238522%2CAreasGovernativas+238517%2CAreasGovernativas+238516%2CTipodeSites+238354%2CTipodeSites+238355%2CTipodeCanais+238347%2CTipodeCanais+238348%2CTipodeCanais+238346&pageSequenceNumber=2",
 }
+# query parameter numbering the result pages of each directory, the pages rendered by the "more" button
+PAGE_PARAMETERS = {
+    "entidades": "pageSequenceNumber",
+    "directorio_dos_sitios_publicos": "pageSequenceNumber",
+}
+# xpaths of the elements holding the data of each website, in the directorio and in entidades
+DIRECTORIO_XPATH = "//h3[@class = 'search-item-title']"
+ENTIDADES_XPATH = "//div[@class = 'pl-3 pb-5 search-item']"
+ENTIDADES_PREFIX = "https://eportugal.gov.pt/entidades/"
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(
+        prog="scrape_eportugal_data",
+        description="Scrape the websites listed in the eportugal directories into eportugal.json.",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        dest="mode",
+        choices=["browser", "http"],
+        default="browser",
+        help="'browser' renders all the results in firefox, clicking the 'more' button; 'http' fetches the result pages directly, in parallel, without a browser",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=HTTP_WORKERS,
+        help="Result pages fetched at once in http mode",
+    )
+    parser.add_argument(
+        "-hd",
+        "--html-dir",
+        dest="html_dir",
+        type=str,
+        default=None,
+        help="Parse the result pages saved in this directory (<directory>_<page>.html, e.g. entidades_1.html) instead of fetching them, in http mode",
+    )
+    parser.add_argument(
+        "-sh",
+        "--save-html",
+        dest="save_html",
+        type=str,
+        default=None,
+        help="Save the result pages fetched in http mode to this directory, e.g. to be parsed again with --html-dir",
+    )
+    parser.add_argument(
+        "-cf",
+        "--check-fixtures",
+        dest="check_fixtures",
+        action="store_true",
+        default=False,
+        help=f"Only check that the http mode parser gives the records browser mode collected from the saved pages in {FIXTURES_DIR}?",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output_path",
+        type=str,
+        default=OUTPUT_PATH,
+        help="Path of the json with the websites",
+    )
+    return vars(parser.parse_args())
 
 
 def deploy_firefox(
@@ -48,10 +116,15 @@ def deploy_firefox(
     headless: bool = False,
     geckodriver_log_path: Optional[str] = None,
     **kwargs,
-) -> Firefox:
+) -> "Firefox":
     """
     launches a firefox instance using the same browser version asgit OpenWPM
     """
+    # selenium and OpenWPM are only needed in browser mode
+    from selenium.webdriver import Firefox
+    from openwpm.utilities.platform_utils import get_firefox_binary_path
+    from openwpm.deploy_browsers.selenium_firefox import Options
+
     if not geckodriver_log_path:
         geckodriver_log_path = os.devnull
     firefox_binary_path = firefox_binary_path or get_firefox_binary_path()
@@ -68,7 +141,7 @@ def deploy_firefox(
     return driver
 
 
-def visit_public_website_directory(driver: Firefox, url: str) -> None:
+def visit_public_website_directory(driver: "Firefox", url: str) -> None:
     """Visit the target website and accept cookies if needed"""
     driver.get(url)
     # accept cookies if needed
@@ -76,14 +149,16 @@ def visit_public_website_directory(driver: Firefox, url: str) -> None:
 
 
 def _find_element(
-    driver: Firefox,
+    driver: "Firefox",
     element_id: Optional[str] = None,
     element_xpath: Optional[str] = None,
-) -> Optional[WebElement]:
+) -> Optional["WebElement"]:
     """
     wait for an element to appear, if there click on it, else timeout.
     return a boolean for whether the button was clicked
     """
+    from selenium.webdriver.common.by import By
+
     if element_id:
         method = By.ID
         value = element_id
@@ -100,15 +175,19 @@ def _find_element(
 
 
 def click(
-    driver_or_webelement: Union[Firefox, WebElement],
+    driver_or_webelement: Union["Firefox", "WebElement"],
     element_id: Optional[str] = None,
     element_xpath: Optional[str] = None,
     timeout: int = 10,
-) -> Optional[WebElement]:
+) -> Optional["WebElement"]:
     """
     wait for an element to appear, if there click on it, else timeout.
     return a boolean for whether the button was clicked
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     if element_id:
         method = By.ID
         value = element_id
@@ -130,12 +209,12 @@ def click(
         return element
 
 
-def accept_cookies(driver: Firefox) -> None:
+def accept_cookies(driver: "Firefox") -> None:
     """If the cookie banner appears, accept all cookies"""
     click(driver, element_id="onetrust-button-group-parent")
 
 
-def render_all_websites(driver: Firefox, **kwargs) -> None:
+def render_all_websites(driver: "Firefox", **kwargs) -> None:
     """render all pages given the infinite loop for rendering pages present in the websites"""
     clicked = True
     while clicked:
@@ -146,7 +225,7 @@ def render_all_websites(driver: Firefox, **kwargs) -> None:
             clicked = False
 
 
-def select_websites_filter(driver: Firefox) -> None:
+def select_websites_filter(driver: "Firefox") -> None:
     """select the 'Websites' filter"""
     _ = click(
         driver,
@@ -154,7 +233,7 @@ def select_websites_filter(driver: Firefox) -> None:
     )
 
 
-def parse_website_holder_element_directorio(element: WebElement) -> dict:
+def parse_website_holder_element_directorio(element: "WebElement") -> dict:
     """extract the relevant data from the webelement holding the website data"""
     anchor_tag = _find_element(element, element_xpath="./a")
     return {
@@ -166,7 +245,7 @@ def parse_website_holder_element_directorio(element: WebElement) -> dict:
     }
 
 
-def parse_website_holder_element_entidades(element: WebElement) -> dict:
+def parse_website_holder_element_entidades(element: "WebElement") -> dict:
     """extract the relevant data from the webelement holding the website data"""
     first_anchor_tag = _find_element(element, element_xpath="./h3/a")
     if first_anchor_tag:
@@ -176,8 +255,8 @@ def parse_website_holder_element_entidades(element: WebElement) -> dict:
     )
     if url:
         url = url.get_attribute("href")
-        if "https://eportugal.gov.pt/entidades/" in url:
-            url = url.split("https://eportugal.gov.pt/entidades/")[1]
+        if ENTIDADES_PREFIX in url:
+            url = url.split(ENTIDADES_PREFIX)[1]
     return {
         "url": url,
         "page_title": first_anchor_tag,
@@ -186,7 +265,7 @@ def parse_website_holder_element_entidades(element: WebElement) -> dict:
 
 
 def parse_website_holder_element(
-    element: WebElement, is_directorio_dos_servicos_publicos: bool = True
+    element: "WebElement", is_directorio_dos_servicos_publicos: bool = True
 ) -> dict:
     """extract the relevant data from the webelement holding the website data"""
     if is_directorio_dos_servicos_publicos:
@@ -196,13 +275,15 @@ def parse_website_holder_element(
 
 
 def collect_website_data(
-    driver: Firefox,
+    driver: "Firefox",
     is_directorio_dos_serviços_publicos: bool = True,
-) -> None:
+) -> dict:
+    from selenium.webdriver.common.by import By
+
     if is_directorio_dos_serviços_publicos:
-        xpath = "//h3[@class = 'search-item-title']"
+        xpath = DIRECTORIO_XPATH
     else:
-        xpath = "//div[@class = 'pl-3 pb-5 search-item']"
+        xpath = ENTIDADES_XPATH
     website_header_elems = driver.find_elements(By.XPATH, xpath)
     if not website_header_elems:
         raise ValueError(f"Could not identify the elements with '{xpath}'.")
@@ -216,8 +297,166 @@ def collect_website_data(
     return website_data
 
 
-def main() -> None:
-    """run the scraper"""
+## http mode
+def _element_text(element) -> str:
+    """Visible text of an lxml element, with the whitespace collapsed as selenium does"""
+    return " ".join(element.text_content().split())
+
+
+def parse_results_page(
+    html: Union[str, bytes], base_url: str, is_directorio_dos_servicos_publicos: bool = True
+) -> list:
+    """
+    Data of the websites listed in a result page, as parse_website_holder_element does for the rendered page.
+    The links are resolved against base_url, as firefox does for the href property.
+    """
+    try:
+        import lxml.html
+    except ImportError as e:
+        raise ImportError("The http mode requires lxml, install it with `pip install lxml`") from e
+    if isinstance(html, bytes):
+        # the portal is served in utf-8, lxml would guess latin-1 for pages without a charset
+        html = html.decode("utf-8", errors="replace")
+    if not html.strip():
+        return []
+    tree = lxml.html.fromstring(html)
+    out = []
+    if is_directorio_dos_servicos_publicos:
+        for element in tree.xpath(DIRECTORIO_XPATH):
+            anchors = element.xpath("./a")
+            if not anchors:
+                continue
+            info = element.xpath("../div[@class = 'search-item-info']")
+            out.append(
+                {
+                    "url": urljoin(base_url, anchors[0].get("href", "")),
+                    "page_title": _element_text(anchors[0]),
+                    "entity": _element_text(info[0]) if info else None,
+                }
+            )
+    else:
+        for element in tree.xpath(ENTIDADES_XPATH):
+            title = element.xpath("./h3/a")
+            title = _element_text(title[0]) if title else None
+            url = element.xpath("./div[@class = 'search-item-links pb-3']/a")
+            url = urljoin(base_url, url[0].get("href", "")) if url else None
+            if url and ENTIDADES_PREFIX in url:
+                url = url.split(ENTIDADES_PREFIX)[1]
+            out.append({"url": url, "page_title": title, "entity": title})
+    return out
+
+
+def page_url(url: str, parameter: str, page: int) -> str:
+    """Url of a result page of a directory, setting its page number parameter"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != parameter]
+    query.append((parameter, str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def http_session(workers: int = HTTP_WORKERS):
+    """requests session keeping a connection per worker alive, retrying the failed requests with a backoff"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": HTTP_USER_AGENT, "Accept-Language": "pt-PT,pt;q=0.9"})
+    return session
+
+
+def read_saved_pages(html_dir: str, data_source: str) -> list:
+    """Saved result pages of a directory, in page order"""
+    pattern = re.compile(re.escape(data_source) + r"_(\d+)\.html$")
+    pages = []
+    for name in os.listdir(html_dir):
+        match = pattern.match(name)
+        if match:
+            with open(os.path.join(html_dir, name), "rb") as f:
+                pages.append((int(match.group(1)), f.read()))
+    return [html for _, html in sorted(pages)]
+
+
+def fetch_result_pages(
+    session, data_source: str, url: str, workers: int = HTTP_WORKERS, save_html: Optional[str] = None
+) -> list:
+    """
+    Fetch the result pages of a directory, workers pages at a time, until a page lists no website, repeats the
+    previous one or is answered with a 4xx (past the last page). Returns the pages in order.
+    Raises ValueError if the second page repeats the first one: the portal ignored the page parameter, and the
+    first page alone would pass for the whole directory
+    """
+    parameter = PAGE_PARAMETERS[data_source]
+
+    def fetch(page: int) -> Optional[bytes]:
+        response = session.get(page_url(url, parameter, page), timeout=HTTP_TIMEOUT)
+        # the pages past the last one may be answered with a client error, the end of the results
+        if page > 1 and 400 <= response.status_code < 500:
+            return None
+        response.raise_for_status()
+        return response.content
+
+    is_directorio = "sitios" in data_source
+    pages = []
+    previous = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        first = 1
+        while True:
+            futures = [executor.submit(fetch, page) for page in range(first, first + workers)]
+            # in page order, so that the error of a page is only raised once the pages before it are kept
+            for future in futures:
+                html = future.result()
+                websites = parse_results_page(html, url, is_directorio) if html is not None else []
+                if websites and websites == previous and len(pages) == 1:
+                    raise ValueError(
+                        f"The second result page of {data_source} repeats the first one, "
+                        f"the {parameter} parameter of {url} has no effect."
+                    )
+                if not websites or websites == previous:
+                    print(f"[+] {data_source}: {len(pages)} result pages")
+                    return pages
+                previous = websites
+                if save_html:
+                    os.makedirs(save_html, exist_ok=True)
+                    with open(os.path.join(save_html, f"{data_source}_{len(pages) + 1}.html"), "wb") as f:
+                        f.write(html)
+                pages.append(html)
+            first += workers
+
+
+def collect_website_data_http(
+    pages: list, base_url: str, is_directorio_dos_servicos_publicos: bool = True
+) -> dict:
+    """Data of the websites listed in the result pages, keyed by their order like collect_website_data"""
+    website_data = {}
+    for html in pages:
+        for website in parse_results_page(html, base_url, is_directorio_dos_servicos_publicos):
+            website_data[len(website_data)] = website
+    if not website_data:
+        raise ValueError(f"Could not identify the websites in the result pages of {base_url}.")
+    return website_data
+
+
+def merge_website_data(container: list) -> dict:
+    """Merge the websites of all the directories, keeping the first record of each url"""
+    i = 0
+    website_data = {}
+    urls_added = set()
+    for source_dict in container:
+        for _, cur_dict in source_dict.items():
+            if cur_dict.get("url") not in urls_added:
+                urls_added.add(cur_dict.get("url"))
+                website_data[i] = cur_dict
+                i += 1
+    return website_data
+
+
+def scrape_browser() -> list:
+    """Websites of each directory, rendering all of its results in firefox"""
     driver = deploy_firefox(headless=HEADLESS)
     container = []
     for data_source, url in PUBLIC_WEBSITE_DIRECTORIES.items():
@@ -233,20 +472,72 @@ def main() -> None:
                 driver=driver, is_directorio_dos_serviços_publicos=is_sitios_publicos
             )
         )
-    # merge them
-    i = 0
-    website_data = {}
-    urls_added = set()
-    for source_dict in container:
-        for _, cur_dict in source_dict.items():
-            if cur_dict.get("url") not in urls_added:
-                website_data[i] = cur_dict
-                i += 1
-    with open(OUTPUT_PATH, "w") as f:
-        json.dump(website_data, f, indent=4, ensure_ascii=False)
     driver.close()
     driver.quit()
+    return container
+
+
+def scrape_http(
+    workers: int = HTTP_WORKERS, html_dir: Optional[str] = None, save_html: Optional[str] = None
+) -> list:
+    """Websites of each directory, from its result pages fetched over http (or saved in html_dir)"""
+    session = None if html_dir else http_session(workers)
+    container = []
+    for data_source, url in PUBLIC_WEBSITE_DIRECTORIES.items():
+        if html_dir:
+            pages = read_saved_pages(html_dir, data_source)
+        else:
+            pages = fetch_result_pages(session, data_source, url, workers=workers, save_html=save_html)
+        container.append(
+            collect_website_data_http(
+                pages, url, is_directorio_dos_servicos_publicos="sitios" in data_source
+            )
+        )
+    return container
+
+
+def verify_fixtures(fixtures_dir: str = FIXTURES_DIR) -> bool:
+    """
+    Parse the saved result pages of the fixtures as the http mode does and compare the merged records with the
+    ones browser mode collected from the same pages (expected.json). Returns whether they match
+    """
+    with open(os.path.join(fixtures_dir, "expected.json"), "r", encoding="utf-8") as f:
+        expected = {int(k): v for k, v in json.load(f).items()}
+    website_data = merge_website_data(scrape_http(html_dir=fixtures_dir))
+    ok = True
+    for i in sorted(set(expected) | set(website_data)):
+        if website_data.get(i) != expected.get(i):
+            ok = False
+            print(f"[!] Record {i}: parsed {website_data.get(i)}, browser mode {expected.get(i)}")
+    print(
+        f"[+] {len(website_data)} records parsed from the fixtures, "
+        + ("the same as browser mode" if ok else "they differ from browser mode")
+    )
+    return ok
+
+
+def main(
+    mode: str = "browser",
+    workers: int = HTTP_WORKERS,
+    html_dir: Optional[str] = None,
+    save_html: Optional[str] = None,
+    output_path: str = OUTPUT_PATH,
+    check_fixtures: bool = False,
+) -> None:
+    """run the scraper"""
+    if check_fixtures:
+        sys.exit(0 if verify_fixtures() else 1)
+    start = time.perf_counter()
+    if mode == "http":
+        container = scrape_http(workers=workers, html_dir=html_dir, save_html=save_html)
+    else:
+        container = scrape_browser()
+    # merge them
+    website_data = merge_website_data(container)
+    with open(output_path, "w") as f:
+        json.dump(website_data, f, indent=4, ensure_ascii=False)
+    print(f"[+] {len(website_data)} websites scraped in {time.perf_counter() - start:.0f}s ({mode} mode)")
 
 
 if __name__ == "__main__":
-    main()
+    main(**parse_args())
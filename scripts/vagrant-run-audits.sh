@@ -19,6 +19,7 @@ OPTIONS:
    -k | --activation-code Expressvpn activation code
    -v | --vpn Should it use vpn
    -n | --n-websites Number of websites to crawl, if left empty all websites will be used
+   -id | --run-id Stable run identifier passed to run-audits.sh, re-using it resumes unfinished audits
 EOF
 
 }
@@ -34,6 +35,7 @@ USE_VPN=0
 MAX_COOKIES=5000
 ACTIVATION_CODE=""
 N_WEBSITES=""
+RUN_ID=""
 
 ## parse the arguments
 while true; do
@@ -66,6 +68,12 @@ while true; do
             shift
         fi
         ;;
+    -id | --run-id)
+        if [ "$2" ]; then
+            RUN_ID="$2"
+            shift
+        fi
+        ;;
     -k | --activation-code)
         if [ "$2" ]; then
             ACTIVATION_CODE="$2"
@@ -146,17 +154,22 @@ run_script() {
     # arg 1 expressvpn alias which will be the name of a machine
     # hostname of the host machine for dedupling parallel scripts
     command_prefix="cd /home/vagrant/govcookiespt;"
+    # pass the run id on, so that a retry resumes the unfinished audits
+    run_id_flag=""
+    if [ -n "$RUN_ID" ]; then
+        run_id_flag="--run-id ${RUN_ID}"
+    fi
     # if the user did not define locations, do not use the 
     if [[ $USE_VPN -gt 0 ]]; then
         echo ""
         echo "[+] Using vpn set to '$1'"
         echo ""
-        command_final="$command_prefix bash scripts/run-audits.sh --replications ${REPS} --location $1 --name-prefix "${TRIAL_NAME_PREFIX}_${HOSTNAME}" --n-websites ${N_WEBSITES} -headless"
+        command_final="$command_prefix bash scripts/run-audits.sh --replications ${REPS} --location $1 --name-prefix "${TRIAL_NAME_PREFIX}_${HOSTNAME}" --n-websites ${N_WEBSITES} ${run_id_flag} -headless"
         disconnect_from_vpn $1
         start_vpn $1
     else
         # no vpn
-        command_final="$command_prefix bash scripts/run-audits.sh --replications ${REPS} --name-prefix "${TRIAL_NAME_PREFIX}_${HOSTNAME}" --n-websites ${N_WEBSITES} -headless"
+        command_final="$command_prefix bash scripts/run-audits.sh --replications ${REPS} --name-prefix "${TRIAL_NAME_PREFIX}_${HOSTNAME}" --n-websites ${N_WEBSITES} ${run_id_flag} -headless"
     fi
     echo ""
     echo "[+] Running tracking audit in $1"
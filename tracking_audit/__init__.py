@@ -1,3 +1,21 @@
+import importlib
 from tracking_audit.constants import *
-from tracking_audit.audit import Audit
-from tracking_audit.utils import current_location
\ No newline at end of file
+
+# imported on first use, so that importing the package does not load OpenWPM, pandas or requests
+_LAZY_ATTRIBUTES = {
+    "Audit": "tracking_audit.audit",
+    "current_location": "tracking_audit.utils",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+        globals()[name] = value
+        return value
+    # the constants read from config.ini
+    return getattr(constants, name)
+
+
+def __dir__() -> list:
+    return sorted({*globals(), *_LAZY_ATTRIBUTES, *CONFIG_CONSTANTS})
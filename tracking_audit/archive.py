@@ -0,0 +1,217 @@
+import os
+import gzip
+import json
+import shutil
+import tarfile
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional
+
+# bytes read from a file at a time while compressing it
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+def _compress_file(path: str, parts_dir: str, compresslevel: int) -> tuple:
+    """
+    Gzip a file in a worker process, streaming it in chunks into a temporary file of parts_dir.
+    Returns (path, compressed path, original size)
+    """
+    fd, part_path = tempfile.mkstemp(suffix=".gz", dir=parts_dir)
+    with open(path, "rb") as src, os.fdopen(fd, "wb") as part, gzip.GzipFile(
+        filename=os.path.basename(path),
+        mode="wb",
+        fileobj=part,
+        compresslevel=compresslevel,
+        mtime=int(os.path.getmtime(path)),
+    ) as dst:
+        shutil.copyfileobj(src, dst, READ_CHUNK_BYTES)
+    return path, part_path, os.path.getsize(path)
+
+
+def manifest_path(archive_path: str) -> str:
+    """Path of the manifest of an archive"""
+    return archive_path + ".manifest.json"
+
+
+def journal_path(archive_path: str) -> str:
+    """Path of the manifest being written, one json line per member on disk, while the archive is not finished"""
+    return archive_path + ".manifest.jsonl"
+
+
+def _read_journal(archive_path: str) -> dict:
+    """Members written by an unfinished archive, name -> entry. A line cut by a crash is ignored"""
+    manifest = {}
+    with open(journal_path(archive_path), "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            manifest[entry.pop("name")] = entry
+    return manifest
+
+
+def _fsync(f) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def archive(
+    files: list,
+    archive_path: str,
+    base_dir: Optional[str] = None,
+    workers: Optional[int] = None,
+    remove_sources: bool = True,
+    compresslevel: int = 6,
+) -> dict:
+    """
+    Archive files into an uncompressed tar whose members are individually gzipped (<name>.gz).
+    Files are compressed in parallel by a process pool, each one streamed into a temporary file next to the
+    archive, and copied into the tar as they are ready; each source file is removed as soon as its member is
+    on disk, so the disk usage does not double.
+    Each member is recorded in a journal (<archive>.manifest.jsonl) once the tar is synced, and only then is its
+    source removed. Archiving again after a crash resumes the archive: the tar is cut after the last member in
+    the journal and the files left are appended. A finished archive, or a file without a journal, is never
+    overwritten.
+    A json manifest with the offset and size of each member is written next to the archive, so a single
+    file can be read back without unpacking the rest (see extract_member). The archive itself can also be
+    unpacked with `tar -xf` followed by `gunzip`.
+        files: list; paths of the files to archive
+        archive_path: str; path of the tar file to write
+        base_dir: str; member names are the file paths relative to it, defaults to the file names
+        workers: int; number of compression processes, defaults to the number of cores
+        remove_sources: bool; delete each file once archived
+        compresslevel: int; gzip compression level
+    Returns the manifest.
+    """
+    workers = workers or os.cpu_count() or 1
+    manifest = {}
+    if os.path.isfile(journal_path(archive_path)):
+        manifest = _read_journal(archive_path)
+        print(f"[+] Resuming {archive_path}, {len(manifest)} files already archived")
+    elif os.path.exists(archive_path) or os.path.exists(manifest_path(archive_path)):
+        raise FileExistsError(f"{archive_path} already exists, refusing to overwrite it")
+
+    def member_name(path: str) -> str:
+        return (os.path.relpath(path, base_dir) if base_dir else os.path.basename(path)) + ".gz"
+
+    to_compress = []
+    for path in files:
+        if member_name(path) not in manifest:
+            to_compress.append(path)
+        elif remove_sources and os.path.isfile(path):
+            # archived, the crash happened before its source was removed
+            os.remove(path)
+    # the tar ends after the last member recorded, whatever was written after it is cut
+    end = max(
+        (e["offset"] + -(-e["size"] // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE for e in manifest.values()),
+        default=0,
+    )
+    parts_dir = archive_path + ".parts"
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir)
+    with open(archive_path, "r+b" if manifest else "wb") as f, open(
+        journal_path(archive_path), "a"
+    ) as journal:
+        f.seek(end)
+        f.truncate()
+        with tarfile.open(fileobj=f, mode="w") as tar, ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            to_compress = iter(to_compress)
+            while True:
+                # keep a bounded number of compressed files waiting on disk
+                for path in to_compress:
+                    pending.add(executor.submit(_compress_file, path, parts_dir, compresslevel))
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, part_path, original_size = future.result()
+                    name = member_name(path)
+                    info = tarfile.TarInfo(name)
+                    info.size = os.path.getsize(part_path)
+                    info.mtime = int(os.path.getmtime(path))
+                    with open(part_path, "rb") as part:
+                        tar.addfile(info, part)
+                    os.remove(part_path)
+                    # the data of the member ends at the current offset, padded to 512 byte blocks
+                    blocks = -(-info.size // tarfile.BLOCKSIZE)
+                    manifest[name] = {
+                        "offset": tar.offset - blocks * tarfile.BLOCKSIZE,
+                        "size": info.size,
+                        "original_size": original_size,
+                    }
+                    # the member is on disk and recorded before its source is removed
+                    _fsync(f)
+                    journal.write(json.dumps({"name": name, **manifest[name]}) + "\n")
+                    _fsync(journal)
+                    if remove_sources:
+                        os.remove(path)
+        _fsync(f)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    tmp_path = manifest_path(archive_path) + ".tmp"
+    with open(tmp_path, "w") as m:
+        json.dump(manifest, m, indent=1)
+        _fsync(m)
+    os.replace(tmp_path, manifest_path(archive_path))
+    # the archive is finished
+    os.remove(journal_path(archive_path))
+    return manifest
+
+
+def _archive_path_for(path: str) -> str:
+    """
+    <path>.tar, resumed if unfinished. A finished one is kept and the files go to <path>.1.tar, <path>.2.tar, ...
+    e.g. the screenshots taken by a resumed audit
+    """
+    archive_path = path + ".tar"
+    n = 0
+    while os.path.exists(archive_path) and not os.path.isfile(journal_path(archive_path)):
+        n += 1
+        archive_path = f"{path}.{n}.tar"
+    return archive_path
+
+
+def archive_dir(
+    dir_path: str, workers: Optional[int] = None, remove_sources: bool = True
+) -> Optional[str]:
+    """Archive all the files under a directory into <dir_path>.tar and remove the directory. Returns the archive path"""
+    if not os.path.isdir(dir_path):
+        return None
+    files = [
+        os.path.join(root, f) for root, _, names in os.walk(dir_path) for f in names
+    ]
+    archive_path = _archive_path_for(dir_path.rstrip(os.sep))
+    archive(
+        files,
+        archive_path,
+        base_dir=dir_path,
+        workers=workers,
+        remove_sources=remove_sources,
+    )
+    if remove_sources:
+        shutil.rmtree(dir_path)
+    return archive_path
+
+
+def archive_file(path: str, remove_source: bool = True) -> Optional[str]:
+    """Archive a single file into <path>.tar. Returns the archive path"""
+    if not os.path.isfile(path):
+        return None
+    archive_path = _archive_path_for(path)
+    archive([path], archive_path, workers=1, remove_sources=remove_source)
+    return archive_path
+
+
+def extract_member(archive_path: str, name: str) -> bytes:
+    """Read and decompress one file of an archive using its manifest, e.g. extract_member("screenshots.tar", "1234-abc.png")"""
+    with open(manifest_path(archive_path), "r") as f:
+        manifest = json.load(f)
+    entry = manifest.get(name) or manifest.get(name + ".gz")
+    if entry is None:
+        raise KeyError(f"{name} is not in {archive_path}")
+    with open(archive_path, "rb") as f:
+        f.seek(entry["offset"])
+        return gzip.decompress(f.read(entry["size"]))
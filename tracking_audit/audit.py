@@ -3,14 +3,21 @@ import os
 import random
 import sqlite3
 from typing import Optional
-import pandas as pd
-import sys
+import socket
 import time
+import threading
+from collections import deque
 from datetime import datetime
-from .other_commands import ScheduleManager
+from .scheduling import ActiveWindow
+from .politeness import PolitenessScheduler
+from .work_queue import SQLiteWorkQueue
+from .metrics import CrawlMetrics
+from .retries import RetryQueue, classify_failure, visit_outcomes
+from .profiles import SeedProfileCache
+from .browser_pool import BrowserPool
+from .timeouts import SiteTimeouts, get_command_history, timeout_savings, visit_commands
 from .constants import (
     GET_REQUEST_TIMEOUT,
-    PATH_TO_OPENWPM,
     OUTPUT_DIR,
     PROFILES_SUBDIR,
     DEFAULT_AUDIT_NAME,
@@ -18,20 +25,22 @@ from .constants import (
     SLEEP_TIME_UNIFORM_DIST_MIN,
     ACTIVE_STATUS_START,
     ACTIVE_STATUS_STOP,
+    VISIT_LEDGER_FILENAME,
+    HOST_COOLDOWN_SECONDS,
+    WORK_QUEUE_POLL_SECONDS,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_HISTORY_WAIT_SECONDS,
+    BROWSER_RECYCLE_VISITS,
+    BROWSER_RECYCLE_RSS_MB,
+    INSTRUMENTS,
+    INSTRUMENT_PRESETS,
+    DEFAULT_INSTRUMENT_PRESET,
 )
-from .utils import _tar
-
-sys.path.insert(0, PATH_TO_OPENWPM)
-from openwpm.command_sequence import CommandSequence
-from openwpm.commands.browser_commands import (
-    GetCommand,
-    ScreenshotFullPageCommand,
-    RecursiveDumpPageSourceCommand,
-)
-from openwpm.config import BrowserParams, ManagerParams
-from openwpm.storage.sql_provider import SQLiteStorageProvider
-from openwpm.storage.leveldb import LevelDbProvider
-from openwpm.task_manager import TaskManager
+from .ledger import VisitLedger
+from .cookie_counter import CookieCounter
+from .archive import archive_dir, archive_file
+from .content_store import ContentStore
+from .utils import add_openwpm_to_path
 
 
 class Audit(object):
@@ -49,6 +58,20 @@ class Audit(object):
         scrape_ads: bool = True,
         output_dir: str = OUTPUT_DIR,
         timeout=87000,
+        host_cooldown: float = HOST_COOLDOWN_SECONDS,
+        cooldown_per_ip: bool = False,
+        work_queue: Optional[str] = None,
+        worker_id: Optional[str] = None,
+        content_store: Optional[str] = None,
+        timeout_history: Optional[list] = None,
+        timeout_stats: Optional[str] = None,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        recycle_visits: Optional[int] = BROWSER_RECYCLE_VISITS,
+        recycle_rss_mb: Optional[float] = BROWSER_RECYCLE_RSS_MB,
+        instruments: str = DEFAULT_INSTRUMENT_PRESET,
+        dwell_range: tuple = (SLEEP_TIME_UNIFORM_DIST_MIN, SLEEP_TIME_UNIFORM_DIST_MAX),
+        active_hours: tuple = (ACTIVE_STATUS_START, ACTIVE_STATUS_STOP),
+        browser_prefs: Optional[dict] = None,
     ) -> None:
         """
         headless: bool; should the browser be launched in headless mode (see: https://github.com/mozilla/OpenWPM/blob/491262e9a9f1a9397abba47bc500f2495971bce4/docs/Configuration.md)
@@ -56,6 +79,20 @@ class Audit(object):
         browser_n: int; number of crawlers
         path_to_seed_profile: str; path to the tar or tar.gz profile defaults to an existing profile in the folder /resources/profile_archive/[AUDIT_NAME], if missing it creates a new one
         audit_name: name of the output folder for this audit
+        host_cooldown: float; seconds between the end of a visit and the next visit to the same registered domain
+        cooldown_per_ip: bool; also apply the host cooldown per ip address, e.g. for sites sharing a hosting provider
+        work_queue: str; path to a sqlite work queue shared with other crawler processes, the websites are leased from it instead of crawling the whole list
+        worker_id: str; unique name of this crawler process in the work queue, defaults to the hostname
+        content_store: str; directory of a content-addressed store shared by many audits, where the saved response bodies (resources_to_save) are stored once instead of in a per-audit LevelDB
+        timeout_history: list; output directories or databases of previous audits (or warehouses) to learn per-site page load timeouts from
+        timeout_stats: str; json file with the page loads of each site, read like timeout_history and updated at the end of the crawl
+        max_attempts: int; visits of a site at most, the failed visits worth retrying are visited again at the end of the crawl, 1 to never retry
+        recycle_visits: int; restart a browser between two visits after this many visits, never if None
+        recycle_rss_mb: float; restart a browser between two visits once its processes use more memory (MB), never if None
+        instruments: str; preset of OpenWPM instruments to turn on, see INSTRUMENT_PRESETS in constants.py
+        dwell_range: tuple; (min, max) seconds a page stays open after loading, drawn uniformly for each visit
+        active_hours: tuple; (first, last) hour of the day in which sites are visited, (0, 23) to crawl all day
+        browser_prefs: dict or None; extra firefox preferences of every browser, e.g. {"network.dns.forceResolve": "127.0.0.1"}
         """
         # run the browser client in headless mode ?
         self.display_mode = "headless" if headless else "native"
@@ -67,13 +104,23 @@ class Audit(object):
         self.audit_name = audit_name
         # timeout for selenium
         self.timeout = timeout
+        # instruments recording the visits
+        if instruments not in INSTRUMENT_PRESETS:
+            raise ValueError(
+                f"Unknown instruments preset '{instruments}', use one of {', '.join(INSTRUMENT_PRESETS)}"
+            )
+        self.instruments = instruments
+        self.dwell_range = dwell_range
+        self.active_hours = active_hours
+        self.browser_prefs = browser_prefs or {}
+        # politeness towards the hosts visited
+        self.host_cooldown = host_cooldown
+        self.cooldown_per_ip = cooldown_per_ip
         ## Create some relevant directories
-        if not os.path.isdir(output_dir):
-            os.mkdir(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
         # parent directory for the output
         parent_output_dir = os.path.join(output_dir, self.audit_name)
-        if not os.path.isdir(parent_output_dir):
-            os.mkdir(parent_output_dir)
+        os.makedirs(parent_output_dir, exist_ok=True)
         self.parent_output_dir = parent_output_dir
         # output sqlite database
         self.output_db = Path(
@@ -81,10 +128,27 @@ class Audit(object):
         )
         # output content db
         self.content_db = Path(os.path.join(parent_output_dir, "saved_content"))
+        # ledger with the status of each site visit, used for resuming the audit
+        self.ledger_path = Path(os.path.join(parent_output_dir, VISIT_LEDGER_FILENAME))
         # comma-separated resources to save. On the resources see: https://developer.mozilla.org/en-US/docs/Mozilla/Add-ons/WebExtensions/API/webRequest/ResourceType
         self.resources_to_save = resources_to_save
+        # shared content-addressed store for the saved resources
+        self.content_store = content_store
         # should we scrape ads using gpt api?
         self.scrape_ads = scrape_ads
+        # per-site GetCommand timeouts learned from previous audits, the fixed GET_REQUEST_TIMEOUT if None
+        self.site_timeouts = None
+        self.timeout_stats = timeout_stats
+        if timeout_history or timeout_stats:
+            self.site_timeouts = SiteTimeouts.from_history(
+                list(timeout_history or []) + ([timeout_stats] if timeout_stats else [])
+            )
+        # adaptive timeout given to each site visited, for the sanity report
+        self.timeouts_used = {}
+        # failed visits retried with a backoff once the other sites are visited
+        self.retries = RetryQueue(max_attempts=max_attempts)
+        # (rank, site, submission holding its visit_id, success, finished at) of the visits finished and not classified yet
+        self._finished_visits = deque()
         ## assign the websites
         # Remove websites already visited by the crawler from the list
         # if the database exists already, grab all the top_urls from the http_visits table
@@ -92,16 +156,44 @@ class Audit(object):
             raise TypeError("No websites were provided.")
         elif websites:
             self.websites = self.remove_already_visited(websites=websites)
+            # share the websites with the other workers, sites already in the queue are left as they are
+            self.work_queue = None
+            if work_queue:
+                self.work_queue = SQLiteWorkQueue(
+                    work_queue, worker_id=worker_id or socket.gethostname()
+                )
+                self.work_queue.populate(enumerate(websites))
             print(
                 f'[+] Going to crawl the following websites: {", ".join(self.websites)}'
             )
+            if self.site_timeouts:
+                known = self.site_timeouts.summary(self.websites)
+                print(
+                    f"[+] Adaptive timeouts for {known['sites_with_history']} websites, "
+                    f"{len(known['known_slow_sites'])} of them known to be slow"
+                )
         else:
             pass
         ## assignt the cookies ceiling
         self.max_cookies = max_cookies
+        # incremental counter of the unique cookies collected
+        self.cookie_counter = CookieCounter(self.output_db)
+        # pauses of the crawl outside of the active window
+        self.window_pauses = []
+        # crawl metrics, created when the crawl starts
+        self.metrics = None
+        # which browsers get the next visits and which ones are restarted before it
+        self.pool = BrowserPool(
+            browser_n, recycle_visits=recycle_visits, recycle_rss_mb=recycle_rss_mb
+        )
+        # seconds spent preparing the seed profile and launching the browsers
+        self.startup_timings = {"seed_profile": None, "browser_launches_seconds": []}
         # profile sub-dir
+        os.makedirs(PROFILES_SUBDIR, exist_ok=True)
         profile_subdir = os.path.join(PROFILES_SUBDIR, self.audit_name)
         self.profile_subdir = profile_subdir
+        # OpenWPM is only imported once an audit is set up, not with the package
+        add_openwpm_to_path()
         ## Define the manager parameters
         self.manager_config()
         ## Define the browser params
@@ -109,17 +201,37 @@ class Audit(object):
 
     def remove_already_visited(self, websites: list) -> list or None:
         """Remove websites already visited from the websites list"""
-        if os.path.isfile(self.output_db):
+        if os.path.isfile(self.ledger_path):
+            # resuming an audit: skip every site with a finished visit in the ledger
+            ledger = VisitLedger(self.ledger_path)
+            try:
+                # the retries queued when the previous run stopped are visited again
+                remaining = ledger.pending(websites, max_attempts=self.retries.max_attempts)
+                retries_left = ledger.retries_left(self.retries.max_attempts)
+            finally:
+                ledger.close()
+            # their next visit counts towards max_attempts
+            for site, attempts in retries_left.items():
+                self.retries.attempts[site] = attempts + 1
+            if len(remaining) < len(websites):
+                print(
+                    f"[+] Resuming the audit, {len(websites) - len(remaining)} websites were already visited"
+                )
+            if retries_left:
+                print(f"[+] {len(retries_left)} failed visits left to retry from the previous run")
+            return remaining
+        elif os.path.isfile(self.output_db):
+            # audits created before the ledger existed, fall back to the sites with recorded requests
             conn = sqlite3.connect(self.output_db)
             cur = conn.cursor()
-            already_visited = set()
-            for url, top_url in cur.execute(
-                "SELECT DISTINCT h.url, v.site_url "
-                "FROM http_requests as h JOIN site_visits as v ON "
-                "h.visit_id = v.visit_id;"
-            ):
-                already_visited.add(top_url)
-            already_visited = list(already_visited)
+            already_visited = {
+                top_url
+                for (top_url,) in cur.execute(
+                    "SELECT DISTINCT site_url FROM site_visits WHERE visit_id IN "
+                    "(SELECT DISTINCT visit_id FROM http_requests);"
+                )
+            }
+            conn.close()
             return [w for w in websites if w not in already_visited]
         else:
             return websites
@@ -133,18 +245,16 @@ class Audit(object):
         c.visit_id = v.visit_id AND c.browser_id = v.browser_id
         WHERE c.command == "GetCommand" AND c.error IS NOT NULL;
         """
+        import pandas as pd
+
         with sqlite3.connect(self.output_db) as con:
             result = pd.read_sql_query(sql=query, con=con)
         return result[["browser_id", "visit_id", "site_url", "error", "retry_number"]]
 
     def count_cookies(self):
         """Count how many unique cookies we have already in the db. Unique if (host, name, value) is unique"""
-        query = (
-            """ SELECT count(*) FROM javascript_cookies GROUP BY host, name, value;"""
-        )
-        with sqlite3.connect(self.output_db) as con:
-            result = pd.read_sql_query(sql=query, con=con)
-        return result.shape[0]
+        # only reads the rows added since the last count
+        return self.cookie_counter.refresh()
 
     def crawl_sanity_check(self) -> dict:
         """
@@ -160,13 +270,29 @@ class Audit(object):
         failed_dict = failed.to_dict("list")
         ## failed visits count
         failed_count = failed.shape[0]
-        return {
+        sanity_dict = {
             "total_cookies_collected": cookie_count,
             "failed_visits_count": failed_count,
             "failed_visits_dict": failed_dict,
         }
+        ## deduplication of the saved content
+        if self.resources_to_save and self.content_store:
+            store = ContentStore(self.content_store)
+            sanity_dict["saved_content"] = store.stats(audit=self.audit_name)
+            store.close()
+        ## failures by kind, retries and permanent failures
+        sanity_dict["retries"] = self.retries.summary()
+        ## wall-clock time saved by the adaptive timeouts
+        if self.site_timeouts and os.path.isfile(self.output_db):
+            sanity_dict["adaptive_timeouts"] = {
+                **self.site_timeouts.summary(self.websites),
+                **timeout_savings(self.output_db, self.timeouts_used),
+            }
+        return sanity_dict
 
     def manager_config(self) -> None:
+        from openwpm.config import ManagerParams
+
         # Loads the default ManagerParams and NUM_BROWSERS copies of the default BrowserParams
         manager_params = ManagerParams(num_browsers=self.browser_n)
         # Update TaskManager configuration (use this for crawl-wide settings)
@@ -181,30 +307,29 @@ class Audit(object):
         self.manager_params = manager_params
 
     def browser_config(self) -> None:
+        from openwpm.config import BrowserParams
+
         # create a browser params instance for all browsers
         browser_params = [
             BrowserParams(display_mode=self.display_mode) for _ in range(self.browser_n)
         ]
+        # one link per browser to the decompressed seed profile
+        seed_tars = self.prepare_seed_profile() if self.path_to_seed_profile else None
         # define the remaining browser parameters
-        for browser_param in browser_params:
+        for i, browser_param in enumerate(browser_params):
             # browser profilek archive
             browser_param.profile_archive_dir = Path(self.profile_subdir)
-            # Record HTTP Requests and Responses
-            browser_param.http_instrument = True
-            # Record cookie changes
-            browser_param.cookie_instrument = True
-            # Record Navigations
-            browser_param.navigation_instrument = True
-            # Record JS Web API calls
-            browser_param.js_instrument = True
-            # Record the callstack of all WebRequests made
-            browser_param.callstack_instrument = True
-            # Record DNS resolution
-            browser_param.dns_instrument = True
+            # Record the HTTP requests and responses, cookie changes, navigations, JS Web API calls, the callstack
+            # of all WebRequests and DNS resolution, as the preset says
+            enabled = INSTRUMENT_PRESETS[self.instruments]
+            for instrument in INSTRUMENTS:
+                setattr(browser_param, instrument, instrument in enabled)
             # Bot mitigation
             browser_param.bot_mitigation = True
             # allow third party cookies
             browser_param.tp_cookies = "always"
+            # extra firefox preferences
+            browser_param.prefs.update(self.browser_prefs)
             # do not track options
             browser_param.donottrack = False
             # tracking protection
@@ -213,8 +338,8 @@ class Audit(object):
             browser_param.profile_archive_dir = Path(self.profile_subdir)
             self.audit_profile_dir = Path(self.profile_subdir)  # assign as attribute
             # path to seed profile
-            if self.path_to_seed_profile:
-                browser_param.seed_tar = Path(self.path_to_seed_profile)
+            if seed_tars:
+                browser_param.seed_tar = seed_tars[i]
             else:
                 # creating a new one
                 pass
@@ -223,102 +348,420 @@ class Audit(object):
             if self.resources_to_save:
                 browser_param.save_content = self.resources_to_save
 
+    def prepare_seed_profile(self) -> list:
+        """
+        Decompress the seed profile once into the seed cache (see profiles.py) and link it for each browser,
+        recording the time it took. Returns the path to the seed tar of each browser.
+        """
+        cache = SeedProfileCache()
+        cached, timings = cache.get(self.path_to_seed_profile)
+        start = time.perf_counter()
+        seed_tars = [
+            Path(self.profile_subdir) / f"seed_browser_{i}.tar" for i in range(self.browser_n)
+        ]
+        methods = {cache.link(cached, seed_tar) for seed_tar in seed_tars}
+        timings["link_seconds"] = round(time.perf_counter() - start, 3)
+        timings["link_method"] = ", ".join(sorted(methods))
+        self.startup_timings["seed_profile"] = timings
+        print(
+            f"[+] Seed profile {'found in' if timings['cache_hit'] else 'added to'} the cache "
+            f"({timings['hash_seconds'] + timings['decompress_seconds'] + timings['link_seconds']:.2f}s)"
+        )
+        return seed_tars
+
     def crawl_audit(
-        self, take_screenshot: bool = False, fetch_source_code: bool = False
+        self,
+        take_screenshot: bool = False,
+        fetch_source_code: bool = False,
+        restart_browsers_between_windows: bool = False,
     ) -> None:
-        """Crawl websites using an audit instance"""
-        if self.websites:
-            unstructed_content_provider = (
-                None
-                if not self.resources_to_save
-                else LevelDbProvider(Path(self.content_db))
-            )
-            with TaskManager(
-                self.manager_params,
-                self.browser_params,
-                structured_storage_provider=SQLiteStorageProvider(Path(self.output_db)),
-                unstructured_storage_provider=unstructed_content_provider,
-            ) as manager:
-                # Visits the sites
-                # last_site = self.websites[-1]
-                for index, site in enumerate(self.websites):
-                    ## call back function for the logger
-                    def callback(success: bool, val: str = site) -> None:
+        """
+        Crawl websites using an audit instance.
+        Sites are only submitted within the active window of the day, in-flight visits are drained before the
+        window closes and the crawl sleeps until the next one.
+            restart_browsers_between_windows: bool; shut the TaskManager and browsers down while sleeping and start them again when the window reopens
+        """
+        if not self.websites:
+            return
+        # record each visit in the ledger so that a crashed audit can be resumed
+        ledger = VisitLedger(self.ledger_path)
+        window = ActiveWindow(*self.active_hours)
+        # stop submitting once a visit might not finish before the window closes
+        drain_seconds = (
+            self.site_timeouts.max_budget() if self.site_timeouts else GET_REQUEST_TIMEOUT
+        ) + self.dwell_range[1]
+        # sites left to submit, keeping their rank, handed out when their host is eligible
+        # with a shared work queue, the sites are leased from it as the crawl goes
+        to_visit = PolitenessScheduler(
+            enumerate(self.websites) if not self.work_queue else (),
+            cooldown=self.host_cooldown,
+            per_ip=self.cooldown_per_ip,
+        )
+        if self.work_queue:
+            self.work_queue.start_heartbeat()
+        # set once the max cookies ceiling is reached, checked before submitting each site
+        ceiling_reached = threading.Event()
+        # set when a browser fails to restart, which ends the crawl as it does in OpenWPM
+        restart_failed = False
+        # per-visit timings and running aggregates, written next to the audit
+        self.metrics = CrawlMetrics(self.parent_output_dir, self.audit_name)
+        while (
+            self._has_sites_left(to_visit) or self._retries_pending(ledger)
+        ) and not ceiling_reached.is_set() and not restart_failed:
+            if window.seconds_until_close() < drain_seconds:
+                self._pause_until_active(window)
+            launch_started = time.perf_counter()
+            with self._task_manager() as manager:
+                self.startup_timings["browser_launches_seconds"].append(
+                    round(time.perf_counter() - launch_started, 3)
+                )
+                # once the other sites are visited, the failed visits worth it are retried in the same session
+                while self._has_sites_left(to_visit) or (
+                    not ceiling_reached.is_set()
+                    and self._queue_due_retries(to_visit, manager, ledger)
+                ):
+                    # failures are classified as the visits finish, the permanent ones are recorded right away
+                    self._classify_visits(ledger)
+                    # drain the in-flight visits before the window closes
+                    if window.seconds_until_close() < drain_seconds:
                         print(
-                            f"[+] CommandSequence for {val} ran {'successfully' if success else 'unsuccessfully'}"
+                            f"[!] The active window closes at {window.closes_at():%H:%M}, draining the in-flight visits"
                         )
-
+                        self._wait_for_all_browsers(manager)
+                        if restart_browsers_between_windows:
+                            # exiting the TaskManager shuts the browsers down
+                            break
+                        self._pause_until_active(window)
+                        continue
+                    # wait for a browser to be free before picking the next site, so that the site
+                    # is chosen among the hosts eligible at submission time
+                    queued_at = time.time()
+                    # under memory pressure, only the first browsers get new visits
+                    browser_index = self._wait_for_free_browser(
+                        manager, active=self.pool.adjust()
+                    )
                     ## check if max cookies ceiling was reached
                     # if applicable
                     if self.max_cookies:
                         # check if we reached that threshold
-                        if self.count_cookies() >= self.max_cookies:
+                        if ceiling_reached.is_set() or self.cookie_counter.reached(
+                            self.max_cookies
+                        ):
                             # yes, stop the crawl
                             print(
                                 f"[!] Reached the user defined max cookies ceiling of {self.max_cookies}\n Exiting the crawl."
                             )
+                            ceiling_reached.set()
                             break
-                    # Parallelize sites over all number of browsers set above.
-                    command_sequence = CommandSequence(
-                        site,
-                        site_rank=index,
-                        callback=callback,
+                    next_site = self._next_site(to_visit)
+                    if next_site is None:
+                        # nothing left to visit, retries aside
+                        continue
+                    index, site = next_site
+                    browser = manager.browsers[browser_index]
+                    self.metrics.browser_seen(
+                        browser.browser_id, getattr(browser, "geckodriver_pid", None)
                     )
-                    # check if the bot should be active at this time of the day
-                    hour_now = datetime.now().hour
-                    if hour_now < ACTIVE_STATUS_START or hour_now > ACTIVE_STATUS_STOP:
-                        print(
-                            f"[!] It is {hour_now} o'clock. Will sleep until the next active start time at {ACTIVE_STATUS_START}"
-                        )
-                        while abs(datetime.now().hour - ACTIVE_STATUS_START) != 0:
-                            time.sleep(1)
-                    # command_sequence.append_command(
-                    #     ScheduleManager()
-                    # )
-                    # visit a page and sleep for n sec
-                    command_sequence.append_command(
-                        GetCommand(
-                            url=site,
-                            sleep=random.uniform(
-                                SLEEP_TIME_UNIFORM_DIST_MIN, SLEEP_TIME_UNIFORM_DIST_MAX
-                            ),
-                        ),
-                        timeout=GET_REQUEST_TIMEOUT,
+                    # restart the browser, idle now, before this visit if it is too old or too big, rather
+                    # than letting it grow until the OpenWPM memory watchdog restarts it
+                    recycle = self.pool.recycle_reason(
+                        browser_index, getattr(browser, "geckodriver_pid", None)
                     )
-                    # browse internal links. Risky due to un-accepted cookie banners crashing the crawl
-                    # command_sequence.append_command(BrowseCommand(url=site, num_links = int(random.uniform(0,5)), sleep=random.uniform(5, 20)), timeout=self.timeout)
-                    # Have a look at custom_command.py to see how to implement your own command
-                    # command_sequence.append_command(LinkCountingCommand()) # this is an example of a custom command
-                    # Fetch and dump the page source
-                    if fetch_source_code:
-                        command_sequence.append_command(
-                            RecursiveDumpPageSourceCommand(suffix=self.audit_name)
+                    if recycle:
+                        print(f"[+] Restarting browser {browser.browser_id} before its next visit ({recycle})")
+                        # keeps the profile, as the restarts of OpenWPM do
+                        if not browser.restart_browser_manager():
+                            # OpenWPM gave up launching it, the site stays pending in the ledger for the next run
+                            print(f"[!] Browser {browser.browser_id} failed to restart\n Exiting the crawl.")
+                            restart_failed = True
+                            break
+                        self.pool.browser_restarted(
+                            browser_index, getattr(browser, "geckodriver_pid", None), recycle
                         )
-                    # Take a screenshot...too large, save it for paris!
-                    if take_screenshot:
-                        command_sequence.append_command(
-                            ScreenshotFullPageCommand(suffix=self.audit_name)
+                    self.pool.visit_submitted(browser_index)
+                    # time the page stays open after loading, the measurement itself
+                    dwell = random.uniform(*self.dwell_range)
+                    # fast sites fail fast, slow ones get the time they usually need
+                    get_timeout = GET_REQUEST_TIMEOUT
+                    if self.site_timeouts and self.site_timeouts.budget(site) is not None:
+                        get_timeout = self.site_timeouts.timeout(site, dwell)
+                        self.timeouts_used[site] = get_timeout
+
+                    # id of the visit, set once the TaskManager has handed it to the browser
+                    submission = {"visit_id": None}
+
+                    ## call back function for the logger
+                    def callback(
+                        success: bool, val: str = site, rank: int = index, sub: dict = submission
+                    ) -> None:
+                        # start the cooldown of the host
+                        to_visit.release(val)
+                        # callbacks fire after the storage flush, when the browser may already hold the id of its
+                        # next visit, so the id is read from the submission, by the crawl thread classifying it
+                        self._finished_visits.append((rank, val, sub, success, time.monotonic()))
+                        self.metrics.visit_finished(val, success)
+                        ledger.mark_finished(val, success)
+                        if self.work_queue:
+                            self.work_queue.complete(val, success)
+                        print(
+                            f"[+] CommandSequence for {val} ran {'successfully' if success else 'unsuccessfully'}"
                         )
-                    # if site == last_site:
-                    # download light beam data
-                    # command_sequence.append_command(DownloadLightbeamData(output_dir=self.parent_output_dir), timeout=self.timeout)
+                        # update the cookie count as soon as a visit finishes
+                        if self.max_cookies and self.cookie_counter.reached(
+                            self.max_cookies
+                        ):
+                            ceiling_reached.set()
+
+                    command_sequence = self._command_sequence(
+                        site=site,
+                        index=index,
+                        callback=callback,
+                        dwell=dwell,
+                        timeout=get_timeout,
+                        take_screenshot=take_screenshot,
+                        fetch_source_code=fetch_source_code,
+                    )
                     # Run commands across all browsers (simple parallelization)
-                    manager.execute_command_sequence(command_sequence)
+                    ledger.mark_submitted(site)
+                    self.metrics.visit_submitted(
+                        site,
+                        browser_id=browser.browser_id,
+                        queue_wait=time.time() - queued_at,
+                        dwell=dwell,
+                    )
+                    manager.execute_command_sequence(command_sequence, index=browser_index)
+                    # the TaskManager assigns the visit id to the browser before returning
+                    submission["visit_id"] = getattr(browser, "curr_visit_id", None)
+        # the TaskManager waits for all visits on exit, so all callbacks have fired
+        # classify the visits left, e.g. when the cookies ceiling stopped the crawl, writing their metrics
+        self._classify_visits(ledger, wait=True)
+        ledger.close()
+        # the measured memory of a browser sizes the pool of the next audits (see browser_pool.auto_browser_n)
+        self.pool.save_footprint(os.path.dirname(self.parent_output_dir))
+        if self.timeout_stats:
+            self._update_timeout_stats()
+        if self.work_queue:
+            # gives back the sites leased but not visited, e.g. when the cookies ceiling was reached
+            self.work_queue.close()
+
+    def _classify_visits(self, ledger: VisitLedger, wait: bool = False) -> None:
+        """
+        Classify the failures of the visits finished, from their crawl_history, and schedule the retries.
+        The history of a visit may be written after its callback fires, so the visits without it are kept for the
+        next call, unless wait is set: then their history is waited for up to RETRY_HISTORY_WAIT_SECONDS.
+        """
+        while self._finished_visits:
+            # callbacks may append more visits meanwhile, they are taken in the next round
+            pending = [self._finished_visits.popleft() for _ in range(len(self._finished_visits))]
+            visit_ids = [v[2]["visit_id"] for v in pending if v[2]["visit_id"] is not None]
+            outcomes, commands = {}, {}
+            if os.path.isfile(self.output_db):
+                outcomes = visit_outcomes(self.output_db, visit_ids)
+                commands = visit_commands(self.output_db, visit_ids)
+            waiting = []
+            for rank, site, submission, success, finished_at in pending:
+                visit_id = submission["visit_id"]
+                outcome = outcomes.get(visit_id)
+                if (
+                    outcome is None
+                    and visit_id is not None
+                    and time.monotonic() - finished_at < RETRY_HISTORY_WAIT_SECONDS
+                ):
+                    waiting.append((rank, site, submission, success, finished_at))
+                    continue
+                # the page load seconds and failed commands of the visit
+                self.metrics.visit_recorded(site, visit_id, commands.get(visit_id))
+                if outcome is None:
+                    # no history, all that is known is the callback outcome
+                    failure = None if success else classify_failure(None, None)
+                else:
+                    failure = classify_failure(*outcome)
+                if failure is None:
+                    self.retries.succeeded(site)
+                    continue
+                kind, retryable = failure
+                retried = self.retries.failed(rank, site, kind, retryable)
+                ledger.mark_failure(site, kind, permanent=not retried)
+                print(
+                    f"[!] Visit to {site} failed ({kind}), "
+                    + ("retrying it at the end of the crawl" if retried else "not retrying it")
+                )
+            self._finished_visits.extend(waiting)
+            if not wait:
+                return
+            if waiting:
+                time.sleep(1)
+
+    def _retries_pending(self, ledger: VisitLedger) -> bool:
+        """Are there failed visits to retry? Waits for the history of the visits not classified yet"""
+        self._classify_visits(ledger, wait=True)
+        return len(self.retries) > 0
+
+    def _queue_due_retries(
+        self, to_visit: PolitenessScheduler, manager: "TaskManager", ledger: VisitLedger
+    ) -> bool:
+        """
+        Once the other sites are visited, wait for the visits in flight and hand the retries to the scheduler,
+        sleeping until the first one is due. Returns False when no retry is left.
+        """
+        self._wait_for_all_browsers(manager)
+        if not self._retries_pending(ledger):
+            return False
+        wait = self.retries.seconds_until_next()
+        if wait:
+            print(f"[+] {len(self.retries)} failed visits to retry, the next one in {wait:.0f}s")
+            time.sleep(wait)
+        for rank, site in self.retries.pop_due():
+            to_visit.add(rank, site)
+        return True
+
+    def _update_timeout_stats(self) -> None:
+        """Add the page loads of the sites visited in this crawl to the shared stats file"""
+        if not os.path.isfile(self.output_db):
+            return
+        # the database of a resumed audit also holds the visits of the previous runs, already in the stats
+        visited = set(self.websites)
+        self.site_timeouts.add(
+            row for row in get_command_history(self.output_db) if row[0] in visited
+        )
+        self.site_timeouts.save(self.timeout_stats)
+
+    def _has_sites_left(self, to_visit: PolitenessScheduler) -> bool:
+        """Are there sites left to visit, locally or in the shared work queue?"""
+        if len(to_visit):
+            return True
+        return bool(self.work_queue and self.work_queue.unfinished())
+
+    def _next_site(self, to_visit: PolitenessScheduler) -> Optional[tuple]:
+        """Next (rank, url) to visit, leasing more sites from the work queue when one is used"""
+        if self.work_queue:
+            # keep a few more sites than browsers at hand, so that the scheduler can skip busy hosts
+            wanted = 2 * self.browser_n - len(to_visit)
+            if wanted > 0:
+                for rank, site in self.work_queue.lease(wanted):
+                    to_visit.add(rank, site)
+            while not len(to_visit):
+                if not self.work_queue.unfinished():
+                    return None
+                # the sites left are leased by other workers, wait for them to finish or for their leases to expire
+                time.sleep(WORK_QUEUE_POLL_SECONDS)
+                for rank, site in self.work_queue.lease(self.browser_n):
+                    to_visit.add(rank, site)
+        return to_visit.next_site()
+
+    def _task_manager(self) -> "TaskManager":
+        """Create a TaskManager, which launches the browsers, writing to the audit's storage providers"""
+        from openwpm.storage.sql_provider import SQLiteStorageProvider
+        from openwpm.storage.leveldb import LevelDbProvider
+        from openwpm.task_manager import TaskManager
+        from .content_provider import SharedContentProvider
+
+        unstructed_content_provider = None
+        if self.resources_to_save:
+            unstructed_content_provider = (
+                SharedContentProvider(self.content_store, audit=self.audit_name)
+                if self.content_store
+                else LevelDbProvider(Path(self.content_db))
+            )
+        return TaskManager(
+            self.manager_params,
+            self.browser_params,
+            structured_storage_provider=SQLiteStorageProvider(Path(self.output_db)),
+            unstructured_storage_provider=unstructed_content_provider,
+        )
+
+    def _command_sequence(
+        self,
+        site: str,
+        index: int,
+        callback,
+        dwell: float,
+        timeout: float = GET_REQUEST_TIMEOUT,
+        take_screenshot: bool = False,
+        fetch_source_code: bool = False,
+    ) -> "CommandSequence":
+        """Make the CommandSequence for visiting a site, the GetCommand is killed after timeout seconds"""
+        from openwpm.command_sequence import CommandSequence
+        from openwpm.commands.browser_commands import (
+            GetCommand,
+            ScreenshotFullPageCommand,
+            RecursiveDumpPageSourceCommand,
+        )
+
+        # Parallelize sites over all number of browsers set above.
+        command_sequence = CommandSequence(
+            site,
+            site_rank=index,
+            callback=callback,
+        )
+        # visit a page and sleep for n sec
+        command_sequence.append_command(
+            GetCommand(url=site, sleep=dwell),
+            timeout=timeout,
+        )
+        # browse internal links. Risky due to un-accepted cookie banners crashing the crawl
+        # command_sequence.append_command(BrowseCommand(url=site, num_links = int(random.uniform(0,5)), sleep=random.uniform(5, 20)), timeout=self.timeout)
+        # Have a look at custom_command.py to see how to implement your own command
+        # command_sequence.append_command(LinkCountingCommand()) # this is an example of a custom command
+        # Fetch and dump the page source
+        if fetch_source_code:
+            command_sequence.append_command(
+                RecursiveDumpPageSourceCommand(suffix=self.audit_name)
+            )
+        # Take a screenshot...too large, save it for paris!
+        if take_screenshot:
+            command_sequence.append_command(
+                ScreenshotFullPageCommand(suffix=self.audit_name)
+            )
+        # download light beam data
+        # command_sequence.append_command(DownloadLightbeamData(output_dir=self.parent_output_dir), timeout=self.timeout)
+        return command_sequence
 
-    def clean_up(self) -> None:
+    def _pause_until_active(self, window: ActiveWindow) -> None:
+        """Sleep until the next active window and keep track of the time paused"""
+        paused_at = datetime.now()
+        print(
+            f"[!] It is {paused_at:%H:%M}. Pausing the crawl until the next active window at {window.next_window_start(paused_at):%Y-%m-%d %H:%M}"
+        )
+        slept = window.sleep_until_next_window()
+        resumed_at = datetime.now()
+        print(f"[+] Resuming the crawl after a pause of {slept / 3600:.2f} hours")
+        if self.metrics:
+            self.metrics.paused(slept)
+        self.window_pauses.append(
+            {
+                "paused_at": paused_at.isoformat(timespec="seconds"),
+                "resumed_at": resumed_at.isoformat(timespec="seconds"),
+                "seconds": round((resumed_at - paused_at).total_seconds()),
+            }
+        )
+
+    @staticmethod
+    def _wait_for_free_browser(
+        manager: "TaskManager", poll: float = 0.5, active: Optional[int] = None
+    ) -> int:
+        """
+        Block until one of the TaskManager browsers is ready for a new CommandSequence and return its index
+            active: int; only the first active browsers are considered, all of them if None
+        """
+        while True:
+            for index, browser in enumerate(manager.browsers[:active]):
+                if browser.ready():
+                    return index
+            time.sleep(poll)
+
+    @staticmethod
+    def _wait_for_all_browsers(manager: "TaskManager", poll: float = 0.5) -> None:
+        """Block until none of the TaskManager browsers has a CommandSequence in flight"""
+        while not all(browser.ready() for browser in manager.browsers):
+            time.sleep(poll)
+
+    def clean_up(self, workers: Optional[int] = None) -> None:
         """
         some cleaning up:
-            * tar very large files
+            * archive very large files, compressing them in parallel and removing them as they are archived
         """
         ## compress some heavy dirs/files
-        to_tar = [
-            os.path.join(self.parent_output_dir, "screenshots"),
-            os.path.join(self.parent_output_dir, "sources"),
-            os.path.join(self.parent_output_dir, f"openwpm_{self.audit_name}.log"),
-        ]
-        for _ in to_tar:
-            if os.path.isdir(_):
-                _files = os.listdir(_)
-            else:
-                _files = [_]
-            _tar(files=_files)
+        for dir_name in ["screenshots", "sources"]:
+            archive_dir(os.path.join(self.parent_output_dir, dir_name), workers=workers)
+        archive_file(str(self.manager_params.log_path))
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+from collections import defaultdict
+from typing import Optional
+import psutil
+from .metrics import _percentile
+from .constants import (
+    OUTPUT_DIR,
+    BROWSER_MEMORY_MB,
+    BROWSER_MEMORY_RESERVE_MB,
+    BROWSER_N_AUTO_MAX,
+    BROWSER_FOOTPRINT_FILENAME,
+    BROWSER_RECYCLE_VISITS,
+    BROWSER_RECYCLE_RSS_MB,
+    MEMORY_PRESSURE_MB,
+)
+
+_MB = 2**20
+
+
+def process_tree_rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Resident memory of a process and all its children (geckodriver, firefox and its content processes)"""
+    if pid is None:
+        return None
+    try:
+        root = psutil.Process(pid)
+        processes = [root, *root.children(recursive=True)]
+    except psutil.Error:
+        return None
+    rss = 0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except psutil.Error:
+            # exited meanwhile
+            continue
+    return rss / _MB
+
+
+def read_footprint(output_dir: str = OUTPUT_DIR) -> Optional[float]:
+    """Memory (MB) of a browser measured by the previous audits, None if never measured"""
+    path = os.path.join(output_dir, BROWSER_FOOTPRINT_FILENAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f).get("browser_mb")
+
+
+def auto_browser_n(
+    browser_mb: Optional[float] = None,
+    reserve_mb: float = BROWSER_MEMORY_RESERVE_MB,
+    max_n: int = BROWSER_N_AUTO_MAX,
+) -> int:
+    """
+    Number of browsers the host can run: as many as fit in the available memory, once the reserve is left to the
+    system, and no more than the cpus.
+        browser_mb: float; memory of a browser, the one measured by the previous audits or BROWSER_MEMORY_MB if None
+    """
+    browser_mb = browser_mb or read_footprint() or BROWSER_MEMORY_MB
+    available_mb = psutil.virtual_memory().available / _MB
+    by_memory = int((available_mb - reserve_mb) // browser_mb)
+    return max(1, min(by_memory, psutil.cpu_count() or 1, max_n))
+
+
+class BrowserPool(object):
+    """
+    Decides, between two visits, which browsers of the TaskManager get the next visit and which ones are restarted.
+        * a browser is recycled (restarted with its profile) while it is idle, after recycle_visits visits or once
+          its processes use more than recycle_rss_mb, before it grows big enough for the OpenWPM memory watchdog
+        * under memory pressure, the browsers above the first active ones stop getting visits, one more each time
+          the available memory is below pressure_mb, and they all do again once twice as much is available
+    """
+
+    def __init__(
+        self,
+        browser_n: int,
+        recycle_visits: Optional[int] = BROWSER_RECYCLE_VISITS,
+        recycle_rss_mb: Optional[float] = BROWSER_RECYCLE_RSS_MB,
+        pressure_mb: float = MEMORY_PRESSURE_MB,
+        adjust_seconds: float = 60,
+    ) -> None:
+        """
+        browser_n: int; browsers of the TaskManager
+        adjust_seconds: float; seconds between two changes of the active browsers, so that memory can settle
+        """
+        self.browser_n = browser_n
+        self.recycle_visits = recycle_visits
+        self.recycle_rss_mb = recycle_rss_mb
+        self.pressure_mb = pressure_mb
+        self.adjust_seconds = adjust_seconds
+        self._adjusted_at = -adjust_seconds
+        # browsers getting new visits, the first ones of the TaskManager
+        self.active = browser_n
+        # visits since the last (re)start of each browser
+        self._visits = defaultdict(int)
+        # geckodriver process id of each browser, a new one means OpenWPM restarted it
+        self._pids = {}
+        # memory of the browsers measured before each visit
+        self._rss_samples = []
+        self.recycled = {"visits": 0, "memory": 0}
+        self.scale_events = []
+
+    def adjust(self) -> int:
+        """Scale the active browsers down under memory pressure, or up again once it is over. Returns them"""
+        if time.monotonic() - self._adjusted_at < self.adjust_seconds:
+            return self.active
+        available_mb = psutil.virtual_memory().available / _MB
+        if available_mb < self.pressure_mb and self.active > 1:
+            self.active -= 1
+        elif available_mb > 2 * self.pressure_mb and self.active < self.browser_n:
+            self.active = self.browser_n
+        else:
+            return self.active
+        self._adjusted_at = time.monotonic()
+        self.scale_events.append({"available_mb": round(available_mb), "active_browsers": self.active})
+        print(
+            f"[!] {available_mb:.0f} MB of memory available, {self.active} of {self.browser_n} browsers get new visits"
+        )
+        return self.active
+
+    def recycle_reason(self, index: int, pid: Optional[int]) -> Optional[str]:
+        """Should the browser be restarted before its next visit? Returns why, or None"""
+        if pid is not None and self._pids.get(index, pid) != pid:
+            # restarted by OpenWPM on its own, after a crash or a timeout
+            self.browser_restarted(index, pid)
+        self._pids[index] = pid
+        rss_mb = process_tree_rss_mb(pid)
+        if rss_mb is not None:
+            self._rss_samples.append(rss_mb)
+        if self.recycle_visits and self._visits[index] >= self.recycle_visits:
+            return "visits"
+        if self.recycle_rss_mb and rss_mb is not None and rss_mb > self.recycle_rss_mb:
+            return "memory"
+        return None
+
+    def browser_restarted(self, index: int, pid: Optional[int], reason: Optional[str] = None) -> None:
+        """Count the visits of a browser from zero again once it was restarted, by us for reason or by OpenWPM"""
+        self._visits[index] = 0
+        self._pids[index] = pid
+        if reason:
+            self.recycled[reason] += 1
+
+    def visit_submitted(self, index: int) -> None:
+        self._visits[index] += 1
+
+    def footprint_mb(self) -> Optional[float]:
+        """Memory of a browser, the 90th percentile over the visits as browsers grow until they are restarted"""
+        return _percentile(self._rss_samples, 90)
+
+    def save_footprint(self, output_dir: str = OUTPUT_DIR) -> None:
+        """Keep the measured memory of a browser for sizing the next audits"""
+        footprint = self.footprint_mb()
+        if footprint is None:
+            return
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, BROWSER_FOOTPRINT_FILENAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"browser_mb": round(footprint, 1)}, f)
+        os.replace(tmp_path, path)
+
+    def summary(self) -> dict:
+        return {
+            "browser_n": self.browser_n,
+            "browser_footprint_mb": round(self.footprint_mb(), 1) if self._rss_samples else None,
+            "browser_peak_mb": round(max(self._rss_samples), 1) if self._rss_samples else None,
+            "recycled": dict(self.recycled),
+            "scale_events": self.scale_events,
+        }
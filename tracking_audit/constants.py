@@ -1,43 +1,132 @@
 import configparser
+from functools import lru_cache
 from pathlib import Path
 import os
-from datetime import datetime
-import random
 
 PARENT_DIR = Path().resolve()
-# parse config file and make it available to the entire module
-config = configparser.ConfigParser()
-config.read(os.path.join(PARENT_DIR, "config.ini"))
 
-# generate some path relevant constants from the config file
-OUTPUT_PATH = config.get("output", "path")
-PATH_TO_OPENWPM = config.get("openwpm", "path")
+
+@lru_cache(maxsize=None)
+def read_config() -> configparser.ConfigParser:
+    """config.ini of the project, parsed on the first use of a constant taken from it"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(PARENT_DIR, "config.ini"))
+    return config
+
+
 # if "vagrant" in os.getlogin():
 #     PATH_TO_OPENWPM = config.get("openwpm-vagrant", "path")
 # else:
 #     PATH_TO_OPENWPM = config.get("openwpm", "path")
+# path relevant constants taken from the config file: name -> (section, option)
+CONFIG_CONSTANTS = {
+    "OUTPUT_PATH": ("output", "path"),
+    "PATH_TO_OPENWPM": ("openwpm", "path"),
+}
+
 
+def __getattr__(name: str) -> str:
+    # the config file is only read when one of its constants is used, not when importing the package
+    if name in CONFIG_CONSTANTS:
+        return read_config().get(*CONFIG_CONSTANTS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# output dir
+
+# output dir, created by the audits
 OUTPUT_DIR = os.path.join(PARENT_DIR, "output")
-if not os.path.isdir(OUTPUT_DIR):
-    os.mkdir(OUTPUT_DIR)
 
-# profiles sub dir
+# profiles sub dir, created by the audits
 PROFILES_SUBDIR = os.path.join(PARENT_DIR, "resources", "profiles")
-if not os.path.isdir(PROFILES_SUBDIR):
-    os.mkdir(PROFILES_SUBDIR)
+
+# seed profiles decompressed once, keyed by the hash of their content, and linked to each browser
+SEED_CACHE_DIR = os.path.join(PROFILES_SUBDIR, ".seed_cache")
+
+# EasyList/EasyPrivacy-style filter lists used to classify the requests, one <category>.txt per list
+FILTER_LISTS_DIR = os.path.join(PARENT_DIR, "resources", "filter_lists")
 
 # default audit name
 DEFAULT_AUDIT_NAME = "test_audit"
 
+# file name of the visit ledger used for resuming audits, stored in the audit's output dir
+VISIT_LEDGER_FILENAME = "visit_ledger.sqlite"
+
 # Get request timeout
 GET_REQUEST_TIMEOUT = 60
+# adaptive GetCommand timeouts learned from previous audits: percentile of the past page loads and margin applied to
+# it, floor and cap of the page load budget (the dwell is added on top of it), past visits needed before a site gets
+# its own timeout, share of timed out past visits making a site known-slow, page loads kept per site in a stats file
+ADAPTIVE_TIMEOUT_PERCENTILE = 95
+ADAPTIVE_TIMEOUT_MARGIN = 1.5
+ADAPTIVE_TIMEOUT_FLOOR_SECONDS = 15
+ADAPTIVE_TIMEOUT_CAP_SECONDS = 120
+ADAPTIVE_TIMEOUT_MIN_VISITS = 2
+ADAPTIVE_TIMEOUT_SLOW_SHARE = 0.5
+ADAPTIVE_TIMEOUT_HISTORY = 20
+
+# OpenWPM instruments turned on by each preset, the ones missing are off. js and callstack are the most costly
+INSTRUMENTS = (
+    "http_instrument",
+    "cookie_instrument",
+    "navigation_instrument",
+    "js_instrument",
+    "callstack_instrument",
+    "dns_instrument",
+)
+INSTRUMENT_PRESETS = {
+    "full": INSTRUMENTS,
+    "cookies-and-requests": ("http_instrument", "cookie_instrument", "navigation_instrument"),
+    "cookies-only": ("cookie_instrument",),
+}
+DEFAULT_INSTRUMENT_PRESET = "full"
 
 # Sleep time uniform min and max
 SLEEP_TIME_UNIFORM_DIST_MIN = 6
 SLEEP_TIME_UNIFORM_DIST_MAX = 60
 
+# minimum number of seconds between the end of a visit and the start of the next visit to the same registered domain
+HOST_COOLDOWN_SECONDS = 30
+# concurrent dns lookups when keying the hosts by ip address
+HOST_RESOLVE_WORKERS = 32
+
+# failed visits retried at the end of the crawl: visits of a site at most (the first one included), seconds before the
+# first retry, multiplied by the factor for each further retry, seconds to wait for the crawl_history of a visit
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 60
+RETRY_BACKOFF_FACTOR = 2
+RETRY_HISTORY_WAIT_SECONDS = 30
+
+# browser pool: memory of a browser (MB) until one is measured, memory left to the system and browsers at most when
+# the number of browsers is picked automatically, file with the measured memory of a browser in the output dir
+BROWSER_MEMORY_MB = 1500
+BROWSER_MEMORY_RESERVE_MB = 1024
+BROWSER_N_AUTO_MAX = 16
+BROWSER_FOOTPRINT_FILENAME = "browser_footprint.json"
+# restart a browser between two visits after this many visits, or once its processes use this much memory (MB)
+BROWSER_RECYCLE_VISITS = 100
+BROWSER_RECYCLE_RSS_MB = 2500
+# under memory pressure (MB available), fewer browsers get new visits, they all do again above twice as much
+MEMORY_PRESSURE_MB = 768
+
+# seconds a site leased from a shared work queue stays leased without a heartbeat
+WORK_QUEUE_LEASE_SECONDS = 300
+# seconds to wait before asking the work queue again when all the sites left are leased by other workers
+WORK_QUEUE_POLL_SECONDS = 10
+
+# pre-crawl liveness probe: seconds a result is reused for, seconds allowed per site, sites probed at the same time
+# (overall and per host)
+LIVENESS_TTL_SECONDS = 24 * 60 * 60
+LIVENESS_TIMEOUT_SECONDS = 15
+LIVENESS_CONCURRENCY = 100
+LIVENESS_PER_HOST = 2
+# file name of the liveness cache, shared by the audits in the output dir
+LIVENESS_CACHE_FILENAME = "liveness_cache.sqlite"
+# what the preflight does with the unreachable sites: drop them or visit them last
+PREFLIGHT_SKIP = "skip"
+PREFLIGHT_DEFER = "defer"
+# redirect canonicalisation of the websites: redirects followed at most, seconds a resolved chain is reused for
+REDIRECT_MAX_HOPS = 10
+REDIRECT_TTL_SECONDS = 7 * 24 * 60 * 60
+
 # working hours
 ACTIVE_STATUS_START = 8
 
@@ -0,0 +1,37 @@
+from .content_store import ContentStore
+from .utils import add_openwpm_to_path
+
+# apart from the store, so that the store can be used for analysis without OpenWPM
+add_openwpm_to_path()
+from openwpm.storage.storage_providers import UnstructuredStorageProvider
+
+
+class SharedContentProvider(UnstructuredStorageProvider):
+    """OpenWPM unstructured storage provider writing the saved response bodies of an audit to a shared ContentStore"""
+
+    def __init__(self, root: str, audit: str) -> None:
+        """
+        root: str; directory of the shared content store
+        audit: str; name of the audit referencing the bodies
+        """
+        super().__init__()
+        self.root = str(root)
+        self.audit = audit
+        self.store = None
+
+    async def init(self) -> None:
+        # opened here since the provider is handed to the storage controller process
+        self.store = ContentStore(self.root)
+
+    async def store_blob(
+        self, filename: str, blob: bytes, overwrite: bool = False
+    ) -> None:
+        self.store.put(self.audit, blob, content_hash=str(filename))
+
+    async def flush_cache(self) -> None:
+        # every blob is written as it arrives
+        pass
+
+    async def shutdown(self) -> None:
+        if self.store:
+            self.store.close()
@@ -0,0 +1,152 @@
+import os
+import re
+import hashlib
+import sqlite3
+from typing import Optional
+
+# content hashes are used as file names, anything else gets re-hashed
+_HASH_REGEX = re.compile(r"^[0-9a-fA-F]{16,128}$")
+
+
+class ContentStore(object):
+    """
+    Content-addressed store of response bodies shared by many audits (replications, locations).
+    Each body is stored once under objects/<hash[:2]>/<hash> and an index keeps which audits reference it,
+    so that deleting an audit only removes the bodies no other audit uses.
+    """
+
+    def __init__(self, root: str) -> None:
+        """
+        root: str; directory of the store, created if missing
+        """
+        self.root = str(root)
+        self.objects_dir = os.path.join(self.root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(self.root, "index.sqlite"), timeout=60, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS objects (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS refs (
+                hash TEXT NOT NULL,
+                audit TEXT NOT NULL,
+                PRIMARY KEY (audit, hash)
+            );
+            CREATE TABLE IF NOT EXISTS audit_stats (
+                audit TEXT PRIMARY KEY,
+                blobs INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                deduplicated_bytes INTEGER NOT NULL DEFAULT 0
+            );
+            """
+        )
+
+    def _object_path(self, content_hash: str) -> str:
+        return os.path.join(self.objects_dir, content_hash[:2], content_hash)
+
+    def put(self, audit: str, blob: bytes, content_hash: Optional[str] = None) -> str:
+        """Store a body referenced by an audit, writing it only if no audit stored it before. Returns its hash"""
+        if not content_hash or not _HASH_REGEX.match(content_hash):
+            content_hash = hashlib.sha256(blob).hexdigest()
+        content_hash = content_hash.lower()
+        path = self._object_path(content_hash)
+        self._conn.execute("BEGIN IMMEDIATE;")
+        try:
+            exists = self._conn.execute(
+                "SELECT 1 FROM objects WHERE hash = ?;", (content_hash,)
+            ).fetchone()
+            if not exists:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(blob)
+                os.replace(tmp_path, path)
+                self._conn.execute(
+                    "INSERT INTO objects (hash, size) VALUES (?, ?);",
+                    (content_hash, len(blob)),
+                )
+            new_ref = self._conn.execute(
+                "INSERT OR IGNORE INTO refs (hash, audit) VALUES (?, ?);",
+                (content_hash, audit),
+            ).rowcount
+            if new_ref:
+                self._conn.execute(
+                    "UPDATE objects SET refcount = refcount + 1 WHERE hash = ?;",
+                    (content_hash,),
+                )
+            self._conn.execute(
+                "INSERT INTO audit_stats (audit, blobs, bytes, deduplicated_bytes) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(audit) DO UPDATE SET blobs = blobs + 1, bytes = bytes + excluded.bytes, "
+                "deduplicated_bytes = deduplicated_bytes + excluded.deduplicated_bytes;",
+                (audit, len(blob), len(blob) if exists else 0),
+            )
+            self._conn.execute("COMMIT;")
+        except Exception:
+            self._conn.execute("ROLLBACK;")
+            raise
+        return content_hash
+
+    def get(self, content_hash: str) -> bytes:
+        """Read a body by its hash"""
+        with open(self._object_path(content_hash.lower()), "rb") as f:
+            return f.read()
+
+    def release_audit(self, audit: str) -> int:
+        """Drop the references of an audit, deleting the bodies no other audit references. Returns the bytes freed"""
+        freed = 0
+        self._conn.execute("BEGIN IMMEDIATE;")
+        try:
+            self._conn.execute(
+                "UPDATE objects SET refcount = refcount - 1 "
+                "WHERE hash IN (SELECT hash FROM refs WHERE audit = ?);",
+                (audit,),
+            )
+            self._conn.execute("DELETE FROM refs WHERE audit = ?;", (audit,))
+            self._conn.execute("DELETE FROM audit_stats WHERE audit = ?;", (audit,))
+            orphans = self._conn.execute(
+                "SELECT hash, size FROM objects WHERE refcount <= 0;"
+            ).fetchall()
+            self._conn.execute("DELETE FROM objects WHERE refcount <= 0;")
+            self._conn.execute("COMMIT;")
+        except Exception:
+            self._conn.execute("ROLLBACK;")
+            raise
+        for content_hash, size in orphans:
+            try:
+                os.remove(self._object_path(content_hash))
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def stats(self, audit: Optional[str] = None) -> dict:
+        """Bodies and bytes saved and deduplicated, for one audit or the whole store"""
+        if audit:
+            row = self._conn.execute(
+                "SELECT blobs, bytes, deduplicated_bytes FROM audit_stats WHERE audit = ?;",
+                (audit,),
+            ).fetchone() or (0, 0, 0)
+        else:
+            row = self._conn.execute(
+                "SELECT coalesce(sum(blobs), 0), coalesce(sum(bytes), 0), "
+                "coalesce(sum(deduplicated_bytes), 0) FROM audit_stats;"
+            ).fetchone()
+        stored = self._conn.execute(
+            "SELECT count(*), coalesce(sum(size), 0) FROM objects;"
+        ).fetchone()
+        return {
+            "blobs_saved": row[0],
+            "bytes_saved": row[1],
+            "bytes_deduplicated": row[2],
+            "store_objects": stored[0],
+            "store_bytes": stored[1],
+        }
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import threading
+
+
+class CookieCounter(object):
+    """
+    Incremental counter of the unique (host, name, value) cookies in the javascript_cookies table.
+    Keeps a high-water-mark rowid cursor, so each refresh only reads the rows inserted since the last one.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        db_path: str; path to the OpenWPM sqlite database
+        """
+        self.db_path = str(db_path)
+        # highest rowid already counted
+        self._last_rowid = 0
+        # hashes of the (host, name, value) tuples seen so far
+        self._seen = set()
+        # refresh is called both from the crawl loop and the CommandSequence callbacks
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        """Number of unique cookies counted so far, without reading the database"""
+        return len(self._seen)
+
+    def refresh(self) -> int:
+        """Read the cookies inserted since the last refresh and return the updated count"""
+        with self._lock:
+            if not os.path.isfile(self.db_path):
+                return len(self._seen)
+            try:
+                # the database is being written concurrently by OpenWPM, so open it read-only
+                con = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=30)
+                try:
+                    rows = con.execute(
+                        "SELECT rowid, host, name, value FROM javascript_cookies "
+                        "WHERE rowid > ? ORDER BY rowid;",
+                        (self._last_rowid,),
+                    )
+                    for rowid, host, name, value in rows:
+                        self._seen.add(hash((host, name, value)))
+                        self._last_rowid = rowid
+                finally:
+                    con.close()
+            except sqlite3.OperationalError:
+                # table not created yet or database locked, try again on the next refresh
+                pass
+            return len(self._seen)
+
+    def reached(self, ceiling: int) -> bool:
+        """Has the number of unique cookies reached the ceiling?"""
+        return self.refresh() >= ceiling
@@ -0,0 +1,126 @@
+import hashlib
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from .labelling import registered_domain
+
+# kinds of keys that can be compared between audits
+COOKIES = "cookies"
+THIRD_PARTIES = "third_parties"
+# rows fetched from sqlite at a time
+FETCH_ROWS = 50_000
+
+
+def key_hash(*parts: str) -> int:
+    """64 bit integer hash of a key, the same in every process (unlike hash())"""
+    h = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        h.update((part or "").encode("utf-8", "surrogatepass"))
+        h.update(b"\x00")
+    return int.from_bytes(h.digest(), "little")
+
+
+def _site_urls(con: sqlite3.Connection) -> dict:
+    """visit_id -> site_url, small enough to keep in memory (one row per visit)"""
+    return dict(con.execute("SELECT visit_id, site_url FROM site_visits;"))
+
+
+def load_audit_keys(db_path: str, kind: str = COOKIES) -> dict:
+    """
+    Stream an audit database into per-site sets of integer keys, so that memory grows with the number of
+    distinct keys and not with the number of rows.
+        kind: str; "cookies" for (cookie host, cookie name) or "third_parties" for the registered domains
+              (eTLD+1) of the requests made to another registered domain than the site's
+    Returns a dict site_url -> set of key hashes.
+    """
+    keys = defaultdict(set)
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        sites = _site_urls(con)
+        if kind == COOKIES:
+            cursor = con.execute("SELECT visit_id, host, name FROM javascript_cookies;")
+            while True:
+                rows = cursor.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                for visit_id, host, name in rows:
+                    site = sites.get(visit_id)
+                    if site is not None:
+                        # leading dots mark domain cookies, the same cookie for our purpose
+                        keys[site].add(key_hash((host or "").lstrip("."), name))
+        elif kind == THIRD_PARTIES:
+            site_domains = {site: registered_domain(site) for site in set(sites.values())}
+            cursor = con.execute("SELECT visit_id, url FROM http_requests;")
+            while True:
+                rows = cursor.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                for visit_id, url in rows:
+                    site = sites.get(visit_id)
+                    if site is None or not url:
+                        continue
+                    domain = registered_domain(url)
+                    if domain and domain != site_domains[site]:
+                        keys[site].add(key_hash(domain))
+        else:
+            raise ValueError(f"Unknown kind '{kind}', use '{COOKIES}' or '{THIRD_PARTIES}'")
+        # sites without any key still count as visited
+        for site in sites.values():
+            keys[site]
+    finally:
+        con.close()
+    return dict(keys)
+
+
+def diff_keys(baseline: dict, other: dict) -> dict:
+    """
+    Compare the per-site key sets of two audits.
+    Returns the added (only in other), removed (only in baseline) and shared counts per site and in total.
+    """
+    per_site = {}
+    totals = {"added": 0, "removed": 0, "shared": 0}
+    for site in baseline.keys() | other.keys():
+        a = baseline.get(site, set())
+        b = other.get(site, set())
+        shared = len(a & b)
+        counts = {"added": len(b) - shared, "removed": len(a) - shared, "shared": shared}
+        per_site[site] = counts
+        for k, v in counts.items():
+            totals[k] += v
+    return {"global": totals, "sites": per_site}
+
+
+def diff_audits(
+    db_paths: list, kind: str = COOKIES, workers: Optional[int] = None
+) -> dict:
+    """
+    Compare two or more audits, e.g. the same trial from pt and esba.
+    The first audit is the baseline the others are compared to. The audits are loaded in parallel.
+    Returns a dict with:
+        * comparisons: one diff_keys result per audit after the first, keyed by its path
+        * shared_by_all: number of keys found in all the audits, in total and per site
+    """
+    if len(db_paths) < 2:
+        raise ValueError("At least two audits are needed for a diff")
+    with ProcessPoolExecutor(max_workers=workers or len(db_paths)) as executor:
+        audits = list(executor.map(load_audit_keys, db_paths, [kind] * len(db_paths)))
+    baseline = audits[0]
+    comparisons = {
+        path: diff_keys(baseline, other) for path, other in zip(db_paths[1:], audits[1:])
+    }
+    shared_by_all = {}
+    for site in set(baseline).union(*audits[1:]):
+        shared = set(baseline.get(site, ()))
+        for other in audits[1:]:
+            shared &= other.get(site, set())
+        shared_by_all[site] = len(shared)
+    return {
+        "kind": kind,
+        "baseline": db_paths[0],
+        "comparisons": comparisons,
+        "shared_by_all": {
+            "global": sum(shared_by_all.values()),
+            "sites": shared_by_all,
+        },
+    }
@@ -0,0 +1,249 @@
+import os
+import shutil
+import sqlite3
+from typing import Iterable, Optional
+
+# OpenWPM tables exported to the columnar store
+TABLES_TO_EXPORT = (
+    "site_visits",
+    "crawl_history",
+    "http_requests",
+    "http_responses",
+    "http_redirects",
+    "javascript",
+    "javascript_cookies",
+    "navigations",
+    "dns_responses",
+)
+# high cardinality but very repetitive columns, stored dictionary-encoded
+DICTIONARY_COLUMNS = (
+    "site_url",
+    "url",
+    "top_level_url",
+    "document_url",
+    "script_url",
+    "referrer",
+    "host",
+    "hostname",
+    "old_request_url",
+    "new_request_url",
+    "frame_url",
+    "command",
+    "resource_type",
+    "method",
+)
+# number of partitions the visits of an audit are spread over (by visit_id)
+VISIT_BUCKETS = 16
+# rows read from sqlite at a time
+CHUNK_ROWS = 100_000
+
+
+def _pyarrow():
+    """Import pyarrow, which is only needed for the columnar export"""
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "The columnar export requires pyarrow, install it with `pip install pyarrow`"
+        ) from e
+    return pyarrow
+
+
+def _arrow_type(pa, declared_type: str):
+    """Map a sqlite declared column type to an arrow type, following sqlite's type affinity rules"""
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type or "BOOL" in declared_type:
+        return pa.int64()
+    if any(t in declared_type for t in ("REAL", "FLOA", "DOUB")):
+        return pa.float64()
+    if "BLOB" in declared_type:
+        return pa.binary()
+    return pa.string()
+
+
+def _coerce(values: list, arrow_type, pa) -> list:
+    """sqlite does not enforce column types, so cast the odd values to the column type"""
+    if arrow_type == pa.string():
+        return [v if v is None or isinstance(v, str) else str(v) for v in values]
+    if arrow_type == pa.int64():
+        return [v if v is None or isinstance(v, int) else _to_int(v) for v in values]
+    if arrow_type == pa.float64():
+        return [v if v is None or isinstance(v, float) else _to_float(v) for v in values]
+    return values
+
+
+def _to_int(v) -> Optional[int]:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(v) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def export_audit(
+    db_path: str,
+    output_dir: str,
+    audit: Optional[str] = None,
+    location: Optional[str] = None,
+    tables: Iterable[str] = TABLES_TO_EXPORT,
+    chunk_rows: int = CHUNK_ROWS,
+) -> dict:
+    """
+    Export a finished audit's sqlite database to parquet files partitioned by audit, location and visit bucket,
+    i.e. output_dir/<table>/audit=<audit>/location=<location>/visit_bucket=<n>/*.parquet.
+    Re-exporting an audit replaces its files.
+        db_path: str; path to the audit's sqlite database
+        output_dir: str; root directory of the columnar store
+        audit: str; name of the audit, defaults to the database file name
+        location: str; location of the audit, e.g. pt
+        tables: tables to export, the ones missing in the db are skipped
+        chunk_rows: int; rows read from sqlite and written at a time
+    Returns a dict with the number of rows exported per table.
+    """
+    pa = _pyarrow()
+    audit = audit or os.path.splitext(os.path.basename(db_path))[0]
+    location = location or "unknown"
+    partitioning = pa.dataset.partitioning(
+        pa.schema(
+            [
+                ("audit", pa.string()),
+                ("location", pa.string()),
+                ("visit_bucket", pa.int64()),
+            ]
+        ),
+        flavor="hive",
+    )
+    exported = {}
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        existing = {
+            row[0]
+            for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+        }
+        for table in tables:
+            if table not in existing:
+                continue
+            table_info = con.execute(f"PRAGMA table_info({table});").fetchall()
+            columns = [(name, _arrow_type(pa, declared)) for _, name, declared, *_ in table_info]
+            column_names = [name for name, _ in columns]
+            if "visit_id" not in column_names:
+                continue
+            # drop the previous export of this audit
+            table_dir = os.path.join(output_dir, table)
+            _remove_partition(table_dir, audit)
+            cursor = con.execute(f"SELECT * FROM {table};")
+            chunk_n = 0
+            exported[table] = 0
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                arrays = []
+                fields = []
+                for i, (name, arrow_type) in enumerate(columns):
+                    array = pa.array(
+                        _coerce([row[i] for row in rows], arrow_type, pa), type=arrow_type
+                    )
+                    if name in DICTIONARY_COLUMNS and arrow_type == pa.string():
+                        array = array.dictionary_encode()
+                    arrays.append(array)
+                    fields.append(pa.field(name, array.type))
+                visit_ids = [row[column_names.index("visit_id")] for row in rows]
+                arrays += [
+                    pa.array([audit] * len(rows), type=pa.string()),
+                    pa.array([location] * len(rows), type=pa.string()),
+                    pa.array(
+                        [(v or 0) % VISIT_BUCKETS for v in visit_ids], type=pa.int64()
+                    ),
+                ]
+                fields += [
+                    pa.field("audit", pa.string()),
+                    pa.field("location", pa.string()),
+                    pa.field("visit_bucket", pa.int64()),
+                ]
+                pa.dataset.write_dataset(
+                    pa.Table.from_arrays(arrays, schema=pa.schema(fields)),
+                    base_dir=table_dir,
+                    format="parquet",
+                    partitioning=partitioning,
+                    basename_template=f"part-{chunk_n}-{{i}}.parquet",
+                    existing_data_behavior="overwrite_or_ignore",
+                    file_options=pa.dataset.ParquetFileFormat().make_write_options(
+                        compression="zstd"
+                    ),
+                )
+                exported[table] += len(rows)
+                chunk_n += 1
+    finally:
+        con.close()
+    return exported
+
+
+def _remove_partition(table_dir: str, audit: str) -> None:
+    """Remove the files of an audit from a table directory"""
+    partition_dir = os.path.join(table_dir, f"audit={audit}")
+    if os.path.isdir(partition_dir):
+        shutil.rmtree(partition_dir)
+
+
+def read_table(
+    store_dir: str,
+    table: str,
+    columns: Optional[list] = None,
+    audits: Optional[list] = None,
+    locations: Optional[list] = None,
+    visit_ids: Optional[list] = None,
+    filter=None,
+):
+    """
+    Read a table from the columnar store as a pandas DataFrame.
+    Only the requested columns are read and the audit, location and visit filters prune whole partitions.
+        store_dir: str; root directory of the columnar store
+        table: str; e.g. "http_requests"
+        columns: list; columns to read, all if missing
+        audits: list; audit names to read, all if missing
+        locations: list; locations to read, all if missing
+        visit_ids: list; visit ids to read, all if missing
+        filter: pyarrow.dataset.Expression; any additional row filter, e.g. pyarrow.dataset.field("host") == "www.google-analytics.com"
+    """
+    pa = _pyarrow()
+    dataset = pa.dataset.dataset(
+        os.path.join(store_dir, table),
+        format="parquet",
+        partitioning=pa.dataset.partitioning(
+            pa.schema(
+                [
+                    ("audit", pa.string()),
+                    ("location", pa.string()),
+                    ("visit_bucket", pa.int64()),
+                ]
+            ),
+            flavor="hive",
+        ),
+    )
+    expressions = []
+    if audits:
+        expressions.append(pa.dataset.field("audit").isin(list(audits)))
+    if locations:
+        expressions.append(pa.dataset.field("location").isin(list(locations)))
+    if visit_ids:
+        expressions.append(
+            pa.dataset.field("visit_bucket").isin(
+                sorted({v % VISIT_BUCKETS for v in visit_ids})
+            )
+        )
+        expressions.append(pa.dataset.field("visit_id").isin(list(visit_ids)))
+    if filter is not None:
+        expressions.append(filter)
+    expression = None
+    for e in expressions:
+        expression = e if expression is None else expression & e
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
@@ -0,0 +1,130 @@
+import sqlite3
+from typing import Iterable, Iterator, Optional
+import numpy as np
+import pandas as pd
+from .utils import url_host, host_registered_domain, registered_domain, LABEL_CACHE_SIZE
+
+# rows labelled at a time when reading from an audit database
+LABEL_CHUNK_ROWS = 200_000
+
+
+def registered_domains(values: Iterable[str], are_hosts: bool = False) -> list:
+    """Registered domains of a whole column of urls (or hosts), parsing each distinct value once"""
+    to_domain = host_registered_domain if are_hosts else registered_domain
+    memo = {}
+    out = []
+    for v in values:
+        if v not in memo:
+            try:
+                memo[v] = (to_domain(v) or None) if v else None
+            except ValueError:
+                # malformed urls, e.g. invalid ipv6 hosts
+                memo[v] = None
+        out.append(memo[v])
+    return out
+
+
+def authority_prefix(url: str) -> str:
+    """Url cut right after its host, e.g. https://www.cm-lisboa.pt/a?b -> https://www.cm-lisboa.pt. See _authority_prefixes"""
+    end = url.find("/", url.find("//") + 2)
+    return url if end < 0 else url[:end]
+
+
+def _authority_prefixes(urls: list) -> list:
+    """
+    Cut each url right after its host (scheme, credentials, host and port are kept, path and query dropped).
+    url_host gives the same host for the prefix and for the url, and the prefixes repeat far more than the urls,
+    so only the distinct prefixes need to be parsed.
+    """
+    # a url without "//" is cut at its first "/" (or its second if it starts with one, same empty host)
+    return [
+        url if (end := url.find("/", url.find("//") + 2)) < 0 else url[:end]
+        for url in urls
+    ]
+
+
+def _factorize_authority_prefixes(column: pd.Series) -> tuple:
+    """
+    Codes and distinct values of the authority prefixes of a column of urls, like pd.factorize (-1 for missing urls).
+    The urls are cut with pyarrow compute kernels when pyarrow is installed, in a python loop otherwise.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        codes, uniques = pd.factorize(column)
+        prefix_codes, prefixes = pd.factorize(
+            pd.Series(_authority_prefixes(uniques.tolist()), dtype="object")
+        )
+        prefix_codes = np.append(prefix_codes, -1)
+        return prefix_codes[codes], prefixes.tolist()
+    urls = pa.array(column, type=pa.string(), from_pandas=True)
+    # scheme://host/... splits into [scheme:, "", host, ...], the first three parts joined back are the prefix
+    parts = pc.split_pattern(urls, "/", max_splits=3)
+    cut = pc.binary_join(pc.list_slice(parts, 0, 3), "/")
+    # urls whose first "/" is not the start of "//" are kept whole, any url is its own valid prefix
+    starts_with_authority = pc.equal(
+        pc.find_substring(urls, "//"), pc.find_substring(urls, "/")
+    )
+    prefixes = pc.if_else(starts_with_authority, cut, urls)
+    encoded = prefixes.dictionary_encode()
+    codes = encoded.indices.fill_null(-1).to_numpy(zero_copy_only=False)
+    return codes, encoded.dictionary.to_pylist()
+
+
+def _column_registered_domains(column: pd.Series, are_hosts: bool) -> pd.Series:
+    """Vectorised registered domains of a DataFrame column: factorize, label the distinct values, take"""
+    if are_hosts:
+        codes, uniques = pd.factorize(column)
+        domains = registered_domains(uniques.tolist(), are_hosts=True)
+    else:
+        # urls rarely repeat but their hosts do, label each distinct prefix once
+        codes, prefixes = _factorize_authority_prefixes(column)
+        domains = registered_domains(prefixes)
+    # factorize marks missing values with -1, which takes the trailing None
+    domains = np.array(domains + [None], dtype="object")
+    return pd.Series(domains[codes], index=column.index, dtype="object")
+
+
+def label_frame(
+    df: pd.DataFrame,
+    site_col: str = "site_url",
+    url_col: Optional[str] = "url",
+    host_col: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Add registered_domain, site_registered_domain and is_third_party columns to a DataFrame of requests or cookies.
+    A row is third party when its registered domain differs from the one of the site visited.
+        site_col: str; column with the site_url of the visit
+        url_col: str; column with the url of the request, e.g. http_requests.url
+        host_col: str; column with a hostname instead of a url, e.g. javascript_cookies.host. Used instead of url_col if given
+    """
+    if host_col:
+        df["registered_domain"] = _column_registered_domains(df[host_col], are_hosts=True)
+    else:
+        df["registered_domain"] = _column_registered_domains(df[url_col], are_hosts=False)
+    df["site_registered_domain"] = _column_registered_domains(df[site_col], are_hosts=False)
+    df["is_third_party"] = df["registered_domain"].notna() & (
+        df["registered_domain"] != df["site_registered_domain"]
+    )
+    return df
+
+
+def label_table(
+    db_path: str, table: str = "http_requests", chunk_rows: int = LABEL_CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    """
+    Read an OpenWPM table (http_requests, javascript_cookies, ...) in chunks, with the site_url of each row's visit
+    and the labels added by label_frame. Yields DataFrames.
+    """
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        sites = pd.read_sql_query("SELECT visit_id, site_url FROM site_visits;", con)
+        columns = [row[1] for row in con.execute(f"PRAGMA table_info({table});")]
+        host_col = "host" if "host" in columns else None
+        url_col = None if host_col else "url"
+        for chunk in pd.read_sql_query(f"SELECT * FROM {table};", con, chunksize=chunk_rows):
+            chunk = chunk.merge(sites, on="visit_id", how="left")
+            yield label_frame(chunk, url_col=url_col, host_col=host_col)
+    finally:
+        con.close()
@@ -0,0 +1,129 @@
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Iterable, Optional
+
+# statuses a site can have in the ledger
+SUBMITTED = "submitted"
+SUCCESS = "success"
+FAILED = "failed"
+# statuses for which a site will not be crawled again when resuming
+FINISHED_STATUSES = (SUCCESS, FAILED)
+
+
+class VisitLedger(object):
+    """
+    Small sqlite ledger holding one row per site of an audit: (site_url, status, attempt, finished_at, failure).
+    It lives next to the OpenWPM database, is written as each CommandSequence callback fires and
+    is used to resume a crashed audit without re-visiting the sites already done.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        path: str; path to the sqlite file holding the ledger, created if missing
+        """
+        self.path = str(path)
+        # callbacks fire from the TaskManager threads, so share a single connection guarded by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        # site_url is the primary key, so every lookup/update is an index hit
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS visit_ledger (
+                site_url TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempt INTEGER NOT NULL DEFAULT 0,
+                finished_at TEXT,
+                failure TEXT
+            );
+            """
+        )
+        # ledgers written before failures were classified
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(visit_ledger);")}
+        if "failure" not in columns:
+            self._conn.execute("ALTER TABLE visit_ledger ADD COLUMN failure TEXT;")
+
+    def mark_submitted(self, site: str) -> None:
+        """Record that a CommandSequence for the site was handed to the TaskManager"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO visit_ledger (site_url, status, attempt) VALUES (?, ?, 1) "
+                "ON CONFLICT(site_url) DO UPDATE SET status = excluded.status, "
+                "attempt = attempt + 1, finished_at = NULL, failure = NULL;",
+                (site, SUBMITTED),
+            )
+
+    def mark_finished(self, site: str, success: bool) -> None:
+        """Record the outcome of the CommandSequence for the site, called from its callback"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE visit_ledger SET status = ?, finished_at = ? WHERE site_url = ?;",
+                (
+                    SUCCESS if success else FAILED,
+                    datetime.now().isoformat(timespec="seconds"),
+                    site,
+                ),
+            )
+
+    def mark_failure(self, site: str, kind: str, permanent: bool) -> None:
+        """Record the kind of failure of the last visit to the site, e.g. 'dns (permanent)'"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE visit_ledger SET status = ?, failure = ? WHERE site_url = ?;",
+                (FAILED, f"{kind} (permanent)" if permanent else kind, site),
+            )
+
+    def status(self, site: str) -> Optional[str]:
+        """Current status of a site or None if it was never submitted"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM visit_ledger WHERE site_url = ?;", (site,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def finished_sites(self) -> set:
+        """Set with all the sites whose visit already finished"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT site_url FROM visit_ledger WHERE status IN (?, ?);",
+                FINISHED_STATUSES,
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def retries_left(self, max_attempts: int) -> dict:
+        """
+        Sites whose last visit failed but is worth visiting again: not a permanent failure and fewer than
+        max_attempts visits so far. Site -> visits so far
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT site_url, attempt FROM visit_ledger WHERE status = ? AND attempt < ? "
+                "AND (failure IS NULL OR failure NOT LIKE '%(permanent)');",
+                (FAILED, max_attempts),
+            ).fetchall()
+        return dict(rows)
+
+    def pending(self, websites: Iterable[str], max_attempts: Optional[int] = None) -> list:
+        """
+        Keep the order of websites but drop the ones already finished. With max_attempts, the failed visits
+        with retries left are kept too, the retry queue only lives as long as the crawl
+        """
+        finished = self.finished_sites()
+        if max_attempts is not None:
+            finished -= set(self.retries_left(max_attempts))
+        return [w for w in websites if w not in finished]
+
+    def counts(self) -> dict:
+        """Number of sites per status"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, count(*) FROM visit_ledger GROUP BY status;"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
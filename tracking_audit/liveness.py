@@ -0,0 +1,278 @@
+import os
+import ssl
+import time
+import socket
+import asyncio
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+from .constants import (
+    LIVENESS_TTL_SECONDS,
+    LIVENESS_TIMEOUT_SECONDS,
+    LIVENESS_CONCURRENCY,
+    LIVENESS_PER_HOST,
+    PREFLIGHT_SKIP,
+    PREFLIGHT_DEFER,
+)
+
+# outcomes of a probe
+OK = "ok"
+DNS_ERROR = "dns_error"
+CONNECTION_ERROR = "connection_error"
+TLS_ERROR = "tls_error"
+TIMEOUT = "timeout"
+HTTP_ERROR = "http_error"
+# what to do with the unreachable sites
+SKIP = PREFLIGHT_SKIP
+DEFER = PREFLIGHT_DEFER
+
+_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0"
+
+
+class LivenessCache(object):
+    """
+    sqlite cache of the probe results, one row per site: (site_url, status, reachable, http_status, seconds, checked_at).
+    Results older than the ttl are probed again.
+    """
+
+    def __init__(self, path: str, ttl: float = LIVENESS_TTL_SECONDS) -> None:
+        """
+        path: str; path to the sqlite file, created if missing. Can be shared by the audits of a trial
+        ttl: float; seconds a result is reused for
+        """
+        self.path = str(path)
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS liveness (
+                site_url TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                reachable INTEGER NOT NULL,
+                http_status INTEGER,
+                seconds REAL,
+                checked_at REAL NOT NULL
+            );
+            """
+        )
+
+    def fresh(self, sites: Iterable[str]) -> dict:
+        """Results still within the ttl for the sites, site_url -> result"""
+        sites = list(sites)
+        oldest = time.time() - self.ttl
+        out = {}
+        # sqlite limits the number of parameters of a query
+        for i in range(0, len(sites), 500):
+            chunk = sites[i : i + 500]
+            for row in self._conn.execute(
+                "SELECT site_url, status, reachable, http_status, seconds FROM liveness "
+                f"WHERE checked_at >= ? AND site_url IN ({', '.join('?' * len(chunk))});",
+                [oldest, *chunk],
+            ):
+                out[row[0]] = {
+                    "url": row[0],
+                    "status": row[1],
+                    "reachable": bool(row[2]),
+                    "http_status": row[3],
+                    "seconds": row[4],
+                }
+        return out
+
+    def put(self, results: Iterable[dict]) -> None:
+        now = time.time()
+        self._conn.execute("BEGIN;")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO liveness (site_url, status, reachable, http_status, seconds, checked_at) "
+            "VALUES (?, ?, ?, ?, ?, ?);",
+            [
+                (r["url"], r["status"], int(r["reachable"]), r["http_status"], r["seconds"], now)
+                for r in results
+            ],
+        )
+        self._conn.execute("COMMIT;")
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+async def http_head(
+    host: str, port: int, https: bool, path: str, timeout: float, ssl_context: ssl.SSLContext
+) -> tuple:
+    """
+    Status code and Location header of a HEAD request (a GET if the server closes the connection on HEAD).
+    Returns (status, location or None).
+    """
+    for method in ("HEAD", "GET"):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host,
+                port,
+                ssl=ssl_context if https else None,
+                server_hostname=host if https else None,
+            ),
+            timeout,
+        )
+        try:
+            writer.write(
+                f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: {_USER_AGENT}\r\n"
+                "Accept: */*\r\nConnection: close\r\n\r\n".encode("latin-1", "replace")
+            )
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), timeout)
+            if not status_line:
+                continue
+            parts = status_line.split()
+            if not (len(parts) >= 2 and parts[0].startswith(b"HTTP/") and parts[1].isdigit()):
+                raise ValueError(f"Not an http response: {status_line[:50]!r}")
+            status = int(parts[1])
+            location = None
+            # the headers are only read for redirects
+            if 300 <= status < 400:
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    if name.strip().lower() == "location":
+                        location = value.strip()
+            return status, location
+        finally:
+            writer.close()
+    raise ConnectionError("The server closed the connection without answering")
+
+
+def split_url(url: str) -> tuple:
+    """(https, host, port, path) of a url, https if the scheme is missing. Raises ValueError if there is no host"""
+    parts = urlsplit(url if "//" in url else "https://" + url)
+    https = parts.scheme != "http"
+    host = parts.hostname
+    port = parts.port or (443 if https else 80)
+    if not host:
+        raise ValueError(f"No host in '{url}'")
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    return https, host, port, path
+
+
+def unverified_ssl_context() -> ssl.SSLContext:
+    """reachability only, the browser decides what to do with invalid certificates"""
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    return ssl_context
+
+
+async def probe_site(url: str, timeout: float, ssl_context: ssl.SSLContext) -> dict:
+    """Check DNS, TCP (and TLS) and HTTP for one site. Any http answer, even an error status, means reachable"""
+    result = {"url": url, "status": None, "reachable": False, "http_status": None}
+    start = time.monotonic()
+    try:
+        https, host, port, path = split_url(url)
+    except ValueError:
+        result.update(status=DNS_ERROR, seconds=0.0)
+        return result
+    try:
+        await asyncio.wait_for(
+            asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM),
+            timeout,
+        )
+        result["status"] = CONNECTION_ERROR
+        result["http_status"], _ = await http_head(
+            host, port, https, path, timeout - (time.monotonic() - start), ssl_context
+        )
+        result.update(status=OK, reachable=True)
+    except asyncio.TimeoutError:
+        result["status"] = TIMEOUT
+    except socket.gaierror:
+        result["status"] = DNS_ERROR
+    except ssl.SSLError:
+        result["status"] = TLS_ERROR
+    except ValueError:
+        result["status"] = HTTP_ERROR
+    except (OSError, UnicodeError):
+        # refused, reset or unreachable; DNS errors are only raised by getaddrinfo
+        result["status"] = result["status"] or DNS_ERROR
+    result["seconds"] = round(time.monotonic() - start, 3)
+    return result
+
+
+async def _probe_all(
+    sites: list, timeout: float, concurrency: int, per_host: int
+) -> list:
+    ssl_context = unverified_ssl_context()
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host))
+
+    async def bounded(url: str) -> dict:
+        host = urlsplit(url if "//" in url else "//" + url).netloc.lower()
+        async with host_limits[host], limit:
+            return await probe_site(url, timeout, ssl_context)
+
+    return await asyncio.gather(*(bounded(url) for url in sites))
+
+
+def probe_sites(
+    sites: Iterable[str],
+    cache_path: Optional[str] = None,
+    ttl: float = LIVENESS_TTL_SECONDS,
+    timeout: float = LIVENESS_TIMEOUT_SECONDS,
+    concurrency: int = LIVENESS_CONCURRENCY,
+    per_host: int = LIVENESS_PER_HOST,
+) -> dict:
+    """
+    Probe many sites concurrently, reusing the cached results younger than the ttl.
+        cache_path: str; sqlite cache of the results, none if missing
+        timeout: float; seconds allowed for each site (DNS, connection and first response line)
+        concurrency: int; sites probed at the same time
+        per_host: int; sites of the same host probed at the same time
+    Returns site_url -> result dict (status, reachable, http_status, seconds, cached).
+    """
+    sites = list(dict.fromkeys(sites))
+    cache = LivenessCache(cache_path, ttl) if cache_path else None
+    try:
+        results = cache.fresh(sites) if cache else {}
+        for r in results.values():
+            r["cached"] = True
+        to_probe = [s for s in sites if s not in results]
+        if to_probe:
+            probed = asyncio.run(_probe_all(to_probe, timeout, concurrency, per_host))
+            if cache:
+                cache.put(probed)
+            for r in probed:
+                r["cached"] = False
+                results[r["url"]] = r
+    finally:
+        if cache:
+            cache.close()
+    return results
+
+
+def order_by_liveness(sites: list, results: dict, mode: str = DEFER) -> list:
+    """
+    Drop (mode="skip") or move to the end (mode="defer") the unreachable sites, keeping the order otherwise.
+    Sites without a result are kept as reachable.
+    """
+    alive = [s for s in sites if results.get(s, {}).get("reachable", True)]
+    if mode == SKIP:
+        return alive
+    if mode == DEFER:
+        return alive + [s for s in sites if not results.get(s, {}).get("reachable", True)]
+    raise ValueError(f"Unknown mode '{mode}', use '{SKIP}' or '{DEFER}'")
+
+
+def summarize(results: dict) -> dict:
+    """Counts per status, for the crawl config"""
+    counts = defaultdict(int)
+    for r in results.values():
+        counts[r["status"]] += 1
+    return {
+        "probed_at": datetime.now().isoformat(timespec="seconds"),
+        "sites": len(results),
+        "cached": sum(bool(r.get("cached")) for r in results.values()),
+        "unreachable": sum(not r["reachable"] for r in results.values()),
+        "statuses": dict(counts),
+        "unreachable_sites": sorted(u for u, r in results.items() if not r["reachable"]),
+    }
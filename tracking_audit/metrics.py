@@ -0,0 +1,181 @@
+import os
+import json
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+
+def _percentile(values: list, q: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of numbers, q in [0, 100]"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class CrawlMetrics(object):
+    """
+    Per-visit timings and running aggregates of a crawl, written continuously next to the audit:
+        * metrics.jsonl: one json line per finished visit, once its crawl_history is known: the page load seconds
+          and the failed commands come from there, the OpenWPM callbacks only fire after the storage flush
+        * metrics.prom: the running aggregates in the Prometheus text format, rewritten after each visit
+    """
+
+    def __init__(self, output_dir: str, audit_name: str) -> None:
+        """
+        output_dir: str; the audit's output directory
+        audit_name: str; name of the audit, used as a label of the aggregates
+        """
+        self.audit_name = audit_name
+        self.visits_path = os.path.join(output_dir, "metrics.jsonl")
+        self.prom_path = os.path.join(output_dir, "metrics.prom")
+        self.started_at = time.time()
+        # seconds the crawl was paused, e.g. outside of the active window
+        self.paused_seconds = 0.0
+        self.visits = 0
+        self.failures = 0
+        self.browser_restarts = 0
+        self.latencies = []
+        # page load seconds of the GetCommands, from crawl_history
+        self.get_latencies = []
+        # visits in flight: site -> timings recorded at submission
+        self._in_flight = {}
+        # visits finished and waiting for their crawl_history: site -> row without it
+        self._finished = {}
+        # last known process id of each browser, a new one means the browser was restarted
+        self._browser_pids = {}
+        self._lock = threading.Lock()
+
+    def visit_submitted(
+        self,
+        site: str,
+        browser_id: Optional[int],
+        queue_wait: float,
+        dwell: float,
+    ) -> None:
+        """
+        Record a visit handed to a browser
+            queue_wait: float; seconds waiting for a free browser and an eligible host before submission
+            dwell: float; seconds the browser stays on the page after loading it
+        """
+        with self._lock:
+            self._in_flight[site] = {
+                "browser_id": browser_id,
+                "queue_wait": queue_wait,
+                "dwell": dwell,
+                "submitted_at": time.time(),
+            }
+
+    def visit_finished(self, site: str, success: bool) -> None:
+        """Record the end of a visit, called from the CommandSequence callback"""
+        finished_at = time.time()
+        with self._lock:
+            timings = self._in_flight.pop(site, None)
+            if timings is None:
+                return
+            # submission to callback, the storage flush and the callback polling included
+            visit_seconds = finished_at - timings["submitted_at"]
+            self.visits += 1
+            self.failures += int(not success)
+            self.latencies.append(visit_seconds)
+            self._finished[site] = {
+                "site_url": site,
+                "browser_id": timings["browser_id"],
+                "success": success,
+                "queue_wait_seconds": round(timings["queue_wait"], 3),
+                "visit_seconds": round(visit_seconds, 3),
+                "dwell_seconds": round(timings["dwell"], 3),
+                "finished_at": datetime.fromtimestamp(finished_at).isoformat(
+                    timespec="seconds"
+                ),
+            }
+            self._write_prom()
+
+    def visit_recorded(self, site: str, visit_id: Optional[int], commands: Optional[dict]) -> None:
+        """
+        Write the row of a finished visit with the outcome of its commands (see timeouts.visit_commands),
+        None if its crawl_history was not written
+        """
+        commands = commands or {}
+        with self._lock:
+            row = self._finished.pop(site, None)
+            if row is None:
+                return
+            if commands.get("get_seconds") is not None:
+                self.get_latencies.append(commands["get_seconds"])
+            row = {
+                **row,
+                "visit_id": visit_id,
+                # duration of the GetCommand without the dwell, None without crawl_history
+                "get_seconds": commands.get("get_seconds"),
+                "command_status": commands.get("command_status"),
+                "error": commands.get("error"),
+                "failed_commands": commands.get("failed_commands", []),
+            }
+            with open(self.visits_path, "a") as f:
+                f.write(json.dumps(row) + "\n")
+
+    def browser_seen(self, browser_id: int, pid: Optional[int]) -> None:
+        """Check the process id of a browser before a visit, counting a restart if it changed"""
+        if pid is None:
+            return
+        with self._lock:
+            previous = self._browser_pids.get(browser_id)
+            if previous is not None and previous != pid:
+                self.browser_restarts += 1
+            self._browser_pids[browser_id] = pid
+
+    def paused(self, seconds: float) -> None:
+        """Record a pause of the crawl, left out of the throughput"""
+        with self._lock:
+            self.paused_seconds += seconds
+
+    def summary(self) -> dict:
+        """Running aggregates of the crawl"""
+        active_seconds = max(time.time() - self.started_at - self.paused_seconds, 1e-9)
+        return {
+            "visits": self.visits,
+            "failures": self.failures,
+            "failure_rate": self.failures / self.visits if self.visits else 0.0,
+            "sites_per_hour": self.visits / active_seconds * 3600,
+            "visit_latency_p50_seconds": _percentile(self.latencies, 50),
+            "visit_latency_p95_seconds": _percentile(self.latencies, 95),
+            "get_latency_p50_seconds": _percentile(self.get_latencies, 50),
+            "get_latency_p95_seconds": _percentile(self.get_latencies, 95),
+            "browser_restarts": self.browser_restarts,
+            "active_seconds": active_seconds,
+            "paused_seconds": self.paused_seconds,
+        }
+
+    def _write_prom(self) -> None:
+        """Rewrite the Prometheus text file, atomically so that readers never see a partial file"""
+        summary = self.summary()
+        label = f'audit="{self.audit_name}"'
+        lines = [
+            "# HELP crawl_visits_total Visits finished.",
+            "# TYPE crawl_visits_total counter",
+            f'crawl_visits_total{{{label},outcome="success"}} {summary["visits"] - summary["failures"]}',
+            f'crawl_visits_total{{{label},outcome="failure"}} {summary["failures"]}',
+            "# HELP crawl_failure_rate Share of the visits that failed.",
+            "# TYPE crawl_failure_rate gauge",
+            f"crawl_failure_rate{{{label}}} {summary['failure_rate']:.6f}",
+            "# HELP crawl_sites_per_hour Visits finished per hour of active crawling.",
+            "# TYPE crawl_sites_per_hour gauge",
+            f"crawl_sites_per_hour{{{label}}} {summary['sites_per_hour']:.3f}",
+            "# HELP crawl_visit_latency_seconds Visit duration from submission to callback.",
+            "# TYPE crawl_visit_latency_seconds summary",
+            f'crawl_visit_latency_seconds{{{label},quantile="0.5"}} {summary["visit_latency_p50_seconds"]:.3f}',
+            f'crawl_visit_latency_seconds{{{label},quantile="0.95"}} {summary["visit_latency_p95_seconds"]:.3f}',
+            f"crawl_visit_latency_seconds_sum{{{label}}} {sum(self.latencies):.3f}",
+            f"crawl_visit_latency_seconds_count{{{label}}} {len(self.latencies)}",
+            "# HELP crawl_browser_restarts_total Browser restarts seen between visits.",
+            "# TYPE crawl_browser_restarts_total counter",
+            f"crawl_browser_restarts_total{{{label}}} {summary['browser_restarts']}",
+        ]
+        tmp_path = self.prom_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
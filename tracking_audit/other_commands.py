@@ -9,9 +9,9 @@ Steps to have a custom command run as part of a CommandSequence
 
 """
 import logging
-import time
 from datetime import datetime
 from .constants import PATH_TO_OPENWPM, ACTIVE_STATUS_STOP, ACTIVE_STATUS_START
+from .scheduling import ActiveWindow
 from selenium.webdriver import Firefox
 import sys
 
@@ -31,6 +31,7 @@ class ScheduleManager(BaseCommand):
         self.logger = logging.getLogger("openwpm")
         self.active_time_start = active_time_start
         self.active_time_stop = active_time_stop
+        self.window = ActiveWindow(active_time_start, active_time_stop)
 
     # While this is not strictly necessary, we use the repr of a command for logging
     # So not having a proper repr will make your logs a lot less useful
@@ -46,9 +47,8 @@ class ScheduleManager(BaseCommand):
         manager_params: ManagerParams,
         extension_socket: ClientSocket,
     ) -> None:
-        hour_now = datetime.now().hour
-        if hour_now < self.active_time_start or hour_now > self.active_time_stop:
+        if not self.window.is_active():
+            hour_now = datetime.now().hour
             print(f"[!] It is {hour_now} o'clock. Will sleep until the next active start time at {self.active_time_start}")
-            while abs(datetime.now().hour - self.active_time_start) != 0:
-                time.sleep(1)
-                print('...', end='', flush=True)
\ No newline at end of file
+            slept = self.window.sleep_until_active()
+            self.logger.info(f"ScheduleManager paused the browser for {slept:.0f} seconds")
\ No newline at end of file
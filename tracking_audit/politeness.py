@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Tuple
+from .constants import HOST_COOLDOWN_SECONDS, HOST_RESOLVE_WORKERS
+from .utils import url_host, host_ip, registered_domain
+
+
+class PolitenessScheduler(object):
+    """
+    Hands the sites to the free browsers in order, skipping the ones whose host is not eligible yet.
+    A host is eligible if no browser is visiting it and its cooldown since the last visit is over.
+    Hosts are keyed by registered domain and, optionally, by ip address (e.g. municipalities sharing a hosting provider).
+    The keys are resolved when the sites are added, outside the lock, so a slow dns lookup never blocks release().
+    """
+
+    def __init__(
+        self,
+        sites: Iterable[Tuple[int, str]] = (),
+        cooldown: float = HOST_COOLDOWN_SECONDS,
+        per_ip: bool = False,
+    ) -> None:
+        """
+        sites: iterable of (rank, url) tuples, in the order they should be visited
+        cooldown: float; seconds between the end of a visit and the next visit to the same host
+        per_ip: bool; also apply the cooldown per ip address of the host
+        """
+        self.cooldown = cooldown
+        self.per_ip = per_ip
+        sites = list(sites)
+        urls = [site for _, site in sites]
+        ips = [None] * len(urls)
+        if per_ip:
+            # the dns lookups run concurrently, dead hosts each wait for the resolver timeout
+            with ThreadPoolExecutor(max_workers=HOST_RESOLVE_WORKERS) as executor:
+                ips = list(executor.map(host_ip, [url_host(url) for url in urls]))
+        # (rank, url, host keys) of the sites waiting to be visited
+        self._pending = deque(
+            (rank, site, self._keys(site, ip)) for (rank, site), ip in zip(sites, ips)
+        )
+        # number of visits in flight per host key
+        self._in_flight = defaultdict(int)
+        # time at which each host key becomes eligible again
+        self._available_at = {}
+        # keys of the sites in flight, so that release does not resolve them again
+        self._site_keys = {}
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        """Number of sites waiting to be visited"""
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of sites handed out and not released yet"""
+        with self._cond:
+            return len(self._site_keys)
+
+    def add(self, rank: int, site: str) -> None:
+        """Add a site at the end of the queue"""
+        keys = self._keys(site, host_ip(url_host(site)) if self.per_ip else None)
+        with self._cond:
+            self._pending.append((rank, site, keys))
+            self._cond.notify_all()
+
+    @staticmethod
+    def _keys(site: str, ip: Optional[str] = None) -> tuple:
+        """Host keys of a site: its registered domain and, when keyed by ip, its ip address"""
+        keys = (registered_domain(site),)
+        if ip:
+            keys += (ip,)
+        return keys
+
+    def _eligible(self, keys: tuple, now: float) -> bool:
+        return all(
+            not self._in_flight[k] and self._available_at.get(k, 0) <= now for k in keys
+        )
+
+    def next_site(self) -> Optional[Tuple[int, str]]:
+        """
+        Return the first (rank, url) whose host is eligible, waiting for one if needed.
+        Returns None once there are no more sites to visit.
+        """
+        with self._cond:
+            while self._pending:
+                now = time.monotonic()
+                # the blocked hosts are at most the ones in flight or cooling down, so the scan stops early
+                for position, (rank, site, keys) in enumerate(self._pending):
+                    if self._eligible(keys, now):
+                        del self._pending[position]
+                        for k in keys:
+                            self._in_flight[k] += 1
+                        self._site_keys[site] = keys
+                        return rank, site
+                # nothing eligible, wait for a release or for the earliest cooldown to end
+                waits = [t - now for t in self._available_at.values() if t > now]
+                self._cond.wait(timeout=min(waits) if waits else None)
+            return None
+
+    def release(self, site: str) -> None:
+        """Mark the visit to a site as finished, starting the cooldown of its host"""
+        with self._cond:
+            keys = self._site_keys.pop(site, None)
+            if keys is None:
+                return
+            available_at = time.monotonic() + self.cooldown
+            for k in keys:
+                self._in_flight[k] -= 1
+                self._available_at[k] = max(self._available_at.get(k, 0), available_at)
+            self._cond.notify_all()
@@ -0,0 +1,121 @@
+import os
+import bz2
+import gzip
+import json
+import lzma
+import time
+import shutil
+import hashlib
+import tarfile
+import threading
+from pathlib import Path
+from typing import Tuple
+from .constants import SEED_CACHE_DIR
+
+# compressed tar formats, by magic bytes
+_DECOMPRESSORS = (
+    (b"\x1f\x8b", gzip.open),
+    (b"BZh", bz2.open),
+    (b"\xfd7zXZ", lzma.open),
+)
+# bytes read at a time while hashing and decompressing
+_CHUNK_SIZE = 1 << 20
+
+
+def _open_decompressed(path: str):
+    """Binary file object with the tar inside a (possibly compressed) seed profile"""
+    with open(path, "rb") as f:
+        magic = f.read(6)
+    for prefix, opener in _DECOMPRESSORS:
+        if magic.startswith(prefix):
+            return opener(path, "rb")
+    return open(path, "rb")
+
+
+class SeedProfileCache(object):
+    """
+    Seed profiles stored once, uncompressed, under <cache_dir>/<sha256 of the seed>/profile.tar.
+    OpenWPM extracts the seed tar at every browser launch and restart; from the cache this is a plain tar read
+    instead of a decompression. Each browser gets a hardlink to the cached tar (a copy across file systems).
+    The hash of a seed is kept by (path, size, mtime), so an unchanged seed is not read again.
+    """
+
+    def __init__(self, cache_dir: str = SEED_CACHE_DIR) -> None:
+        """
+        cache_dir: str; directory of the cache, shared by all the audits
+        """
+        self.cache_dir = Path(cache_dir)
+        self.index_path = self.cache_dir / "hashes.json"
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, path: str) -> str:
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def _read_index(self) -> dict:
+        if not self.index_path.is_file():
+            return {}
+        with open(self.index_path, "r") as f:
+            return json.load(f)
+
+    def seed_hash(self, path: str) -> str:
+        """sha256 of a seed profile, read from the index if the file did not change"""
+        fingerprint = self._fingerprint(path)
+        with self._lock:
+            index = self._read_index()
+            if fingerprint in index:
+                return index[fingerprint]
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                    h.update(chunk)
+            index[fingerprint] = h.hexdigest()
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = str(self.index_path) + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=4)
+            os.replace(tmp_path, self.index_path)
+            return index[fingerprint]
+
+    def get(self, path: str) -> Tuple[Path, dict]:
+        """
+        Cached uncompressed tar of a seed profile, made on the first use.
+        Returns its path and the timings of the lookup (hash, decompression and whether the cache was hit).
+        """
+        start = time.perf_counter()
+        seed_hash = self.seed_hash(path)
+        hashed = time.perf_counter()
+        cached = self.cache_dir / seed_hash / "profile.tar"
+        hit = cached.is_file()
+        if not hit:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cached.with_suffix(".tar.tmp")
+            with _open_decompressed(path) as src, open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+            if not tarfile.is_tarfile(tmp_path):
+                os.remove(tmp_path)
+                raise ValueError(f"{path} is not a (compressed) tar of a firefox profile")
+            # the cache entry only appears once complete, so a crash never leaves half a tar behind
+            os.replace(tmp_path, cached)
+        return cached, {
+            "seed_hash": seed_hash,
+            "cache_hit": hit,
+            "hash_seconds": round(hashed - start, 3),
+            "decompress_seconds": round(time.perf_counter() - hashed, 3),
+        }
+
+    @staticmethod
+    def link(cached: Path, destination: Path) -> str:
+        """Give a browser its own path to the cached tar. Returns how: 'hardlink' or 'copy'"""
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if destination.exists():
+            if os.path.samefile(cached, destination):
+                return "hardlink"
+            destination.unlink()
+        try:
+            os.link(cached, destination)
+            return "hardlink"
+        except OSError:
+            # another file system, or one without hardlinks
+            shutil.copyfile(cached, destination)
+            return "copy"
@@ -0,0 +1,208 @@
+import os
+import ssl
+import time
+import socket
+import asyncio
+import sqlite3
+from collections import defaultdict
+from typing import Iterable, Optional
+from urllib.parse import urljoin, urlsplit
+from .constants import (
+    REDIRECT_MAX_HOPS,
+    REDIRECT_TTL_SECONDS,
+    LIVENESS_TIMEOUT_SECONDS,
+    LIVENESS_CONCURRENCY,
+    LIVENESS_PER_HOST,
+)
+from .liveness import (
+    OK,
+    DNS_ERROR,
+    CONNECTION_ERROR,
+    TLS_ERROR,
+    TIMEOUT,
+    HTTP_ERROR,
+    http_head,
+    split_url,
+    unverified_ssl_context,
+)
+
+# outcome of a chain that does not end, e.g. a redirect loop
+TOO_MANY_REDIRECTS = "too_many_redirects"
+
+
+class RedirectCache(object):
+    """
+    sqlite cache of the resolved redirect chains, one row per url: (url, final_url, hops, status, checked_at).
+    Chains older than the ttl are resolved again.
+    """
+
+    def __init__(self, path: str, ttl: float = REDIRECT_TTL_SECONDS) -> None:
+        """
+        path: str; path to the sqlite file, created if missing
+        ttl: float; seconds a chain is reused for
+        """
+        self.path = str(path)
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS redirects (
+                url TEXT PRIMARY KEY,
+                final_url TEXT,
+                hops INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                checked_at REAL NOT NULL
+            );
+            """
+        )
+
+    def fresh(self, urls: Iterable[str]) -> dict:
+        """Chains still within the ttl for the urls, url -> result"""
+        urls = list(urls)
+        oldest = time.time() - self.ttl
+        out = {}
+        # sqlite limits the number of parameters of a query
+        for i in range(0, len(urls), 500):
+            chunk = urls[i : i + 500]
+            for row in self._conn.execute(
+                "SELECT url, final_url, hops, status FROM redirects "
+                f"WHERE checked_at >= ? AND url IN ({', '.join('?' * len(chunk))});",
+                [oldest, *chunk],
+            ):
+                out[row[0]] = {"url": row[0], "final_url": row[1], "hops": row[2], "status": row[3]}
+        return out
+
+    def put(self, results: Iterable[dict]) -> None:
+        now = time.time()
+        self._conn.execute("BEGIN;")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO redirects (url, final_url, hops, status, checked_at) VALUES (?, ?, ?, ?, ?);",
+            [(r["url"], r["final_url"], r["hops"], r["status"], now) for r in results],
+        )
+        self._conn.execute("COMMIT;")
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def origin(url: str) -> Optional[str]:
+    """scheme://host[:port] of a url, lower case and without the default port"""
+    try:
+        https, host, port, _ = split_url(url)
+    except ValueError:
+        return None
+    scheme = "https" if https else "http"
+    default = 443 if https else 80
+    return f"{scheme}://{host.lower()}" + (f":{port}" if port != default else "")
+
+
+async def resolve_url(
+    url: str, timeout: float, ssl_context: ssl.SSLContext, max_hops: int = REDIRECT_MAX_HOPS
+) -> dict:
+    """
+    Follow the HTTP redirects of a url. Only Location headers are followed, not meta refreshes or scripts.
+    Returns a dict with the final url (None if it could not be reached), the number of hops and the status.
+    """
+    result = {"url": url, "final_url": None, "hops": 0, "status": None}
+    current = url if "//" in url else "https://" + url
+    seen = set()
+    try:
+        for hops in range(max_hops + 1):
+            https, host, port, path = split_url(current)
+            result["status"] = CONNECTION_ERROR
+            status, location = await asyncio.wait_for(
+                http_head(host, port, https, path, timeout, ssl_context), timeout
+            )
+            result["hops"] = hops
+            seen.add(current)
+            if not (300 <= status < 400 and location):
+                result.update(final_url=current, status=OK)
+                return result
+            current = urljoin(current, location)
+            if current in seen:
+                break
+        result["status"] = TOO_MANY_REDIRECTS
+    except asyncio.TimeoutError:
+        result["status"] = TIMEOUT
+    except ssl.SSLError:
+        result["status"] = TLS_ERROR
+    except ValueError:
+        result["status"] = HTTP_ERROR
+    except socket.gaierror:
+        result["status"] = DNS_ERROR
+    except (OSError, UnicodeError):
+        result["status"] = result["status"] or DNS_ERROR
+    return result
+
+
+async def _resolve_all(urls: list, timeout: float, concurrency: int, per_host: int, max_hops: int) -> list:
+    ssl_context = unverified_ssl_context()
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host))
+
+    async def bounded(url: str) -> dict:
+        host = urlsplit(url if "//" in url else "//" + url).netloc.lower()
+        async with host_limits[host], limit:
+            return await resolve_url(url, timeout, ssl_context, max_hops)
+
+    return await asyncio.gather(*(bounded(url) for url in urls))
+
+
+def resolve_redirects(
+    urls: Iterable[str],
+    cache_path: Optional[str] = None,
+    ttl: float = REDIRECT_TTL_SECONDS,
+    timeout: float = LIVENESS_TIMEOUT_SECONDS,
+    concurrency: int = LIVENESS_CONCURRENCY,
+    per_host: int = LIVENESS_PER_HOST,
+    max_hops: int = REDIRECT_MAX_HOPS,
+) -> dict:
+    """
+    Resolve the redirect chains of many urls concurrently, reusing the cached chains younger than the ttl.
+        cache_path: str; sqlite cache of the chains, none if missing
+        timeout: float; seconds allowed for each hop
+        concurrency: int; urls resolved at the same time
+        per_host: int; urls of the same host resolved at the same time
+    Returns url -> result dict (final_url, hops, status, cached).
+    """
+    urls = list(dict.fromkeys(urls))
+    cache = RedirectCache(cache_path, ttl) if cache_path else None
+    try:
+        results = cache.fresh(urls) if cache else {}
+        for r in results.values():
+            r["cached"] = True
+        to_resolve = [u for u in urls if u not in results]
+        if to_resolve:
+            resolved = asyncio.run(_resolve_all(to_resolve, timeout, concurrency, per_host, max_hops))
+            if cache:
+                cache.put(resolved)
+            for r in resolved:
+                r["cached"] = False
+                results[r["url"]] = r
+    finally:
+        if cache:
+            cache.close()
+    return results
+
+
+def canonicalize(websites: dict, results: dict) -> dict:
+    """
+    Keep one website per final origin. The first website of each group is the crawl target; it gets the
+    "final_url" it lands on and the records of the other websites of the group under "aliases". Websites whose
+    chain could not be resolved are kept as they are.
+        websites: dict; dataset of websites (id -> record with a "url")
+        results: dict; url -> result of resolve_redirects
+    Returns the canonical dataset, with new consecutive ids.
+    """
+    groups = {}
+    for i, record in websites.items():
+        final_url = results.get(record["url"], {}).get("final_url")
+        # unresolved websites are groups of their own
+        key = origin(final_url) if final_url else ("unresolved", i)
+        if key not in groups:
+            groups[key] = dict(record, final_url=final_url, aliases=[])
+        else:
+            groups[key]["aliases"].append(record)
+    return {i: record for i, record in enumerate(groups.values())}
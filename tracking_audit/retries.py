@@ -0,0 +1,177 @@
+import re
+import heapq
+import sqlite3
+import time
+from collections import Counter
+from typing import Iterable, Optional, Tuple
+from .constants import (
+    RETRY_MAX_ATTEMPTS,
+    RETRY_BACKOFF_SECONDS,
+    RETRY_BACKOFF_FACTOR,
+)
+
+# kinds of failed visits
+TIMEOUT = "timeout"
+DNS = "dns"
+TLS = "tls"
+NETWORK = "network"
+BROWSER_CRASH = "browser_crash"
+HTTP_ERROR = "http_error"
+UNKNOWN = "unknown"
+# kinds worth visiting again, the others fail the same way every time
+RETRYABLE = (TIMEOUT, NETWORK, BROWSER_CRASH, HTTP_ERROR, UNKNOWN)
+# firefox about:neterror codes of the failures that do not go away by trying again
+PERMANENT_NETERRORS = {
+    "dnsNotFound": DNS,
+    "nssFailure2": TLS,
+    "nssBadCert": TLS,
+    "malformedURI": NETWORK,
+    "unknownProtocolFound": NETWORK,
+    "deniedPortAccess": NETWORK,
+    "blockedByPolicy": NETWORK,
+}
+# http status of the page that are worth visiting again
+RETRYABLE_HTTP_STATUSES = (429, 500, 502, 503, 504)
+
+_NETERROR_CODE = re.compile(r"[?&]e=(\w+)")
+
+
+def classify_failure(
+    command_status: Optional[str], error: Optional[str], http_status: Optional[int] = None
+) -> Optional[Tuple[str, bool]]:
+    """
+    Kind of failure of a visit from its GetCommand crawl_history row and the status of the page.
+    Returns (kind, retryable), or None if the visit did not fail.
+    """
+    if command_status == "ok":
+        if http_status in RETRYABLE_HTTP_STATUSES:
+            return HTTP_ERROR, True
+        return None
+    if command_status == "timeout":
+        return TIMEOUT, True
+    if command_status == "critical":
+        return BROWSER_CRASH, True
+    if command_status == "neterror":
+        # OpenWPM keeps the error code of the about:neterror page, or its whole url
+        match = _NETERROR_CODE.search(error or "")
+        code = match.group(1) if match else (error or "").strip()
+        if code in PERMANENT_NETERRORS:
+            return PERMANENT_NETERRORS[code], False
+        return NETWORK, True
+    if command_status == "error" and error and "WebDriver" in error:
+        return BROWSER_CRASH, True
+    return UNKNOWN, True
+
+
+def visit_outcomes(db_path: str, visit_ids: Iterable[int]) -> dict:
+    """
+    (command_status, error, http_status) of the GetCommand of visits, visit_id -> outcome. The http status is the
+    one of the last main frame response. Visits whose crawl_history was not written yet are missing.
+    """
+    visit_ids = list(visit_ids)
+    out = {}
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=60)
+    try:
+        # sqlite limits the number of parameters of a query
+        for i in range(0, len(visit_ids), 500):
+            chunk = visit_ids[i : i + 500]
+            marks = ", ".join("?" * len(chunk))
+            for visit_id, status, error in con.execute(
+                "SELECT visit_id, command_status, error FROM crawl_history "
+                f"WHERE command = 'GetCommand' AND visit_id IN ({marks}) ORDER BY rowid;",
+                chunk,
+            ):
+                out[visit_id] = (status, error, None)
+            ok = [v for v in chunk if v in out and out[v][0] == "ok"]
+            if not ok:
+                continue
+            for visit_id, http_status in con.execute(
+                "SELECT r.visit_id, r.response_status FROM http_responses r "
+                "JOIN http_requests q ON q.visit_id = r.visit_id AND q.request_id = r.request_id "
+                f"WHERE q.resource_type = 'main_frame' AND r.visit_id IN ({', '.join('?' * len(ok))}) "
+                "ORDER BY r.rowid;",
+                ok,
+            ):
+                out[visit_id] = (*out[visit_id][:2], http_status)
+    except sqlite3.OperationalError:
+        # tables not created yet, nothing was written
+        pass
+    finally:
+        con.close()
+    return out
+
+
+class RetryQueue(object):
+    """
+    Failed visits waiting to be retried, each due after an exponential backoff: backoff, backoff * factor, ...
+    A site is visited at most max_attempts times; the permanent failures and the sites out of attempts are kept
+    for the report.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        backoff: float = RETRY_BACKOFF_SECONDS,
+        factor: float = RETRY_BACKOFF_FACTOR,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.factor = factor
+        # (due at, rank, site) heap
+        self._due = []
+        # site -> visits so far
+        self.attempts = {}
+        # site -> kind of its last failure, removed when a retry succeeds
+        self.failures = {}
+        # failed visits per kind, the retries included
+        self.kind_counts = Counter()
+        # sites not retried, because the failure is permanent or they are out of attempts
+        self.given_up = {}
+        # sites whose retry succeeded
+        self.recovered = set()
+
+    def __len__(self) -> int:
+        """Number of retries waiting"""
+        return len(self._due)
+
+    def failed(self, rank: int, site: str, kind: str, retryable: bool) -> bool:
+        """Record a failed visit and schedule its retry if worth it. Returns whether it will be retried"""
+        attempts = self.attempts.get(site, 1)
+        self.failures[site] = kind
+        self.kind_counts[kind] += 1
+        if not retryable or attempts >= self.max_attempts:
+            self.given_up[site] = kind
+            return False
+        delay = self.backoff * self.factor ** (attempts - 1)
+        heapq.heappush(self._due, (time.monotonic() + delay, rank, site))
+        self.attempts[site] = attempts + 1
+        return True
+
+    def succeeded(self, site: str) -> None:
+        """Record a successful visit, a recovery if it was a retry"""
+        if self.failures.pop(site, None) is not None:
+            self.recovered.add(site)
+
+    def seconds_until_next(self) -> Optional[float]:
+        """Seconds until the first retry is due, None if there is none"""
+        if not self._due:
+            return None
+        return max(self._due[0][0] - time.monotonic(), 0.0)
+
+    def pop_due(self) -> list:
+        """(rank, site) of the retries due"""
+        now = time.monotonic()
+        out = []
+        while self._due and self._due[0][0] <= now:
+            _, rank, site = heapq.heappop(self._due)
+            out.append((rank, site))
+        return out
+
+    def summary(self) -> dict:
+        """Failures per kind, retries, recoveries and the sites given up on"""
+        return {
+            "failed_visits_by_kind": dict(self.kind_counts),
+            "retried_sites": sum(a > 1 for a in self.attempts.values()),
+            "recovered_sites": len(self.recovered),
+            "given_up_sites": dict(sorted(self.given_up.items())),
+        }
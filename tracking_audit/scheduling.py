@@ -0,0 +1,83 @@
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from .constants import ACTIVE_STATUS_START, ACTIVE_STATUS_STOP
+
+
+class ActiveWindow(object):
+    """
+    Daily window of hours in which the crawler is allowed to be active.
+    The crawler is active from start_hour:00 until stop_hour:59, e.g. 8 to 19 means 08:00-19:59.
+    """
+
+    def __init__(
+        self,
+        start_hour: int = ACTIVE_STATUS_START,
+        stop_hour: int = ACTIVE_STATUS_STOP,
+    ) -> None:
+        """
+        start_hour: int; first active hour of the day
+        stop_hour: int; last active hour of the day
+        """
+        if not 0 <= start_hour <= stop_hour <= 23:
+            raise ValueError(
+                f"Expected 0 <= start_hour <= stop_hour <= 23, got {start_hour} and {stop_hour}"
+            )
+        self.start_hour = start_hour
+        self.stop_hour = stop_hour
+
+    def is_active(self, now: Optional[datetime] = None) -> bool:
+        """Is the crawler allowed to be active at this time of the day?"""
+        now = now or datetime.now()
+        return self.start_hour <= now.hour <= self.stop_hour
+
+    def next_start(self, now: Optional[datetime] = None) -> datetime:
+        """Start of the next active window, or now if inside one"""
+        now = now or datetime.now()
+        if self.is_active(now):
+            return now
+        start = now.replace(hour=self.start_hour, minute=0, second=0, microsecond=0)
+        if now.hour > self.stop_hour:
+            start += timedelta(days=1)
+        return start
+
+    def closes_at(self, now: Optional[datetime] = None) -> datetime:
+        """End of the current active window, or of the next one if outside a window"""
+        start = self.next_start(now)
+        return start.replace(
+            hour=self.stop_hour, minute=0, second=0, microsecond=0
+        ) + timedelta(hours=1)
+
+    def seconds_until_close(self, now: Optional[datetime] = None) -> float:
+        """Seconds left in the current active window, 0 if outside a window"""
+        now = now or datetime.now()
+        if not self.is_active(now):
+            return 0.0
+        return (self.closes_at(now) - now).total_seconds()
+
+    def next_window_start(self, now: Optional[datetime] = None) -> datetime:
+        """Start of the next active window, skipping the current one if inside a window"""
+        now = now or datetime.now()
+        if self.is_active(now):
+            return self.next_start(self.closes_at(now))
+        return self.next_start(now)
+
+    def sleep_until_next_window(self) -> float:
+        """Sleep until the start of the next active window, return the number of seconds slept"""
+        target = self.next_window_start()
+        slept = 0.0
+        while datetime.now() < target:
+            seconds = max((target - datetime.now()).total_seconds(), 0.0)
+            time.sleep(seconds)
+            slept += seconds
+        return slept
+
+    def sleep_until_active(self) -> float:
+        """Sleep until the next active window starts, return the number of seconds slept"""
+        slept = 0.0
+        # sleep in one go, re-checking afterwards in case of clock adjustments
+        while not self.is_active():
+            seconds = max((self.next_start() - datetime.now()).total_seconds(), 1.0)
+            time.sleep(seconds)
+            slept += seconds
+        return slept
@@ -0,0 +1,216 @@
+import time
+import random
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlsplit
+
+# kinds of synthetic sites
+NORMAL = "normal"
+REDIRECT = "redirect"
+SLOW = "slow"
+DEAD = "dead"
+
+
+def _free_port() -> int:
+    """A local port nothing listens on, for the dead hosts"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SiteFarm(object):
+    """
+    Farm of synthetic "government" websites served by a single local http server, which routes on the Host header.
+    Every host name (the sites and the third-party trackers alike) has to resolve to 127.0.0.1, which firefox does
+    with the browser_prefs() preference, so no DNS and no network is involved:
+        * normal sites set a first-party cookie and embed scripts and pixels of a few tracker hosts, which set
+          third-party cookies, both from the response headers and from javascript
+        * redirecting sites answer with a chain of 301s before the home page
+        * slow sites wait slow_seconds before answering
+        * dead sites point to a port nothing listens on, so the connection is refused
+    The farm is built from a seed, so two benchmarks with the same settings crawl the same sites.
+    """
+
+    def __init__(
+        self,
+        sites: int = 100,
+        trackers: int = 30,
+        trackers_per_site: int = 5,
+        redirect_share: float = 0.1,
+        slow_share: float = 0.1,
+        dead_share: float = 0.05,
+        slow_seconds: float = 5,
+        redirect_hops: int = 2,
+        seed: int = 0,
+    ) -> None:
+        """
+        sites: int; number of synthetic websites
+        trackers: int; number of distinct third-party tracker hosts, a few of them embedded by most sites
+        trackers_per_site: int; trackers embedded by each site
+        redirect_share, slow_share, dead_share: float; share of the sites redirecting, slow and dead
+        slow_seconds: float; seconds a slow site waits before answering
+        redirect_hops: int; 301s before the home page of a redirecting site
+        seed: int; random seed of the farm
+        """
+        rng = random.Random(seed)
+        self.slow_seconds = slow_seconds
+        self.redirect_hops = redirect_hops
+        self.tracker_hosts = [f"sitefarm-tracker-{j}.com" for j in range(trackers)]
+        # a few trackers are everywhere, as on the real sites
+        weights = [1 / (j + 1) for j in range(trackers)]
+        # host -> (kind, trackers embedded)
+        self.sites = {}
+        for i in range(sites):
+            draw = rng.random()
+            if draw < dead_share:
+                kind = DEAD
+            elif draw < dead_share + slow_share:
+                kind = SLOW
+            elif draw < dead_share + slow_share + redirect_share:
+                kind = REDIRECT
+            else:
+                kind = NORMAL
+            embedded = set()
+            while len(embedded) < min(trackers_per_site, trackers):
+                embedded.add(rng.choices(self.tracker_hosts, weights=weights)[0])
+            self.sites[f"www.sitefarm-municipio-{i}.pt"] = (kind, sorted(embedded))
+        self._server = None
+        self._thread = None
+        self.port = None
+        self.dead_port = _free_port()
+        # requests served, by kind of host
+        self.requests = {"site": 0, "tracker": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def browser_prefs() -> dict:
+        """Firefox preferences resolving every host name to the farm"""
+        return {"network.dns.forceResolve": "127.0.0.1"}
+
+    def urls(self) -> list:
+        """Urls of the sites of the farm, in order"""
+        if self.port is None:
+            raise RuntimeError("Start the site farm before asking for its urls")
+        out = []
+        for host, (kind, _) in self.sites.items():
+            port = self.dead_port if kind == DEAD else self.port
+            out.append(f"http://{host}:{port}/")
+        return out
+
+    def kinds(self) -> dict:
+        """Number of sites of each kind"""
+        counts = {}
+        for kind, _ in self.sites.values():
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def start(self, port: int = 0) -> "SiteFarm":
+        """Serve the farm from a background thread, on a free port by default"""
+        farm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, as real servers do
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                farm._handle(self)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"[+] Site farm of {len(self.sites)} websites on port {self.port}: {self.kinds()}")
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "SiteFarm":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _handle(self, request: BaseHTTPRequestHandler) -> None:
+        host = (request.headers.get("Host") or "").split(":")[0]
+        path = urlsplit(request.path).path
+        if host in self.sites:
+            with self._lock:
+                self.requests["site"] += 1
+            self._serve_site(request, host, path)
+        elif host in self.tracker_hosts:
+            with self._lock:
+                self.requests["tracker"] += 1
+            self._serve_tracker(request, host, path)
+        else:
+            self._send(request, 404, b"unknown host", "text/plain")
+
+    def _serve_site(self, request: BaseHTTPRequestHandler, host: str, path: str) -> None:
+        kind, embedded = self.sites[host]
+        if kind == REDIRECT and (path == "/" or path.startswith("/hop/")):
+            hop = int(path.rsplit("/", 1)[-1]) if path.startswith("/hop/") else 0
+            location = f"/hop/{hop + 1}" if hop + 1 < self.redirect_hops else "/inicio"
+            self._send(request, 301, b"", "text/html", headers={"Location": location})
+            return
+        if path not in ("/", "/inicio"):
+            self._send(request, 404, b"not found", "text/plain")
+            return
+        if kind == SLOW:
+            time.sleep(self.slow_seconds)
+        scripts = "".join(
+            f'<script src="http://{tracker}:{self.port}/t.js?site={host}"></script>' for tracker in embedded
+        )
+        pixels = "".join(
+            f'<img src="http://{tracker}:{self.port}/pixel.gif?site={host}" width="1" height="1">'
+            for tracker in embedded
+        )
+        body = (
+            f"<!DOCTYPE html><html lang='pt'><head><title>{host}</title>{scripts}</head>"
+            f"<body><h1>{host}</h1>" + "<p>Serviços públicos online.</p>" * 50 + f"{pixels}</body></html>"
+        ).encode("utf-8")
+        self._send(
+            request,
+            200,
+            body,
+            "text/html; charset=utf-8",
+            headers={"Set-Cookie": f"sessao={random.getrandbits(64):x}; Path=/; Max-Age=86400"},
+        )
+
+    def _serve_tracker(self, request: BaseHTTPRequestHandler, host: str, path: str) -> None:
+        cookie = {"Set-Cookie": f"uid={random.getrandbits(64):x}; Path=/; Max-Age=31536000; SameSite=None"}
+        if path == "/t.js":
+            body = (
+                f'document.cookie = "_{host.split(".")[0].replace("-", "_")}={random.getrandbits(32):x}; path=/; max-age=31536000";'
+                'navigator.userAgent; screen.width; new Date().getTimezoneOffset();'
+            ).encode("utf-8")
+            self._send(request, 200, body, "application/javascript", headers=cookie)
+        elif path == "/pixel.gif":
+            body = b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+            self._send(request, 200, body, "image/gif", headers=cookie)
+        else:
+            self._send(request, 404, b"not found", "text/plain")
+
+    @staticmethod
+    def _send(
+        request: BaseHTTPRequestHandler,
+        status: int,
+        body: bytes,
+        content_type: str,
+        headers: Optional[dict] = None,
+    ) -> None:
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
@@ -0,0 +1,244 @@
+import os
+import json
+import sqlite3
+from collections import defaultdict
+from typing import Iterable, Optional
+from .metrics import _percentile
+from .constants import (
+    GET_REQUEST_TIMEOUT,
+    ADAPTIVE_TIMEOUT_PERCENTILE,
+    ADAPTIVE_TIMEOUT_MARGIN,
+    ADAPTIVE_TIMEOUT_FLOOR_SECONDS,
+    ADAPTIVE_TIMEOUT_CAP_SECONDS,
+    ADAPTIVE_TIMEOUT_MIN_VISITS,
+    ADAPTIVE_TIMEOUT_SLOW_SHARE,
+    ADAPTIVE_TIMEOUT_HISTORY,
+)
+
+# crawl_history.command_status of a command killed by its timeout
+TIMEOUT_STATUS = "timeout"
+
+
+def audit_db_path(path: str) -> str:
+    """Path to the sqlite database of an audit given its output directory, or the path itself if it is a file"""
+    if os.path.isdir(path):
+        return os.path.join(path, f"{os.path.basename(os.path.normpath(path))}.sqlite")
+    return path
+
+
+def _column_names(con: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in con.execute(f"PRAGMA table_info({table});")}
+
+
+def get_command_history(db_path: str) -> Iterable[tuple]:
+    """
+    (site_url, load_seconds, timed_out) of every GetCommand of an audit database or of a warehouse.
+    The load seconds are the duration of the command without the sleep after the page loaded.
+    """
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        # the warehouse holds the visits of many audits, whose visit_ids may repeat
+        same_audit = (
+            " AND v.audit_id = c.audit_id"
+            if "audit_id" in _column_names(con, "crawl_history")
+            and "audit_id" in _column_names(con, "site_visits")
+            else ""
+        )
+        rows = con.execute(
+            "SELECT v.site_url, c.duration, c.arguments, c.command_status FROM crawl_history c "
+            f"JOIN site_visits v ON v.visit_id = c.visit_id{same_audit} "
+            "WHERE c.command = 'GetCommand' AND c.duration IS NOT NULL;"
+        )
+        for site_url, duration, arguments, status in rows:
+            yield site_url, _load_seconds(duration, arguments), status == TIMEOUT_STATUS
+    finally:
+        con.close()
+
+
+def _load_seconds(duration: float, arguments: Optional[str]) -> float:
+    """Seconds a GetCommand took to load the page: its duration (ms) without the sleep after loading"""
+    try:
+        sleep = float(json.loads(arguments).get("sleep") or 0)
+    except (TypeError, ValueError, AttributeError):
+        sleep = 0.0
+    return max(duration / 1000 - sleep, 0.0)
+
+
+def visit_commands(db_path: str, visit_ids: Iterable[int]) -> dict:
+    """
+    Outcome of the commands of visits from their crawl_history, visit_id -> {get_seconds, command_status, error,
+    failed_commands}: the page load seconds, status and error of the GetCommand, and the (command, status, error)
+    of every command that did not end ok. Visits whose crawl_history was not written yet are missing.
+    """
+    visit_ids = list(visit_ids)
+    out = {}
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=60)
+    try:
+        # sqlite limits the number of parameters of a query
+        for i in range(0, len(visit_ids), 500):
+            chunk = visit_ids[i : i + 500]
+            for visit_id, command, status, error, duration, arguments in con.execute(
+                "SELECT visit_id, command, command_status, error, duration, arguments FROM crawl_history "
+                f"WHERE visit_id IN ({', '.join('?' * len(chunk))}) ORDER BY rowid;",
+                chunk,
+            ):
+                visit = out.setdefault(
+                    visit_id,
+                    {"get_seconds": None, "command_status": None, "error": None, "failed_commands": []},
+                )
+                if command == "GetCommand":
+                    visit["command_status"] = status
+                    visit["error"] = error
+                    if duration is not None:
+                        visit["get_seconds"] = round(_load_seconds(duration, arguments), 3)
+                if status != "ok":
+                    visit["failed_commands"].append({"command": command, "status": status, "error": error})
+    except sqlite3.OperationalError:
+        # crawl_history not created yet, nothing was written
+        pass
+    finally:
+        con.close()
+    return out
+
+
+class SiteTimeouts(object):
+    """
+    Per-site GetCommand timeouts learned from the page loads of previous audits. A site with enough history gets
+    a high percentile of its past loads (times a margin, within a floor and a cap) plus the dwell of the visit;
+    a site timing out in most of its past visits is known-slow and gets the cap. The other sites keep the fixed
+    GET_REQUEST_TIMEOUT.
+    """
+
+    def __init__(
+        self,
+        percentile: float = ADAPTIVE_TIMEOUT_PERCENTILE,
+        margin: float = ADAPTIVE_TIMEOUT_MARGIN,
+        floor: float = ADAPTIVE_TIMEOUT_FLOOR_SECONDS,
+        cap: float = ADAPTIVE_TIMEOUT_CAP_SECONDS,
+        min_visits: int = ADAPTIVE_TIMEOUT_MIN_VISITS,
+    ) -> None:
+        self.percentile = percentile
+        self.margin = margin
+        self.floor = floor
+        self.cap = cap
+        self.min_visits = min_visits
+        # site_url -> [[load seconds, timed out], ...], oldest first
+        self.history = defaultdict(list)
+        # page load budgets, computed on first use
+        self._budgets = {}
+
+    def add(self, rows: Iterable[tuple]) -> None:
+        """Add (site_url, load_seconds, timed_out) observations"""
+        for site_url, load_seconds, timed_out in rows:
+            self.history[site_url].append([round(load_seconds, 3), bool(timed_out)])
+        self._budgets.clear()
+
+    @classmethod
+    def from_history(cls, paths: Iterable[str], **kwargs) -> "SiteTimeouts":
+        """
+        Learn the timeouts from previous audits.
+            paths: output directories or sqlite databases of audits, warehouses, or json stats files (see save)
+        """
+        timeouts = cls(**kwargs)
+        for path in paths:
+            if str(path).endswith(".json"):
+                timeouts.load(path)
+            else:
+                timeouts.add(get_command_history(audit_db_path(path)))
+        return timeouts
+
+    def load(self, path: str) -> None:
+        """Add the observations of a json stats file, if it exists"""
+        if not os.path.isfile(path):
+            return
+        with open(path, "r") as f:
+            stats = json.load(f)
+        self.add(
+            (site_url, load_seconds, timed_out)
+            for site_url, loads in stats.items()
+            for load_seconds, timed_out in loads
+        )
+
+    def save(self, path: str, keep: int = ADAPTIVE_TIMEOUT_HISTORY) -> None:
+        """Write the last observations of each site to a json stats file, shared by the next audits"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({site: loads[-keep:] for site, loads in self.history.items()}, f)
+        os.replace(tmp_path, path)
+
+    def known_slow(self, site_url: str) -> bool:
+        """Did the site time out in most of its past visits?"""
+        loads = self.history.get(site_url, ())
+        if len(loads) < self.min_visits:
+            return False
+        return sum(timed_out for _, timed_out in loads) / len(loads) >= ADAPTIVE_TIMEOUT_SLOW_SHARE
+
+    def budget(self, site_url: str) -> Optional[float]:
+        """Seconds allowed for loading the page, None without enough history"""
+        if site_url not in self._budgets:
+            loads = self.history.get(site_url, ())
+            budget = None
+            if len(loads) >= self.min_visits:
+                if self.known_slow(site_url):
+                    budget = self.cap
+                else:
+                    # a timed out load only says the page took longer than that, so it counts as the cap
+                    seconds = [self.cap if timed_out else s for s, timed_out in loads]
+                    budget = min(max(self.margin * _percentile(seconds, self.percentile), self.floor), self.cap)
+            self._budgets[site_url] = budget
+        return self._budgets[site_url]
+
+    def timeout(self, site_url: str, dwell: float) -> float:
+        """GetCommand timeout of a visit, the fixed GET_REQUEST_TIMEOUT for the sites without enough history"""
+        budget = self.budget(site_url)
+        if budget is None:
+            return GET_REQUEST_TIMEOUT
+        return round(budget + dwell, 3)
+
+    def max_budget(self) -> float:
+        """Longest page load budget a visit can get, without the dwell"""
+        return max(GET_REQUEST_TIMEOUT, self.cap)
+
+    def summary(self, sites: Iterable[str]) -> dict:
+        """Sites with their own timeout and known-slow sites among the sites to visit"""
+        sites = list(sites)
+        return {
+            "sites_with_history": sum(self.budget(s) is not None for s in sites),
+            "known_slow_sites": sorted(s for s in sites if self.known_slow(s)),
+        }
+
+
+def timeout_savings(db_path: str, timeouts_used: dict) -> dict:
+    """
+    Wall-clock time saved by the adaptive timeouts in an audit, against the fixed GET_REQUEST_TIMEOUT.
+    A timed out visit saved (or, for slow sites, spent) the difference between both timeouts; a successful visit
+    longer than the fixed timeout would have timed out without the adaptive one.
+        timeouts_used: dict; site_url -> adaptive GetCommand timeout of its visit
+    """
+    saved = 0.0
+    timed_out = 0
+    rescued = 0
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = con.execute(
+            "SELECT v.site_url, c.duration, c.command_status FROM crawl_history c "
+            "JOIN site_visits v ON v.visit_id = c.visit_id "
+            "WHERE c.command = 'GetCommand';"
+        ).fetchall()
+    finally:
+        con.close()
+    for site_url, duration, status in rows:
+        used = timeouts_used.get(site_url)
+        if used is None:
+            continue
+        if status == TIMEOUT_STATUS:
+            timed_out += 1
+            saved += GET_REQUEST_TIMEOUT - used
+        elif duration is not None and duration / 1000 > GET_REQUEST_TIMEOUT:
+            rescued += 1
+    return {
+        "adaptive_visits": len(timeouts_used),
+        "timed_out_visits": timed_out,
+        "seconds_saved": round(saved, 1),
+        "visits_longer_than_fixed_timeout": rescued,
+    }
@@ -0,0 +1,517 @@
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+from typing import Iterable, Optional
+from .labelling import LABEL_CACHE_SIZE, authority_prefix, host_registered_domain
+from .utils import url_host
+
+# column of http_requests the category (filter list name) of the matching list is written to, NULL for non trackers
+TRACKER_COLUMN = "tracker_category"
+# requests classified at a time
+CLASSIFY_CHUNK_ROWS = 50_000
+
+# adblock plus resource type options -> webRequest resource types, as recorded in http_requests.resource_type
+RESOURCE_TYPES = {
+    "script": ("script",),
+    "image": ("image", "imageset"),
+    "stylesheet": ("stylesheet",),
+    "css": ("stylesheet",),
+    "object": ("object", "object_subrequest"),
+    "xmlhttprequest": ("xmlhttprequest",),
+    "xhr": ("xmlhttprequest",),
+    "subdocument": ("sub_frame",),
+    "frame": ("sub_frame",),
+    "document": ("main_frame",),
+    "doc": ("main_frame",),
+    "ping": ("ping", "beacon"),
+    "media": ("media",),
+    "font": ("font",),
+    "websocket": ("websocket",),
+    "other": ("other", "xslt", "xml_dtd", "csp_report", "web_manifest", "speculative"),
+}
+# options that do not change which requests a filter matches
+IGNORED_OPTIONS = {"important", "all"}
+
+# adblock plus separator: anything but a letter, a digit or one of _ - . %, or the end of the url
+_SEPARATOR_REGEX = r"(?:[^A-Za-z0-9_.%-]|$)"
+# start of a url up to where a || (domain anchor) filter starts matching
+_DOMAIN_ANCHOR_REGEX = r"^[A-Za-z][A-Za-z0-9+.-]*:/+(?:[^/?#]*\.)?"
+# urls and filters are indexed by their tokens
+_TOKEN_REGEX = re.compile(r"[a-z0-9%]+")
+# hostname at the start of a || filter
+_HOST_PATTERN_REGEX = re.compile(r"[a-z0-9-]+(?:\.[a-z0-9-]+)*")
+
+_prefix_host = lru_cache(maxsize=LABEL_CACHE_SIZE)(url_host)
+
+
+class Filter(object):
+    """One network filter of an EasyList/EasyPrivacy (adblock plus syntax) list"""
+
+    def __init__(self, text: str, category: str) -> None:
+        """
+        text: str; the filter as written in the list, e.g. ||google-analytics.com^$third-party
+        category: str; name of the list the filter belongs to
+        Raises ValueError for filters the matcher does not support (cosmetic filters, unknown options, ...).
+        """
+        self.text = text
+        self.category = category
+        self.exception = text.startswith("@@")
+        pattern = text[2:] if self.exception else text
+        options = ""
+        # $ separates the options, unless the filter is a regular expression ending with /
+        dollar = pattern.rfind("$")
+        if dollar >= 0 and not (pattern.startswith("/") and pattern.endswith("/")):
+            pattern, options = pattern[:dollar], pattern[dollar + 1 :]
+        self.match_case = False
+        self.third_party = None
+        self.types = set()
+        self.excluded_types = set()
+        self.domains = set()
+        self.excluded_domains = set()
+        for option in filter(None, options.lower().split(",")):
+            negated = option.startswith("~")
+            name = option.lstrip("~")
+            if name in ("third-party", "3p"):
+                self.third_party = not negated
+            elif name in ("first-party", "1p"):
+                self.third_party = negated
+            elif name == "match-case":
+                self.match_case = not negated
+            elif name in RESOURCE_TYPES:
+                (self.excluded_types if negated else self.types).update(
+                    RESOURCE_TYPES[name]
+                )
+            elif option.startswith(("domain=", "from=")):
+                for domain in option.split("=", 1)[1].split("|"):
+                    if domain.startswith("~"):
+                        self.excluded_domains.add(domain[1:])
+                    elif domain:
+                        self.domains.add(domain)
+            elif name not in IGNORED_OPTIONS:
+                raise ValueError(f"Unsupported option '{option}'")
+        if not self.match_case:
+            pattern = pattern.lower()
+        self.pattern = pattern
+        self.is_regex = len(pattern) > 1 and pattern.startswith("/") and pattern.endswith("/")
+        self.domain_anchor = not self.is_regex and pattern.startswith("||")
+        self.start_anchor = not self.is_regex and not self.domain_anchor and pattern.startswith("|")
+        self.end_anchor = not self.is_regex and pattern.endswith("|") and len(pattern) > 1
+        self.body = pattern if self.is_regex else pattern.lstrip("|").rstrip("|")
+        if not self.is_regex:
+            self.body = self.body.strip("*") if not self.domain_anchor else self.body.rstrip("*")
+        if not self.body and not (self.types or self.domains or self.third_party is not None):
+            raise ValueError("Filter matching every request")
+        # || filters starting with a whole hostname are looked up by host instead of by token
+        self.host = None
+        self.host_only = False
+        if self.domain_anchor:
+            host = _HOST_PATTERN_REGEX.match(self.body)
+            rest = self.body[host.end() :] if host else None
+            if host and (rest == "" and self.end_anchor or rest[:1] in ("^", "/", ":")):
+                self.host = host.group()
+                # ||example.com^ needs no regex, the host lookup is the match
+                self.host_only = rest == "^" and not self.end_anchor
+        self._regex = None
+
+    @property
+    def regex(self) -> re.Pattern:
+        """Regular expression of the filter, compiled the first time it is needed"""
+        if self._regex is None:
+            if self.is_regex:
+                regex = self.body[1:-1]
+            else:
+                regex = "".join(
+                    ".*" if c == "*" else _SEPARATOR_REGEX if c == "^" else re.escape(c)
+                    for c in self.body
+                )
+                if self.domain_anchor:
+                    regex = _DOMAIN_ANCHOR_REGEX + regex
+                elif self.start_anchor:
+                    regex = "^" + regex
+                if self.end_anchor:
+                    regex += "$"
+            self._regex = re.compile(regex, 0 if self.match_case else re.IGNORECASE)
+        return self._regex
+
+    def tokens(self) -> list:
+        """Tokens of the filter that every matching url contains as a whole token"""
+        if self.host:
+            return []
+        if self.is_regex:
+            return _regex_tokens(self.body[1:-1].lower())
+        tokens = []
+        for m in _TOKEN_REGEX.finditer(self.body.lower()):
+            start, end = m.span()
+            # a token next to a wildcard or an unanchored end may be part of a longer url token
+            left = self.body[start - 1] != "*" if start else self.start_anchor or self.domain_anchor
+            right = self.body[end] != "*" if end < len(self.body) else self.end_anchor
+            if left and right:
+                tokens.append(m.group())
+        return tokens
+
+    def applies(self, resource_type: Optional[str], third_party: Optional[bool], site_host: str) -> bool:
+        """Whether the options of the filter allow it to match a request"""
+        if self.types and resource_type not in self.types:
+            return False
+        if self.excluded_types and resource_type in self.excluded_types:
+            return False
+        if self.third_party is not None and third_party is not None and self.third_party != third_party:
+            return False
+        if self.domains or self.excluded_domains:
+            suffixes = _host_suffixes(site_host)
+            if self.excluded_domains and not self.excluded_domains.isdisjoint(suffixes):
+                return False
+            if self.domains and self.domains.isdisjoint(suffixes):
+                return False
+        return True
+
+    def matches(self, url: str, resource_type: Optional[str], third_party: Optional[bool], site_host: str) -> bool:
+        """Whether the filter matches a request, tested without any index"""
+        if not self.applies(resource_type, third_party, site_host):
+            return False
+        if self.host_only:
+            return self.host in _host_suffixes(_prefix_host(authority_prefix(url)))
+        return not self.body or self.regex.search(url) is not None
+
+    def __repr__(self) -> str:
+        return f"Filter({self.text!r}, {self.category!r})"
+
+
+def _regex_tokens(regex: str) -> list:
+    """
+    Tokens every url matching a regular expression filter contains as a whole token, e.g. /-123\\.[a-z]+\\.js/ -> [123].
+    Only runs of literal characters bounded by literal separators are kept; regexes with groups or alternatives have none.
+    """
+    if "|" in regex or "(" in regex:
+        return []
+    # each atom is a literal character or None for anything else (classes, ., escapes like \d, repeated atoms)
+    atoms = []
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        if c == "\\" and i + 1 < len(regex):
+            nxt = regex[i + 1]
+            atoms.append(None if nxt.isalnum() else nxt)
+            i += 2
+        elif c == "[":
+            end = regex.find("]", i + 2)
+            if end < 0:
+                return []
+            atoms.append(None)
+            i = end + 1
+        elif c in "*+?{":
+            if atoms:
+                atoms[-1] = None
+            # skip the rest of a {m,n} quantifier
+            i = regex.find("}", i) + 1 if c == "{" else i + 1
+            if i == 0:
+                return []
+        elif c in ".^$":
+            atoms.append(None)
+            i += 1
+        else:
+            atoms.append(c)
+            i += 1
+    tokens = []
+    run = ""
+    # None on the left: the regex is not anchored, the first token may be part of a longer one
+    bounded = False
+    for atom in atoms + [None]:
+        if atom is not None and _TOKEN_REGEX.fullmatch(atom):
+            run += atom
+            continue
+        if run and bounded and atom is not None:
+            tokens.append(run)
+        run = ""
+        bounded = atom is not None
+    return tokens
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def _host_suffixes(host: str) -> tuple:
+    """A host and its parent domains, e.g. a.b.pt -> (a.b.pt, b.pt, pt)"""
+    labels = host.split(".")
+    return tuple(".".join(labels[i:]) for i in range(len(labels)))
+
+
+class FilterIndex(object):
+    """
+    Filters indexed so that a url is only tested against the few filters that can match it:
+    by host for ||host filters, by their rarest token for the others, and linearly for those without any token.
+    """
+
+    def __init__(self) -> None:
+        self.by_host = {}
+        self.by_token = {}
+        self.generic = []
+        self.size = 0
+
+    def add(self, f: Filter) -> None:
+        self.size += 1
+        if f.host:
+            self.by_host.setdefault(f.host, []).append(f)
+            return
+        tokens = f.tokens()
+        if not tokens:
+            self.generic.append(f)
+            return
+        # the rarest token so far, the longest one on ties
+        token = min(tokens, key=lambda t: (len(self.by_token.get(t, ())), -len(t)))
+        self.by_token.setdefault(token, []).append(f)
+
+    def match(
+        self,
+        url: str,
+        host_suffixes: tuple,
+        url_tokens: Iterable[str],
+        resource_type: Optional[str],
+        third_party: Optional[bool],
+        site_host: str,
+    ) -> Optional[Filter]:
+        """First filter matching a request, None if none does"""
+        for host in host_suffixes:
+            for f in self.by_host.get(host, ()):
+                if f.applies(resource_type, third_party, site_host) and (
+                    f.host_only or f.regex.search(url)
+                ):
+                    return f
+        for token in url_tokens:
+            for f in self.by_token.get(token, ()):
+                if f.applies(resource_type, third_party, site_host) and f.regex.search(url):
+                    return f
+        for f in self.generic:
+            if f.applies(resource_type, third_party, site_host) and (
+                not f.body or f.regex.search(url)
+            ):
+                return f
+        return None
+
+
+class TrackerMatcher(object):
+    """
+    Classify requests with EasyList/EasyPrivacy-style filter lists, compiled into token-indexed filters.
+    A request is a tracker when a blocking filter of a list matches it and no exception filter (@@) does;
+    its category is the name of the first list with a matching filter.
+    """
+
+    def __init__(self) -> None:
+        self.categories = []
+        self.blocking = {}
+        self.exceptions = FilterIndex()
+        # @@...$document exceptions allow every request of the pages they match
+        self.page_exceptions = FilterIndex()
+        self.filters = []
+        self.skipped = 0
+        self._allowed_pages = {}
+
+    @classmethod
+    def from_files(cls, filter_lists: dict) -> "TrackerMatcher":
+        """
+        filter_lists: dict; category -> path of the filter list, e.g. {"easyprivacy": "resources/filter_lists/easyprivacy.txt"}.
+                      The lists are tried in this order.
+        """
+        matcher = cls()
+        for category, path in filter_lists.items():
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                matcher.add_list(category, f)
+        return matcher
+
+    def add_list(self, category: str, lines: Iterable[str]) -> None:
+        """Add the network filters of a list, skipping comments, cosmetic filters and unsupported options"""
+        if category not in self.blocking:
+            self.categories.append(category)
+            self.blocking[category] = FilterIndex()
+        for line in lines:
+            line = line.strip()
+            # comments, header and cosmetic (element hiding, scriptlet) filters
+            if not line or line.startswith(("!", "[")) or "##" in line or "#@#" in line or "#?#" in line or "#$#" in line:
+                continue
+            try:
+                f = Filter(line, category)
+            except ValueError:
+                self.skipped += 1
+                continue
+            self.filters.append(f)
+            if not f.exception:
+                self.blocking[category].add(f)
+            elif f.types == set(RESOURCE_TYPES["document"]):
+                f.types = set()
+                self.page_exceptions.add(f)
+            else:
+                self.exceptions.add(f)
+
+    def classify(
+        self, url: str, resource_type: Optional[str] = None, site_url: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Category of a request, None if it is not a tracker.
+            url: str; http_requests.url
+            resource_type: str; http_requests.resource_type, e.g. script, image, xmlhttprequest
+            site_url: str; site_visits.site_url of the visit, for the third-party and domain options
+        """
+        if not url:
+            return None
+        host_suffixes = _host_suffixes(_prefix_host(authority_prefix(url)))
+        site_host = _prefix_host(authority_prefix(site_url)) if site_url else ""
+        third_party = (
+            host_registered_domain(host_suffixes[0]) != host_registered_domain(site_host)
+            if site_host and host_suffixes[0]
+            else None
+        )
+        url_tokens = set(_TOKEN_REGEX.findall(url.lower()))
+        for category in self.categories:
+            if self.blocking[category].match(
+                url, host_suffixes, url_tokens, resource_type, third_party, site_host
+            ):
+                break
+        else:
+            return None
+        if self.exceptions.match(
+            url, host_suffixes, url_tokens, resource_type, third_party, site_host
+        ):
+            return None
+        if site_host and self._page_allowed(site_url, site_host):
+            return None
+        return category
+
+    def _page_allowed(self, site_url: str, site_host: str) -> bool:
+        """Whether a @@...$document exception matches the site visited"""
+        if site_url not in self._allowed_pages:
+            self._allowed_pages[site_url] = (
+                self.page_exceptions.match(
+                    site_url,
+                    _host_suffixes(site_host),
+                    set(_TOKEN_REGEX.findall(site_url.lower())),
+                    None,
+                    False,
+                    site_host,
+                )
+                is not None
+            )
+        return self._allowed_pages[site_url]
+
+
+# matcher of each worker process, compiled once by _init_worker
+_WORKER_MATCHER = None
+
+
+def _init_worker(filter_lists: dict) -> None:
+    global _WORKER_MATCHER
+    _WORKER_MATCHER = TrackerMatcher.from_files(filter_lists)
+
+
+def _classify_rows(rows: list, matcher: Optional[TrackerMatcher] = None) -> list:
+    """(category, rowid) of the trackers among (rowid, url, resource_type, site_url) rows"""
+    classify = (matcher or _WORKER_MATCHER).classify
+    out = []
+    for rowid, url, resource_type, site_url in rows:
+        category = classify(url, resource_type, site_url)
+        if category:
+            out.append((category, rowid))
+    return out
+
+
+def _column_names(con: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in con.execute(f"PRAGMA table_info({table});")}
+
+
+def classify_requests(
+    db_path: str,
+    filter_lists: dict,
+    workers: Optional[int] = None,
+    chunk_rows: int = CLASSIFY_CHUNK_ROWS,
+    executor: Optional[ProcessPoolExecutor] = None,
+) -> dict:
+    """
+    Classify the http_requests of an audit database (or of a warehouse, see warehouse.py) and write the category of
+    each tracker to its tracker_category column, NULL for the other requests. The requests are read in chunks by
+    rowid and, with workers > 1, classified by a process pool while this process writes the results back.
+        filter_lists: dict; category -> path of the filter list, see TrackerMatcher.from_files
+        workers: int; number of classifying processes, the requests are classified in this process if not > 1
+        executor: ProcessPoolExecutor; pool set up with _init_worker, to share it across databases (see classify_audits)
+    Returns the number of requests per category, with the total number of requests under "requests".
+    """
+    con = sqlite3.connect(db_path, timeout=60)
+    own_executor = None
+    try:
+        columns = _column_names(con, "http_requests")
+        if TRACKER_COLUMN not in columns:
+            con.execute(f"ALTER TABLE http_requests ADD COLUMN {TRACKER_COLUMN} TEXT;")
+        con.execute(f"UPDATE http_requests SET {TRACKER_COLUMN} = NULL;")
+        con.commit()
+        # the warehouse holds the visits of many audits, whose visit_ids may repeat
+        same_audit = (
+            " AND s.audit_id = r.audit_id"
+            if "audit_id" in columns and "audit_id" in _column_names(con, "site_visits")
+            else ""
+        )
+        query = (
+            "SELECT r.rowid, r.url, r.resource_type, s.site_url FROM http_requests r "
+            f"LEFT JOIN site_visits s ON s.visit_id = r.visit_id{same_audit} "
+            "WHERE r.rowid > ? ORDER BY r.rowid LIMIT ?;"
+        )
+        matcher = None
+        if executor is None and workers and workers > 1:
+            executor = own_executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(filter_lists,)
+            )
+        elif executor is None:
+            matcher = TrackerMatcher.from_files(filter_lists)
+        counts = {"requests": 0}
+
+        def write(results: list) -> None:
+            con.executemany(
+                f"UPDATE http_requests SET {TRACKER_COLUMN} = ? WHERE rowid = ?;", results
+            )
+            con.commit()
+            for category, _ in results:
+                counts[category] = counts.get(category, 0) + 1
+
+        last_rowid = 0
+        pending = set()
+        in_flight = 2 * (workers or 1)
+        while True:
+            rows = con.execute(query, (last_rowid, chunk_rows)).fetchall()
+            if rows:
+                last_rowid = rows[-1][0]
+                counts["requests"] += len(rows)
+                if matcher is not None:
+                    write(_classify_rows(rows, matcher))
+                    continue
+                pending.add(executor.submit(_classify_rows, rows))
+            if not pending:
+                break
+            # keep a bounded number of chunks in memory
+            if len(pending) >= in_flight or not rows:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future.result())
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown()
+        con.close()
+    return counts
+
+
+def classify_audits(
+    db_paths: list,
+    filter_lists: dict,
+    workers: Optional[int] = None,
+    chunk_rows: int = CLASSIFY_CHUNK_ROWS,
+) -> dict:
+    """Classify the requests of many audit databases with one process pool, see classify_requests. Returns the counts per database"""
+    if not workers or workers <= 1:
+        return {
+            path: classify_requests(path, filter_lists, chunk_rows=chunk_rows)
+            for path in db_paths
+        }
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(filter_lists,)
+    ) as executor:
+        return {
+            path: classify_requests(
+                path, filter_lists, workers=workers, chunk_rows=chunk_rows, executor=executor
+            )
+            for path in db_paths
+        }
@@ -1,33 +1,68 @@
-import tarfile
-import shutil
-import os
+import sys
+import socket
+from functools import lru_cache
 from typing import Optional
-import requests
-
-## compress dirs or files
-def _tar(files: Optional[list]) -> None:
-    if files:
-        is_file = False
-        for f in files:
-            if os.path.isfile(f) and "tar" not in f:
-                files = [f]
-                is_file = True
-            elif os.path.isdir(f) and "tar" not in f:
-                files = [os.path.join(f, _f) for _f in os.listdir(f)]
-            else:
-                continue
-            tar_filename = f + ".tar.gz"
-            tar = tarfile.open(tar_filename, "w:gz")
-            for name_ in files:
-                tar.add(name_, os.path.basename(name_))
-            tar.close()
-            if is_file:
-                os.remove(f)
-            else:
-                shutil.rmtree(f)
+from urllib.parse import urlsplit
+from .constants import CONFIG_CONSTANTS, read_config
+
+# size of the memo cache of registered domains, keyed by hostname
+LABEL_CACHE_SIZE = 2**18
+
+
+def add_openwpm_to_path() -> None:
+    """Make OpenWPM importable from the path in config.ini, before importing it"""
+    path = read_config().get(*CONFIG_CONSTANTS["PATH_TO_OPENWPM"])
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
 
 def current_location():
     """Given the public IP fetch the current location"""
+    import requests
+
     # get the current ip
     pubip = requests.get("https://ipinfo.io/ip").text
     return requests.get(f"https://ipinfo.io/{pubip}").json()["country"]
+
+
+def url_host(url: str) -> str:
+    """Hostname of a url, also for urls missing the scheme"""
+    if "//" not in url:
+        url = "//" + url
+    return (urlsplit(url).hostname or "").lower()
+
+
+@lru_cache(maxsize=2**14)
+def host_ip(host: str) -> Optional[str]:
+    """Resolve a hostname to one ip address, None if it does not resolve"""
+    try:
+        return socket.gethostbyname(host)
+    except (socket.gaierror, UnicodeError):
+        return None
+
+
+@lru_cache(maxsize=None)
+def _tld_extract():
+    """
+    Offline extractor: uses the public suffix list snapshot bundled with tldextract, never fetching it nor writing
+    a cache. Made on first use, as tldextract is slow to import
+    """
+    import tldextract
+
+    return tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def host_registered_domain(host: str) -> str:
+    """Registered domain (eTLD+1) of a hostname, e.g. www.cm-lisboa.pt -> cm-lisboa.pt. Falls back to the host for ips, localhost, etc."""
+    # cookie hosts have a leading dot for domain cookies
+    host = host.lstrip(".").lower()
+    ext = _tld_extract()(host)
+    if ext.domain and ext.suffix:
+        return f"{ext.domain}.{ext.suffix}"
+    return host
+
+
+def registered_domain(url: str) -> str:
+    """Registered domain (eTLD+1) of a url, e.g. https://www.cm-lisboa.pt/ -> cm-lisboa.pt"""
+    return host_registered_domain(url_host(url))
@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import sqlite3
+from datetime import datetime
+from typing import Iterable, Optional
+from .export import TABLES_TO_EXPORT
+from .utils import url_host
+
+# columns added to every table of the warehouse
+AUDIT_COLUMNS = (
+    ("audit_id", "INTEGER NOT NULL"),
+    ("location", "TEXT"),
+    ("replication", "INTEGER"),
+)
+# tables getting a host column derived from one of their url columns
+HOST_COLUMNS = {
+    "http_requests": "url",
+    "http_responses": "url",
+    "javascript": "script_url",
+}
+# indexes of the warehouse, ordered so that the usual lookups are covered by the index alone
+INDEXES = {
+    "site_visits": [
+        ("audit_id", "visit_id", "site_url"),
+        ("site_url", "audit_id", "visit_id"),
+    ],
+    "crawl_history": [("audit_id", "visit_id", "command")],
+    "http_requests": [
+        ("audit_id", "visit_id"),
+        ("host", "audit_id", "visit_id"),
+    ],
+    "http_responses": [("audit_id", "visit_id")],
+    "http_redirects": [("audit_id", "visit_id")],
+    "javascript": [("audit_id", "visit_id"), ("host", "audit_id", "visit_id")],
+    "javascript_cookies": [
+        ("audit_id", "visit_id"),
+        ("host", "name", "audit_id", "visit_id"),
+    ],
+    "navigations": [("audit_id", "visit_id")],
+    "dns_responses": [("audit_id", "visit_id")],
+}
+# replication number in the audit names made by run-audits.sh, e.g. audit_rep_3_host_pt_202210101010
+_REPLICATION_REGEX = re.compile(r"_rep_(\d+)_")
+
+
+def audit_metadata(audit_dir: str) -> dict:
+    """Name, location and replication of an audit, from its crawl_config.json and directory name"""
+    audit_name = os.path.basename(os.path.normpath(audit_dir))
+    location = None
+    config_path = os.path.join(audit_dir, "crawl_config.json")
+    if os.path.isfile(config_path):
+        with open(config_path, "r") as f:
+            crawl_config = json.load(f)
+        location = crawl_config.get("location")
+    replication = _REPLICATION_REGEX.search(audit_name)
+    return {
+        "audit_name": audit_name,
+        "location": location,
+        "replication": int(replication.group(1)) if replication else None,
+        "db_path": os.path.join(audit_dir, f"{audit_name}.sqlite"),
+    }
+
+
+class Warehouse(object):
+    """
+    Single indexed sqlite database holding the tables of many audits, each row tagged with its audit_id,
+    location and replication. Audits are appended incrementally; the ones already merged are skipped.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        path: str; path to the warehouse sqlite file, created if missing
+        """
+        self.path = str(path)
+        self._conn = sqlite3.connect(self.path, isolation_level=None, uri=True)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        # used to derive the host columns while copying the rows
+        self._conn.create_function("url_host", 1, _safe_url_host, deterministic=True)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS audits (
+                audit_id INTEGER PRIMARY KEY,
+                audit_name TEXT UNIQUE NOT NULL,
+                location TEXT,
+                replication INTEGER,
+                source_path TEXT,
+                merged_at TEXT
+            );
+            """
+        )
+
+    def merged_audits(self) -> set:
+        """Names of the audits already in the warehouse"""
+        return {
+            row[0] for row in self._conn.execute("SELECT audit_name FROM audits;")
+        }
+
+    def _columns(self, schema: str, table: str) -> list:
+        """(name, declared type) of the columns of a table"""
+        return [
+            (name, declared or "")
+            for _, name, declared, *_ in self._conn.execute(
+                f"PRAGMA {schema}.table_info({table});"
+            )
+        ]
+
+    def _ensure_table(self, table: str, source_columns: list) -> None:
+        """Create the warehouse table or add the columns missing from it (e.g. audits of another OpenWPM version)"""
+        existing = {name for name, _ in self._columns("main", table)}
+        if not existing:
+            # primary keys and constraints of the source tables are not kept, ids repeat across audits
+            columns = list(AUDIT_COLUMNS) + [
+                (name, declared.split()[0] if declared else "")
+                for name, declared in source_columns
+            ]
+            if table in HOST_COLUMNS:
+                columns.append(("host", "TEXT"))
+            self._conn.execute(
+                f"CREATE TABLE {table} ("
+                + ", ".join(f'"{name}" {declared}' for name, declared in columns)
+                + ");"
+            )
+            for index_columns in INDEXES.get(table, [("audit_id", "visit_id")]):
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_{'_'.join(index_columns)}_idx "
+                    f"ON {table} ({', '.join(index_columns)});"
+                )
+            return
+        for name, declared in source_columns:
+            if name not in existing:
+                self._conn.execute(
+                    f'ALTER TABLE {table} ADD COLUMN "{name}" {declared.split()[0] if declared else ""};'
+                )
+
+    def merge(
+        self,
+        db_path: str,
+        audit_name: str,
+        location: Optional[str] = None,
+        replication: Optional[int] = None,
+        tables: Iterable[str] = TABLES_TO_EXPORT,
+        replace: bool = False,
+    ) -> Optional[int]:
+        """
+        Append one audit database to the warehouse. Returns its audit_id, or None if it was already merged.
+            replace: bool; merge the audit again, replacing its rows
+        """
+        if audit_name in self.merged_audits():
+            if not replace:
+                return None
+            self.remove(audit_name)
+        self._conn.execute("ATTACH DATABASE ? AS src;", (f"file:{db_path}?mode=ro",))
+        try:
+            source_tables = {
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT name FROM src.sqlite_master WHERE type = 'table';"
+                )
+            }
+            self._conn.execute("BEGIN;")
+            audit_id = self._conn.execute(
+                "INSERT INTO audits (audit_name, location, replication, source_path, merged_at) "
+                "VALUES (?, ?, ?, ?, ?);",
+                (
+                    audit_name,
+                    location,
+                    replication,
+                    os.path.abspath(db_path),
+                    datetime.now().isoformat(timespec="seconds"),
+                ),
+            ).lastrowid
+            for table in tables:
+                if table not in source_tables:
+                    continue
+                source_columns = self._columns("src", table)
+                self._ensure_table(table, source_columns)
+                names = [f'"{name}"' for name, _ in source_columns]
+                select = list(names)
+                if table in HOST_COLUMNS:
+                    names.append('"host"')
+                    select.append(f'url_host("{HOST_COLUMNS[table]}")')
+                self._conn.execute(
+                    f"INSERT INTO {table} (audit_id, location, replication, {', '.join(names)}) "
+                    f"SELECT ?, ?, ?, {', '.join(select)} FROM src.{table};",
+                    (audit_id, location, replication),
+                )
+            self._conn.execute("COMMIT;")
+        except Exception:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK;")
+            raise
+        finally:
+            self._conn.execute("DETACH DATABASE src;")
+        return audit_id
+
+    def merge_audit_dir(self, audit_dir: str, replace: bool = False) -> Optional[int]:
+        """Append the audit in an audit output directory, see merge"""
+        metadata = audit_metadata(audit_dir)
+        if not os.path.isfile(metadata["db_path"]):
+            raise FileNotFoundError(f"No audit database in {audit_dir}")
+        return self.merge(replace=replace, **metadata)
+
+    def remove(self, audit_name: str) -> None:
+        """Delete all the rows of an audit"""
+        row = self._conn.execute(
+            "SELECT audit_id FROM audits WHERE audit_name = ?;", (audit_name,)
+        ).fetchone()
+        if not row:
+            return
+        self._conn.execute("BEGIN;")
+        for table in TABLES_TO_EXPORT:
+            if self._columns("main", table):
+                self._conn.execute(f"DELETE FROM {table} WHERE audit_id = ?;", row)
+        self._conn.execute("DELETE FROM audits WHERE audit_id = ?;", row)
+        self._conn.execute("COMMIT;")
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        """Run a query against the warehouse"""
+        return self._conn.execute(sql, params).fetchall()
+
+    def close(self) -> None:
+        self._conn.execute("PRAGMA optimize;")
+        self._conn.close()
+
+
+def _safe_url_host(url: Optional[str]) -> Optional[str]:
+    if not url:
+        return None
+    try:
+        return url_host(url)
+    except ValueError:
+        return None
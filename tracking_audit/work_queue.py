@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, Tuple
+from .constants import WORK_QUEUE_LEASE_SECONDS
+
+# statuses a site can have in the work queue
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+
+class SQLiteWorkQueue(object):
+    """
+    Work queue shared by several crawler processes (or machines, through a shared volume) splitting one list of websites.
+    Each worker leases a few sites at a time and renews its leases with a heartbeat while visiting them.
+    Leases not renewed in time, e.g. of a crashed worker, go back to the pool.
+    """
+
+    def __init__(
+        self, path: str, worker_id: str, lease_seconds: float = WORK_QUEUE_LEASE_SECONDS
+    ) -> None:
+        """
+        path: str; path to the sqlite file holding the queue, created if missing
+        worker_id: str; unique name of this worker, e.g. hostname + a process index
+        lease_seconds: float; seconds a lease is valid without a heartbeat
+        """
+        self.path = str(path)
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        # sites currently leased by this worker, renewed by the heartbeat
+        self._held = set()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._stop = threading.Event()
+        self._conn = sqlite3.connect(
+            self.path, timeout=60, check_same_thread=False, isolation_level=None
+        )
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS work_queue (
+                site_url TEXT PRIMARY KEY,
+                rank INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                success INTEGER,
+                finished_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS work_queue_status_rank ON work_queue (status, rank);
+            """
+        )
+
+    def populate(self, sites: Iterable[Tuple[int, str]]) -> None:
+        """Add (rank, url) tuples to the queue, sites already in it are left untouched so every worker can call it"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE;")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO work_queue (site_url, rank) VALUES (?, ?);",
+                [(site, rank) for rank, site in sites],
+            )
+            self._conn.execute("COMMIT;")
+
+    def lease(self, n: int = 1) -> list:
+        """Lease up to n pending sites, returned as (rank, url) tuples in rank order"""
+        now = time.time()
+        with self._lock:
+            # take the write lock right away, so two workers can not lease the same sites
+            self._conn.execute("BEGIN IMMEDIATE;")
+            try:
+                # return the expired leases to the pool
+                self._conn.execute(
+                    "UPDATE work_queue SET status = ?, worker_id = NULL, lease_expires = NULL "
+                    "WHERE status = ? AND lease_expires < ?;",
+                    (PENDING, LEASED, now),
+                )
+                rows = self._conn.execute(
+                    "SELECT rank, site_url FROM work_queue WHERE status = ? ORDER BY rank LIMIT ?;",
+                    (PENDING, n),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE work_queue SET status = ?, worker_id = ?, lease_expires = ?, "
+                    "attempts = attempts + 1 WHERE site_url = ?;",
+                    [
+                        (LEASED, self.worker_id, now + self.lease_seconds, site)
+                        for _, site in rows
+                    ],
+                )
+                self._conn.execute("COMMIT;")
+            except Exception:
+                self._conn.execute("ROLLBACK;")
+                raise
+            self._held.update(site for _, site in rows)
+        return rows
+
+    def renew(self) -> None:
+        """Extend the leases of all the sites held by this worker"""
+        with self._lock:
+            if not self._held:
+                return
+            self._conn.executemany(
+                "UPDATE work_queue SET lease_expires = ? "
+                "WHERE site_url = ? AND worker_id = ? AND status = ?;",
+                [
+                    (time.time() + self.lease_seconds, site, self.worker_id, LEASED)
+                    for site in self._held
+                ],
+            )
+
+    def complete(self, site: str, success: bool) -> None:
+        """Mark a leased site as visited"""
+        with self._lock:
+            self._held.discard(site)
+            self._conn.execute(
+                "UPDATE work_queue SET status = ?, success = ?, finished_at = ?, lease_expires = NULL "
+                "WHERE site_url = ?;",
+                (DONE, int(success), datetime.now().isoformat(timespec="seconds"), site),
+            )
+
+    def give_back(self, site: str) -> None:
+        """Return a leased site to the pool without visiting it"""
+        with self._lock:
+            self._held.discard(site)
+            self._conn.execute(
+                "UPDATE work_queue SET status = ?, worker_id = NULL, lease_expires = NULL "
+                "WHERE site_url = ? AND worker_id = ? AND status = ?;",
+                (PENDING, site, self.worker_id, LEASED),
+            )
+
+    def unfinished(self) -> int:
+        """Number of sites pending or leased by any worker"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT count(*) FROM work_queue WHERE status != ?;", (DONE,)
+            ).fetchone()[0]
+
+    def start_heartbeat(self) -> None:
+        """Renew the leases held by this worker in a background thread"""
+        if self._heartbeat:
+            return
+        self._stop.clear()
+
+        def beat() -> None:
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    self.renew()
+                except sqlite3.OperationalError as e:
+                    # database busy, the next beat will try again
+                    print(f"[!] Could not renew the work queue leases: {e}")
+
+        self._heartbeat = threading.Thread(target=beat, daemon=True)
+        self._heartbeat.start()
+
+    def close(self) -> None:
+        """Stop the heartbeat, give back the sites still held and close the connection"""
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+            self._heartbeat = None
+        for site in list(self._held):
+            self.give_back(site)
+        with self._lock:
+            self._conn.close()